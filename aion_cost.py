@@ -0,0 +1,671 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AION 制作成本引擎（与网页计算器同口径）
+输入为 convert_bom 返回的 recipes 字典与物料记录，不依赖 pandas：
+  recipes   : {产品编号: {"calculation_coefficient", "materials": [{"ref"|"id", "qty"}...]}}
+  material  : [{"id", "name", "price"}...]
+单件成本 = Σ 数量 × 计算系数 × (100/成功率) × (原料单价 | 子配方单件成本)，与网页一致逐层累乘。
+expected_costs / monte_carlo 另按每个配方自己的成功率（可按配方或需求等级指定）计算期望成本、方差与分位数。
+"""
+import copy, heapq, math
+from collections import defaultdict
+
+import numpy as np
+
+
+# --------------------  稀疏矩阵 BOM  --------------------
+class CSRMatrix:
+    """最小 CSR 稀疏矩阵，data / indices / indptr 与 scipy.sparse.csr_matrix 同构
+
+    安装了 SciPy 时乘法交给 scipy.sparse，否则用 numpy 分块计算；to_scipy() 可直接转为 csr_matrix。
+    """
+
+    def __init__(self, data, indices, indptr, shape):
+        self.data = np.asarray(data)
+        self.indices = np.asarray(indices, dtype=np.int64)
+        self.indptr = np.asarray(indptr, dtype=np.int64)
+        self.shape = tuple(shape)
+
+    @property
+    def nnz(self):
+        return len(self.data)
+
+    def to_scipy(self):
+        from scipy.sparse import csr_matrix
+        return csr_matrix((self.data, self.indices, self.indptr), shape=self.shape)
+
+    def toarray(self) -> np.ndarray:
+        out = np.zeros(self.shape, dtype=np.result_type(self.data, float))
+        rows = np.repeat(np.arange(self.shape[0]), np.diff(self.indptr))
+        np.add.at(out, (rows, self.indices), self.data)
+        return out
+
+    def dot(self, x, block=1 << 22) -> np.ndarray:
+        """稀疏 × 稠密：x 形状 (列数,) 或 (列数, k)
+
+        无 SciPy 时按行分块：较稠密的矩阵（如展开需求矩阵，非零元占 1/64 以上）每块还原为 行数 × 列数 ≤ block
+        的稠密块交给 BLAS；更稀疏时只取非零元，每块 非零元 × k ≤ block。
+        """
+        x = np.asarray(x, dtype=float)
+        if x.shape[0] != self.shape[1]:
+            raise ValueError(f"维度不匹配: {self.shape} @ {x.shape}")
+        if _scipy_sparse():
+            return self.to_scipy() @ x
+        x2 = x[:, None] if x.ndim == 1 else x
+        out = np.zeros((self.shape[0], x2.shape[1]))
+        n_row, n_col = self.shape
+        if not self.nnz or not x2.size:
+            # 没有非零元、0 列（x 为空）或 k = 0：结果全为 0
+            return out.reshape((n_row,) + x.shape[1:])
+        if self.nnz * 64 >= n_row * n_col:
+            rows = np.repeat(np.arange(n_row), np.diff(self.indptr))
+            step = max(1, block // max(1, n_col))
+            for r0 in range(0, n_row, step):
+                r1 = min(n_row, r0 + step)
+                lo, hi = self.indptr[r0], self.indptr[r1]
+                q = np.bincount((rows[lo:hi] - r0) * n_col + self.indices[lo:hi], self.data[lo:hi].astype(float),
+                                minlength=(r1 - r0) * n_col).reshape(r1 - r0, n_col)
+                out[r0:r1] = q @ x2
+            return out.reshape((n_row,) + x.shape[1:])
+        nz = np.flatnonzero(np.diff(self.indptr))
+        starts = self.indptr[nz]
+        step = max(1, block // max(1, x2.shape[1]))
+        k = 0
+        while k < len(nz):
+            e = max(k + 1, int(np.searchsorted(starts, starts[k] + step)))
+            lo, hi = starts[k], self.indptr[nz[e - 1] + 1]
+            out[nz[k:e]] = np.add.reduceat(self.data[lo:hi, None] * x2[self.indices[lo:hi]], starts[k:e] - lo)
+            k = e
+        return out.reshape((self.shape[0],) + x.shape[1:])
+
+    __matmul__ = dot
+
+
+def _scipy_sparse():
+    """SciPy 为可选依赖：已安装时返回 scipy.sparse，否则返回 None"""
+    try:
+        import scipy.sparse
+    except ImportError:
+        return None
+    return scipy.sparse
+
+
+def bom_triplets(recipes: dict, row_of: dict, col_of: dict):
+    """配方的直接用量（数量 × 计算系数）三元组，产品行号取自 row_of、原料列号取自 col_of
+
+    返回 (子配方边 (父行, 子行, 数量), 原料边 (父行, 原料列, 数量))，均为 numpy 数组；
+    引用了不存在的配方时子行记为 len(row_of)，不在物料表中的原料不计入。
+    """
+    sub, raw = ([], [], []), ([], [], [])
+    missing = len(row_of)
+    for pid, p in recipes.items():
+        r, coef = row_of[pid], p['calculation_coefficient']
+        for m in p['materials']:
+            if 'ref' in m:
+                edge = sub, row_of.get(m['ref'], missing)
+            elif m['id'] in col_of:
+                edge = raw, col_of[m['id']]
+            else:
+                continue
+            (rows, cols, qty), c = edge
+            rows.append(r)
+            cols.append(c)
+            qty.append(m['qty'] * coef)
+    # 用量保持原类型（通常为整数），与逐条展开的结果逐位一致
+    return tuple((np.asarray(rows, dtype=np.int64), np.asarray(cols, dtype=np.int64),
+                  np.asarray(qty) if qty else np.zeros(0, dtype=np.int64)) for rows, cols, qty in (sub, raw))
+
+
+def topo_layers(n, parent, child) -> np.ndarray:
+    """按层剥离产品图：只用原料的产品为第 0 层，第 k 层只引用更低层的产品；环上及其下游的产品记 -1"""
+    layer = np.full(n, -1, dtype=np.int64)
+    pending = np.bincount(parent, minlength=n)
+    frontier = np.flatnonzero(pending == 0)
+    k = 0
+    while len(frontier):
+        layer[frontier] = k
+        mask = np.zeros(n + 1, dtype=bool)
+        mask[frontier] = True
+        pending = pending - np.bincount(parent[mask[child]], minlength=n)
+        frontier = np.flatnonzero((pending == 0) & (layer < 0))
+        k += 1
+    return layer
+
+
+def _flatten_layers(n, sub, raw, layer):
+    """按拓扑分层求展开矩阵 G（列为 (原料, 深度)）：G[L_k] = B[L_k] ⊕ 深度+1(A[L_k] @ G)
+
+    A、B 为 sub、raw 的直接用量；第 k 层只引用已求出的低层行，每层一次向量化的稀疏矩阵乘法。
+    G 按层追加存放，返回每行的 (起点, 长度) 与拼接后的 (列, 深度, 用量)；未分层（-1）的行长度为 0。
+    """
+    sp, sc, sq = sub
+    rp, rc, rq = raw
+    start, length = np.zeros(n + 1, dtype=np.int64), np.zeros(n + 1, dtype=np.int64)
+    dtype = np.result_type(sq, rq)
+    col, depth, qty = np.zeros(0, dtype=np.int64), np.zeros(0, dtype=np.int64), np.zeros(0, dtype=dtype)
+    for k in range(int(layer.max(initial=-1)) + 1):
+        in_k = np.r_[layer == k, False]
+        a, b = np.flatnonzero(in_k[sp]), np.flatnonzero(in_k[rp])
+        # 每条子配方边展开为子配方的整段展开向量，深度 +1
+        cnt = length[sc[a]]
+        rep = np.repeat(a, cnt)
+        pos = np.arange(cnt.sum()) - np.repeat(np.cumsum(cnt) - cnt, cnt) + np.repeat(start[sc[a]], cnt)
+        r = np.concatenate([rp[b], sp[rep]])
+        c = np.concatenate([rc[b], col[pos]])
+        d = np.concatenate([np.ones(len(b), dtype=np.int64), depth[pos] + 1])
+        if dtype == np.int64 and len(rep) and int(np.abs(sq).max()) * int(np.abs(qty[pos]).max()) >= 1 << 63:
+            # 整数用量可能溢出 int64 时改用 Python 整数（object），与逐条展开的结果保持一致
+            dtype, sq, rq, qty = object, sq.astype(object), rq.astype(object), qty.astype(object)
+        q = np.concatenate([rq[b], sq[rep] * qty[pos]]).astype(dtype)
+        # 合并同一 (产品, 原料, 深度)，行内按 (原料, 深度) 排序
+        order = np.lexsort((d, c, r))
+        r, c, d, q = r[order], c[order], d[order], q[order]
+        first = np.flatnonzero(np.r_[True, (r[1:] != r[:-1]) | (c[1:] != c[:-1]) | (d[1:] != d[:-1])])
+        first = first[first < len(r)]
+        q = np.add.reduceat(q, first) if len(first) else q
+        r = r[first]
+        rows = np.flatnonzero(in_k[:n])
+        lo, hi = np.searchsorted(r, rows), np.searchsorted(r, rows, side='right')
+        start[rows], length[rows] = len(col) + lo, hi - lo
+        col, depth, qty = np.concatenate([col, c[first]]), np.concatenate([depth, d[first]]), np.concatenate([qty, q])
+    return start[:n], length[:n], col, depth, qty
+
+
+# --------------------  配方展开（原料用量向量）  --------------------
+def flatten_recipes(recipes: dict, material_ids):
+    """按拓扑顺序把每个产品展开为 (物料, 深度) → 每件用量 的稀疏向量
+
+    深度为从产品到该物料经过的配方层数，即网页成本计算中成功率系数 100/rate 的次数，
+    因此 成本 = Σ 用量 × (100/rate)^深度 × 单价。只统计物料表中存在的原料；
+    无环部分按拓扑分层做稀疏矩阵乘法（_flatten_layers）；循环依赖上及其下游的产品
+    按网页的路径去重规则（同一路径上重复出现的产品记 0）逐条展开。
+    返回 CSR 结构 {cols, rows, ptr, col, depth, qty}。
+    """
+    col_of = {mid: i for i, mid in enumerate(material_ids)}
+    ids = list(recipes)
+    n = len(ids)
+    row_of = {pid: k for k, pid in enumerate(ids)}
+    sub, raw = bom_triplets(recipes, row_of, col_of)
+    layer = topo_layers(n, sub[0], sub[1])
+    start, length, col, depth, qty = _flatten_layers(n, sub, raw, layer)
+
+    rest = np.flatnonzero(layer < 0)
+    if len(rest):
+        # 环上产品的展开结果依赖路径，不能写回 flat 供其他产品复用；只需把它们直接引用的已展开子配方转为字典
+        need = {row_of[m['ref']] for k in rest for m in recipes[ids[k]]['materials'] if m.get('ref') in row_of}
+        flat = {ids[j]: {(int(c), int(d)): q for c, d, q in zip(col[start[j]:start[j] + length[j]],
+                                                                depth[start[j]:start[j] + length[j]],
+                                                                qty[start[j]:start[j] + length[j]].tolist())}
+                for j in need if layer[j] >= 0}
+        paths = [sorted(_flatten_path(ids[k], recipes, col_of, flat, frozenset()).items()) for k in rest]
+        start[rest] = len(col) + np.cumsum([0] + [len(v) for v in paths[:-1]])
+        length[rest] = [len(v) for v in paths]
+        items = [kv for v in paths for kv in v]
+        col = np.concatenate([col, np.asarray([c for (c, _), _ in items], dtype=np.int64)])
+        depth = np.concatenate([depth, np.asarray([d for (_, d), _ in items], dtype=np.int64)])
+        qty = np.concatenate([qty, np.asarray([q for _, q in items], dtype=qty.dtype if items else None)]) if items else qty
+
+    # 各行段按产品顺序拼接为 CSR
+    ptr = np.r_[0, np.cumsum(length)]
+    pos = np.arange(ptr[-1]) - np.repeat(ptr[:-1], length) + np.repeat(start, length)
+    return {"cols": list(material_ids), "rows": row_of, "ptr": ptr.tolist(),
+            "col": col[pos].tolist(), "depth": depth[pos].tolist(), "qty": qty[pos].tolist()}
+
+def _flatten_one(p, col_of, sub_vec):
+    """展开单个配方；sub_vec(ref) 返回子配方向量，返回 None 表示子配方尚不可用"""
+    coef = p['calculation_coefficient']
+    vec = defaultdict(int)
+    for m in p['materials']:
+        qty = m['qty'] * coef
+        if 'ref' in m:
+            sub = sub_vec(m['ref'])
+            if sub is None:
+                return None
+            for (c, d), q in sub.items():
+                vec[(c, d + 1)] += qty * q
+        elif m['id'] in col_of:
+            vec[(col_of[m['id']], 1)] += qty
+    return dict(vec)
+
+def _flatten_path(pid, recipes, col_of, flat, visited):
+    """循环依赖产品：按路径展开，已在拓扑序中展开的子配方直接复用"""
+    if pid in visited or pid not in recipes:
+        return {}
+    if pid in flat:
+        return flat[pid]
+    visited = visited | {pid}
+    return _flatten_one(recipes[pid], col_of,
+                        lambda ref: flat[ref] if ref in flat else _flatten_path(ref, recipes, col_of, flat, visited))
+
+
+# --------------------  成本引擎  --------------------
+class CostEngine:
+    """批量成本计算：按拓扑顺序一次遍历为全部产品定价，并支持多价格场景向量化计算
+
+    engine = CostEngine(recipes, material_items)
+    engine.price_all()                         # 当前物价、100% 成功率下全部产品单件成本
+    engine.price_all({"M001": 9000}, 25)       # 覆盖部分单价、25% 成功率
+    engine.price_scenarios(P, 50)              # P: (场景数 × 物料数) 单价矩阵 → (场景数 × 产品数)
+    engine.bom_matrix()                        # 直接用量稀疏矩阵（产品 × 组成项）
+    engine.requirement_matrix(50) @ prices     # 展开需求矩阵（产品 × 物料）× 单价向量 → 全部产品成本
+    engine.make_or_buy(market={"COMP0001": 5000})  # 子配方取 自制/购买 较小者
+    engine.shopping_list({"COMP0001": 20, "COMP0002": 5}, success_rate=50)  # 多产品合并采购清单
+    engine.expected_costs(rates={"专业10": 40}, default_rate=100)  # 按配方成功率的期望成本与标准差
+    engine.monte_carlo({"COMP0001": 1}, rates={"专业10": 40})      # 成本样本，可取分位数做预算
+    engine.sensitivity(50)                     # d(成本)/d(单价) 稀疏矩阵（产品 × 物料）
+    engine.material_impact(success_rate=50)    # 各原料单价对全目录成本的贡献（涨价影响最大的在前）
+    engine.with_materials(new_items)           # 只换单价（物料编号不变时复用展开结果，不重新展开）
+    """
+
+    def __init__(self, recipes: dict, material_items):
+        self.recipes = recipes
+        self.materials = list(material_items)
+        self.material_ids = [m['id'] for m in self.materials]
+        self.col_of = {mid: i for i, mid in enumerate(self.material_ids)}
+        self.base_prices = np.array([m.get('price', 0) for m in self.materials], dtype=float)
+        self.flat = flatten_recipes(recipes, self.material_ids)
+        self.products = list(self.flat['rows'])
+        self._ptr = np.asarray(self.flat['ptr'], dtype=np.int64)
+        self._col = np.asarray(self.flat['col'], dtype=np.int64)
+        self._depth = np.asarray(self.flat['depth'], dtype=np.int64)
+        self._qty = np.asarray(self.flat['qty'], dtype=float)
+
+    def with_materials(self, material_items) -> 'CostEngine':
+        """同一份配方、新物料表的引擎；物料编号与顺序不变时共享展开结果，只替换单价，否则重新展开"""
+        materials = list(material_items)
+        if [m['id'] for m in materials] != self.material_ids:
+            return CostEngine(self.recipes, materials)
+        engine = copy.copy(self)
+        engine.materials = materials
+        engine.base_prices = np.array([m.get('price', 0) for m in materials], dtype=float)
+        return engine
+
+    def price_vector(self, prices=None) -> np.ndarray:
+        """单价向量（与 material_ids 对齐）；prices 可为 {物料编号: 单价} 覆盖表或完整数组"""
+        if prices is None:
+            return self.base_prices.copy()
+        if isinstance(prices, dict):
+            vec = self.base_prices.copy()
+            for mid, price in prices.items():
+                if mid in self.col_of:
+                    vec[self.col_of[mid]] = price
+            return vec
+        vec = np.asarray(prices, dtype=float)
+        if vec.shape != self.base_prices.shape:
+            raise ValueError(f"单价数组长度应为 {len(self.base_prices)}，实际为 {vec.shape}")
+        return vec
+
+    def price_all(self, prices=None, success_rate=100) -> dict:
+        """全部产品单件成本 {产品编号: 成本}；按拓扑顺序记忆化子配方成本，每条配方边只算一次"""
+        vec = self.price_vector(prices)
+        prices_list = vec.tolist()
+        rate_mult = 100 / success_rate
+        cost = {}
+        for pid, p in self.recipes.items():
+            mult = rate_mult * p['calculation_coefficient']
+            total = 0.0
+            for m in p['materials']:
+                if 'ref' in m:
+                    if cost.get(m['ref']) is None:
+                        total = None
+                        break
+                    total += m['qty'] * mult * cost[m['ref']]
+                elif m['id'] in self.col_of:
+                    total += m['qty'] * mult * prices_list[self.col_of[m['id']]]
+            cost[pid] = total
+        # 循环依赖（或未按拓扑顺序排列）的产品无法记忆化，改用展开向量
+        for pid in [pid for pid, c in cost.items() if c is None]:
+            cost[pid] = float(self._row_weights(pid, rate_mult) @ vec[self._row_cols(pid)])
+        return cost
+
+    def breakdown(self, pid, prices=None, success_rate=100) -> dict:
+        """单个产品的原料构成 {物料编号: {"name", "qty", "cost"}}，按成本降序"""
+        vec = self.price_vector(prices)
+        out = {}
+        for c, w in zip(self._row_cols(pid), self._row_weights(pid, 100 / success_rate)):
+            mid = self.material_ids[c]
+            item = out.setdefault(mid, {"name": self.materials[c]['name'], "qty": 0.0, "cost": 0.0})
+            item["qty"] += w
+            item["cost"] += w * vec[c]
+        return dict(sorted(out.items(), key=lambda kv: -kv[1]["cost"]))
+
+    def price_scenarios(self, price_matrix, success_rate=100, block=1 << 22) -> np.ndarray:
+        """多价格场景向量化定价：price_matrix 形状 (S, 物料数)，返回 (S, 产品数)，列顺序同 self.products
+
+        成本 = (R @ Pᵀ)ᵀ，R 为 requirement_matrix 的展开需求矩阵，全部场景一次稀疏 × 稠密乘法。
+        """
+        prices = np.atleast_2d(np.asarray(price_matrix, dtype=float))
+        n_mat = len(self.material_ids)
+        if prices.shape[1] != n_mat:
+            raise ValueError(f"单价矩阵列数应为 {n_mat}，实际为 {prices.shape[1]}")
+        return self.requirement_matrix(success_rate).dot(prices.T, block).T
+
+    def bom_matrix(self):
+        """直接用量稀疏矩阵（产品 × 组成项，CSR）及组成项编号：组成项为全部产品在前、物料在后，值为 数量 × 计算系数
+
+        bom, comps = engine.bom_matrix()
+        bom.to_scipy()   # 需要 SciPy；否则可直接使用 bom.data / bom.indices / bom.indptr
+        """
+        n, n_mat = len(self.products), len(self.material_ids)
+        (sp, sc, sq), (rp, rc, rq) = bom_triplets(self.recipes, self.flat['rows'], self.col_of)
+        keep = sc < n
+        rows = np.concatenate([sp[keep], rp])
+        cols = np.concatenate([sc[keep], rc + n])
+        vals = np.concatenate([sq[keep], rq])
+        order = np.lexsort((cols, rows))
+        rows, cols, vals = rows[order], cols[order], vals[order]
+        first = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (cols[1:] != cols[:-1])])
+        first = first[first < len(rows)]
+        vals = np.add.reduceat(vals, first) if len(first) else vals
+        ptr = np.searchsorted(rows[first], np.arange(n + 1))
+        return CSRMatrix(vals, cols[first], ptr, (n, n + n_mat)), self.products + self.material_ids
+
+    def requirement_matrix(self, success_rate=100) -> CSRMatrix:
+        """展开需求矩阵（产品 × 物料，CSR）：每件产品对各原料的总用量，各层成功率系数已计入，即 sensitivity 的梯度"""
+        grad = self.sensitivity(success_rate)
+        return CSRMatrix(grad["val"], grad["col"], grad["ptr"], (len(self.products), len(self.material_ids)))
+
+    def sensitivity(self, success_rate=100) -> dict:
+        """d(单件成本)/d(原料单价) 的稀疏矩阵（产品 × 物料，CSR）
+
+        成本对单价是线性的，梯度即展开后每件产品对该原料的用量 Σ 用量 × (100/rate)^深度，
+        由展开向量按 (产品, 物料) 合并不同深度得到，与单价无关。
+        返回 {"rows": 产品编号, "cols": 物料编号, "ptr", "col", "val"}，val 为 float 数组。
+        """
+        weights = self._qty * (100 / success_rate) ** self._depth
+        rows = np.repeat(np.arange(len(self.products)), np.diff(self._ptr))
+        # 展开向量每行内按 (物料, 深度) 有序，同一物料的各深度相邻，逐段求和即可
+        start = np.flatnonzero(np.r_[True, (rows[1:] != rows[:-1]) | (self._col[1:] != self._col[:-1])])
+        start = start[start < len(rows)]
+        val = np.add.reduceat(weights, start) if len(start) else np.zeros(0)
+        ptr = np.searchsorted(rows[start], np.arange(len(self.products) + 1))
+        return {"rows": self.products, "cols": self.material_ids, "ptr": ptr, "col": self._col[start], "val": val}
+
+    def material_impact(self, prices=None, success_rate=100, grad=None) -> dict:
+        """各原料对全目录（全部产品各一件）成本的影响，按成本贡献降序
+
+        {物料编号: {"name", "products": 受影响产品数, "qty": Σ 梯度（单价 +1 时全目录成本增量）,
+                    "cost": 单价 × Σ 梯度, "share": 占全目录成本比例, "top": 梯度最大的产品编号}}
+        grad 可传入已算好的 sensitivity 结果。
+        """
+        vec = self.price_vector(prices)
+        grad = grad or self.sensitivity(success_rate)
+        n_mat = len(self.material_ids)
+        col, val = grad["col"], grad["val"]
+        qty = np.bincount(col, val, minlength=n_mat)
+        products = np.bincount(col, minlength=n_mat)
+        rows = np.repeat(np.arange(len(self.products)), np.diff(grad["ptr"]))
+        # 每个物料梯度最大的产品：按 (物料, 梯度) 排序后取每段最后一个
+        order = np.lexsort((val, col))
+        last = np.flatnonzero(np.r_[col[order][1:] != col[order][:-1], True]) if len(col) else []
+        top = {int(col[order[k]]): self.products[rows[order[k]]] for k in last}
+        cost = qty * vec
+        total = float(cost.sum())
+        out = {
+            self.material_ids[c]: {
+                "name": self.materials[c]['name'],
+                "products": int(products[c]),
+                "qty": float(qty[c]),
+                "cost": float(cost[c]),
+                "share": float(cost[c] / total) if total else 0.0,
+                "top": top[c],
+            }
+            for c in np.flatnonzero(products)
+        }
+        return dict(sorted(out.items(), key=lambda kv: -kv[1]["cost"]))
+
+    def make_or_buy(self, prices=None, market=None, success_rate=100) -> dict:
+        """自制还是购买：每个产品取 自制成本 与 市场价 的较小者，按拓扑顺序自底向上一次遍历
+
+        市场价来自物料表中与产品同编号的记录（产品名出现在物料表中时编号相同）及 market {产品编号: 单价}，
+        单价 ≤ 0 视为买不到。自制成本中的子配方一律按其最优成本（买或做）计入；环上产品逐层展开会把环重复计入，
+        其自制成本另以 price_all 的全自制成本（按路径展开）为上限，保证最优成本不高于全自制。
+        返回 {产品编号: {"craft": 自制成本, "buy": 市场价或 None, "cost": 最优成本, "decision": "make"|"buy"}}
+        """
+        vec = self.price_vector(prices)
+        prices_list = vec.tolist()
+        market = market or {}
+        rate_mult = 100 / success_rate
+        cycle, _ = self._cycle_order()
+        fallback = None
+        out = {}
+        for pid, p in self.recipes.items():
+            mult = rate_mult * p['calculation_coefficient']
+            craft = 0.0
+            for m in p['materials']:
+                if 'ref' in m:
+                    sub = out.get(m['ref'])
+                    if sub is None:
+                        # 循环依赖上尚未求解的子配方：能买则按市场价，否则按展开向量全自制
+                        buy = self._market_price(m['ref'], market, prices_list)
+                        if buy is None:
+                            fallback = fallback or self.price_all(vec, success_rate)
+                            buy = fallback.get(m['ref'], 0.0)
+                        craft += m['qty'] * mult * buy
+                    else:
+                        craft += m['qty'] * mult * sub['cost']
+                elif m['id'] in self.col_of:
+                    craft += m['qty'] * mult * prices_list[self.col_of[m['id']]]
+            if pid in cycle:
+                fallback = fallback or self.price_all(vec, success_rate)
+                craft = min(craft, fallback[pid])
+            buy = self._market_price(pid, market, prices_list)
+            decision = "buy" if buy is not None and buy < craft else "make"
+            out[pid] = {"craft": craft, "buy": buy, "cost": buy if decision == "buy" else craft, "decision": decision}
+        return out
+
+    def make_buy_plan(self, pid, decisions, success_rate=100) -> dict:
+        """按 make_or_buy 的决策自制一件 pid 的方案：展开需自制的子配方，需购买的子配方不再展开
+
+        返回 {"make": {产品编号: 数量}, "buy": {产品编号: 数量}, "materials": {物料编号: 数量}}，
+        pid 本身总是自制；同一路径上重复出现的产品（循环依赖）不再展开。
+        """
+        rate_mult = 100 / success_rate
+        plan = {"make": defaultdict(float), "buy": defaultdict(float), "materials": defaultdict(float)}
+        stack = [(pid, 1.0, frozenset())]
+        while stack:
+            cur, qty, path = stack.pop()
+            p = self.recipes.get(cur)
+            if p is None or cur in path:
+                continue
+            path = path | {cur}
+            mult = qty * rate_mult * p['calculation_coefficient']
+            for m in p['materials']:
+                q = m['qty'] * mult
+                if 'ref' not in m:
+                    plan["materials"][m['id']] += q
+                elif decisions.get(m['ref'], {}).get("decision") == "buy":
+                    plan["buy"][m['ref']] += q
+                else:
+                    plan["make"][m['ref']] += q
+                    stack.append((m['ref'], q, path))
+        return {k: dict(v) for k, v in plan.items()}
+
+    def shopping_list(self, orders: dict, prices=None, success_rate=100) -> dict:
+        """多产品合并采购清单：orders 为 {产品编号: 件数}
+
+        按拓扑逆序（先成品后子配方）一次传递需求，共用的中间品先合并件数再展开，每层配方各乘一次 100/成功率。
+        返回 {"products": {编号: {"name", "qty", "crafts"}}（含中间品），"materials": {物料编号: {"name", "qty", "cost"}}, "total"}，
+        qty 为所需件数，crafts = qty × 100/成功率 为期望制作次数。环上的产品只列出自身件数，原料按其展开向量
+        （与 price_all 相同按路径展开，路径上已出现的产品不再计入）折算，因此 total = Σ 件数 × price_all 成本。
+        """
+        vec = self.price_vector(prices)
+        rate_mult = 100 / success_rate
+        demand = defaultdict(float)
+        for pid, n in orders.items():
+            if pid in self.recipes:
+                demand[pid] += n
+        cycle, order = self._cycle_order()
+        products, raw = {}, defaultdict(float)
+        # 环外产品的引用方都在拓扑顺序中排在其后，逆序处理到它时需求已累计完整；环上产品的需求只来自环外，最后折算
+        for pid in [*reversed(order), *(pid for pid in self.recipes if pid in cycle)]:
+            n = demand.get(pid)
+            if not n:
+                continue
+            p = self.recipes[pid]
+            products[pid] = {"name": p['name'], "qty": n, "crafts": n * rate_mult}
+            if pid in cycle:
+                for c, w in zip(self._row_cols(pid), self._row_weights(pid, rate_mult)):
+                    raw[c] += n * w
+                continue
+            mult = n * rate_mult * p['calculation_coefficient']
+            for m in p['materials']:
+                if 'ref' in m:
+                    if m['ref'] in self.recipes:
+                        demand[m['ref']] += m['qty'] * mult
+                elif m['id'] in self.col_of:
+                    raw[self.col_of[m['id']]] += m['qty'] * mult
+        materials = {
+            self.material_ids[c]: {"name": self.materials[c]['name'], "qty": q, "cost": q * vec[c]}
+            for c, q in sorted(raw.items(), key=lambda kv: -kv[1] * vec[kv[0]])
+        }
+        return {"products": products, "materials": materials, "total": sum(m["cost"] for m in materials.values())}
+
+    def recipe_rates(self, rates=None, default_rate=100) -> dict:
+        """每个配方的成功率（百分比）：rates 的键可为产品编号或需求等级（如 "专业10"），编号优先，未命中取 default_rate"""
+        rates = rates or {}
+        return {pid: rates.get(pid, rates.get(p['level'], default_rate)) for pid, p in self.recipes.items()}
+
+    def expected_costs(self, prices=None, rates=None, default_rate=100) -> dict:
+        """按各配方自身成功率的期望成本与标准差，拓扑顺序一次遍历，每个配方的成功率只计一次
+
+        每次尝试消耗一份材料 A（子配方的每一件相互独立），成功率 p 时尝试次数 N 服从几何分布：
+          E[N] = 1/p，Var[N] = (1-p)/p²
+          单件成本 X = Σ_{i≤N} A_i → E[X] = E[A]/p，Var[X] = Var[A]/p + (1-p)/p² · E[A]²
+        循环依赖上的产品与 price_all 相同按路径展开（路径上已出现的产品不再计入），
+        因此所有配方成功率相同时，期望成本与 price_all 一致。返回 {产品编号: {"rate", "mean", "std"}}
+        """
+        prices_list = self.price_vector(prices).tolist()
+        rate = self.recipe_rates(rates, default_rate)
+        out = {}
+        for pid, p in self.recipes.items():
+            out[pid] = self._expected_one(p, rate[pid], prices_list, out.get)
+        resolved = {pid: s for pid, s in out.items() if s is not None}
+        for pid in [pid for pid, s in out.items() if s is None]:
+            out[pid] = self._expected_path(pid, rate, prices_list, resolved, frozenset())
+        return out
+
+    def _expected_one(self, p, rate, prices_list, sub_stats):
+        """单个配方的期望与标准差；sub_stats(子配方) 返回 None（尚未求解）时整体返回 None"""
+        coef = p['calculation_coefficient']
+        mean_a = var_a = 0.0
+        for m in p['materials']:
+            q = m['qty'] * coef
+            if 'ref' in m:
+                sub = sub_stats(m['ref'])
+                if sub is None:
+                    return None
+                mean_a += q * sub["mean"]
+                var_a += q * sub["std"] ** 2
+            elif m['id'] in self.col_of:
+                mean_a += q * prices_list[self.col_of[m['id']]]
+        pr = rate / 100
+        var = var_a / pr + (1 - pr) / pr ** 2 * mean_a ** 2
+        return {"rate": rate, "mean": mean_a / pr, "std": math.sqrt(var)}
+
+    def _expected_path(self, pid, rate, prices_list, resolved, visited):
+        """循环依赖产品：同 _flatten_path 按路径展开，拓扑序中已求解的子配方直接复用"""
+        if pid in visited or pid not in self.recipes:
+            return {"rate": 100, "mean": 0.0, "std": 0.0}
+        if pid in resolved:
+            return resolved[pid]
+        visited = visited | {pid}
+        return self._expected_one(self.recipes[pid], rate[pid], prices_list,
+                                  lambda ref: self._expected_path(ref, rate, prices_list, resolved, visited))
+
+    def monte_carlo(self, orders: dict, prices=None, rates=None, default_rate=100, samples=10000, seed=None) -> np.ndarray:
+        """蒙特卡洛模拟 orders {产品编号: 件数} 的总成本，返回长度 samples 的样本数组
+
+        需求按拓扑逆序逐层传递且全程向量化（每个样本一列）：某配方需产出 n 件时，
+        尝试次数 = n + 负二项分布(n, p) 的失败次数，子配方需求 = 尝试次数 × 数量 × 计算系数。
+        只访问 orders 可达的配方；环上的产品按 expected_costs 的期望成本（与 price_all 同样按路径展开）整体计入，
+        因此所有配方成功率相同时样本均值与 price_all 一致。
+        """
+        rng = np.random.default_rng(seed)
+        vec = self.price_vector(prices)
+        rate = self.recipe_rates(rates, default_rate)
+        cycle, order = self._cycle_order()
+        rank = {pid: k for k, pid in enumerate(order)}
+        expected = self.expected_costs(vec, rates, default_rate) if cycle else None
+        cost = np.zeros(samples)
+        demand, heap = {}, []
+        for pid, n in orders.items():
+            if pid in cycle and n > 0:
+                cost += n * expected[pid]["mean"]
+            elif pid in rank and n > 0:
+                demand[pid] = np.full(samples, int(n), dtype=np.int64)
+                heap.append(-rank[pid])
+        heapq.heapify(heap)
+        while heap:
+            pid = order[-heapq.heappop(heap)]
+            need = demand.pop(pid)
+            if need.min(initial=0) < 0:
+                raise OverflowError(f"{pid} 的需求件数超出 int64 范围，无法模拟")
+            pr = rate[pid] / 100
+            attempts = need if pr >= 1 else need + np.where(need > 0, rng.negative_binomial(np.maximum(need, 1), pr), 0)
+            p = self.recipes[pid]
+            for m in p['materials']:
+                k = m['qty'] * p['calculation_coefficient']
+                if int(attempts.max(initial=0)) * k > np.iinfo(np.int64).max:
+                    raise OverflowError(f"{pid} 的材料 {m['name']} 需求件数超出 int64 范围，无法模拟")
+                units = attempts * k
+                if 'ref' in m:
+                    ref = m['ref']
+                    if ref in cycle:
+                        cost += units * expected[ref]["mean"]
+                    elif ref in demand:
+                        demand[ref] += units
+                    elif ref in rank:
+                        demand[ref] = units
+                        heapq.heappush(heap, -rank[ref])
+                elif m['id'] in self.col_of:
+                    cost += units * vec[self.col_of[m['id']]]
+        return cost
+
+    def _cycle_order(self):
+        """(环上产品集合, 其余产品的拓扑顺序)：子配方排在引用方之前
+
+        Kahn 排序后剩下的是环上产品与（间接）依赖环的产品；再从中反复剥离没有被剩余产品引用的产品，
+        剩下的即环上产品（含夹在两个环之间的产品），剥离出的产品按剥离的逆序接在拓扑顺序之后。
+        """
+        refs = {pid: [m['ref'] for m in p['materials'] if m.get('ref') in self.recipes] for pid, p in self.recipes.items()}
+        users, indeg = defaultdict(list), {pid: len(r) for pid, r in refs.items()}
+        for pid, r in refs.items():
+            for ref in r:
+                users[ref].append(pid)
+        order = [pid for pid, d in indeg.items() if d == 0]
+        for pid in order:
+            for u in users[pid]:
+                indeg[u] -= 1
+                if indeg[u] == 0:
+                    order.append(u)
+        rest = set(refs) - set(order)
+        used = dict.fromkeys(rest, 0)
+        for pid in rest:
+            for ref in refs[pid]:
+                if ref in used:
+                    used[ref] += 1
+        peeled = [pid for pid, n in used.items() if n == 0]
+        for pid in peeled:
+            for ref in refs[pid]:
+                if ref in used:
+                    used[ref] -= 1
+                    if used[ref] == 0:
+                        peeled.append(ref)
+        return rest - set(peeled), order + peeled[::-1]
+
+    def _market_price(self, pid, market, prices_list):
+        price = market.get(pid)
+        if price is None and pid in self.col_of:
+            price = prices_list[self.col_of[pid]]
+        return float(price) if price is not None and price > 0 else None
+
+    def _row_cols(self, pid):
+        row = self.flat['rows'][pid]
+        return self._col[self._ptr[row]:self._ptr[row + 1]]
+
+    def _row_weights(self, pid, rate_mult):
+        row = self.flat['rows'][pid]
+        lo, hi = self._ptr[row], self._ptr[row + 1]
+        return self._qty[lo:hi] * rate_mult ** self._depth[lo:hi]
@@ -0,0 +1,170 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AION 物价历史库（SQLite，只追加），按物料名称索引，不依赖 pandas
+（物料编号取自物料表行号，增删或调整行序后会指向别的物料，不能作为历史的键）
+表结构：
+  snapshots(id, ts, source, sha)       每次记录一行，ts 为本地时间 ISO 字符串
+  prices(material, snapshot, price)    material 为物料名称；只记与上一次相比变化（或新出现）的单价，
+                                       主键 (material, snapshot)；物料从表中消失时记一行 NULL
+  materials(name, price)               物料名称 → 最近一次记录的单价（写入时比对变化用）
+  record_prices(db, material_items, source, sha)   # 追加一次快照，内容未变时跳过
+  hist = PriceHistory(db)
+  hist.snapshots(since, until)         # 时间段内的快照（含 since 时刻生效的那次）
+  hist.snapshot_at(ts)                 # ts 时刻生效的快照（只给日期时取当天结束）
+  hist.price_matrix(names, snapshot_ids)           # (快照数 × 物料数)，列按物料名称对齐，未记录的物料为 NaN
+"""
+import sqlite3
+from datetime import datetime
+from pathlib import Path
+
+import numpy as np
+
+SCHEMA_VERSION = 1  # PRAGMA user_version；0 为按物料编号记录的旧库
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS snapshots (
+    id     INTEGER PRIMARY KEY,
+    ts     TEXT NOT NULL,
+    source TEXT NOT NULL DEFAULT '',
+    sha    TEXT
+);
+CREATE INDEX IF NOT EXISTS snapshots_ts ON snapshots(ts);
+CREATE TABLE IF NOT EXISTS prices (
+    material TEXT NOT NULL,
+    snapshot INTEGER NOT NULL REFERENCES snapshots(id),
+    price    REAL,
+    PRIMARY KEY (material, snapshot)
+) WITHOUT ROWID;
+CREATE INDEX IF NOT EXISTS prices_snapshot ON prices(snapshot);
+CREATE TABLE IF NOT EXISTS materials (
+    name  TEXT PRIMARY KEY,
+    price REAL
+) WITHOUT ROWID;
+"""
+
+# 旧库 prices.material 为物料编号：按 materials 中各编号最近一次的名称改写（编号早先对应过的其他物料无从区分，沿用该名称）
+_MIGRATE_V1 = """
+BEGIN;
+UPDATE OR REPLACE prices SET material = (SELECT name FROM materials WHERE id = prices.material)
+    WHERE material IN (SELECT id FROM materials);
+CREATE TABLE materials_v1 (
+    name  TEXT PRIMARY KEY,
+    price REAL
+) WITHOUT ROWID;
+INSERT OR REPLACE INTO materials_v1 (name, price) SELECT name, price FROM materials;
+DROP TABLE materials;
+ALTER TABLE materials_v1 RENAME TO materials;
+COMMIT;
+"""
+
+
+def parse_time(value: str, end: bool = False) -> str:
+    """ISO 日期或时间 → 可与 snapshots.ts 直接比较的字符串；只给日期且 end 为真时取当天结束"""
+    value = str(value).strip()
+    t = datetime.fromisoformat(value)
+    if end and 'T' not in value and ' ' not in value:
+        t = t.replace(hour=23, minute=59, second=59)
+    return t.isoformat(timespec='seconds')
+
+
+def _connect(db) -> sqlite3.Connection:
+    Path(db).parent.mkdir(parents=True, exist_ok=True)
+    conn = sqlite3.connect(str(db))
+    if conn.execute("PRAGMA user_version").fetchone()[0] < SCHEMA_VERSION:
+        if 'id' in [row[1] for row in conn.execute("PRAGMA table_info(materials)")]:
+            conn.executescript(_MIGRATE_V1)
+    conn.executescript(_SCHEMA + f"PRAGMA user_version = {SCHEMA_VERSION};")
+    return conn
+
+
+def record_prices(db, material_items, source: str = '', sha: str = None, ts: str = None):
+    """追加一次物价快照，返回快照编号；sha 与最近一次相同或单价完全未变时不写入，返回 None
+    按物料名称记录；同名物料出现多次时以最后一行为准"""
+    conn = _connect(db)
+    try:
+        last = conn.execute("SELECT id, sha FROM snapshots ORDER BY id DESC LIMIT 1").fetchone()
+        if last and sha and last[1] == sha:
+            return None
+        current = {name: _number(price) for name, price in conn.execute("SELECT name, price FROM materials")}
+        latest = {m['name']: m['price'] for m in material_items}
+        changed = [(name, price) for name, price in latest.items() if current.get(name) != price]
+        changed += [(name, None) for name, price in current.items() if price is not None and name not in latest]
+        if last and not changed:
+            return None
+        with conn:
+            sid = conn.execute("INSERT INTO snapshots (ts, source, sha) VALUES (?, ?, ?)",
+                               (ts or datetime.now().isoformat(timespec='seconds'), source, sha)).lastrowid
+            conn.executemany("INSERT INTO prices (material, snapshot, price) VALUES (?, ?, ?)",
+                             [(name, sid, price) for name, price in changed])
+            conn.executemany("INSERT OR REPLACE INTO materials (name, price) VALUES (?, ?)", changed)
+        return sid
+    finally:
+        conn.close()
+
+
+def _number(v):
+    """REAL 列读回的整数单价还原为 int，便于与物料表比对"""
+    return int(v) if v is not None and float(v).is_integer() else v
+
+
+class PriceHistory:
+    """物价历史库的只读查询"""
+
+    def __init__(self, db):
+        if not Path(db).exists():
+            raise FileNotFoundError(f"物价历史库不存在: {db}")
+        self.path = Path(db)
+        self.conn = _connect(db)
+
+    def close(self):
+        self.conn.close()
+
+    def snapshots(self, since: str = None, until: str = None) -> list:
+        """时间段 [since, until] 内的快照（按时间升序），since 时刻生效的一次（不晚于 since 的最后一次）也包含在内，
+        作为时间段起点的物价；since 只给日期时取当天开始，until 只给日期时取当天结束"""
+        sql = "SELECT id, ts, source, (SELECT COUNT(*) FROM prices WHERE snapshot = s.id) FROM snapshots s"
+        cond, args = [], []
+        if since:
+            first = self.snapshot_at(since, end=False)
+            cond.append("id >= ?")
+            args.append(first["id"] if first else 0)
+        if until:
+            cond.append("ts <= ?")
+            args.append(parse_time(until, end=True))
+        if cond:
+            sql += " WHERE " + " AND ".join(cond)
+        rows = self.conn.execute(sql + " ORDER BY id", args)
+        return [{"id": sid, "ts": ts, "source": source, "changes": n} for sid, ts, source, n in rows]
+
+    def snapshot_at(self, ts: str, end: bool = True):
+        """ts 时刻生效的快照（不晚于 ts 的最后一次），更早则返回 None；ts 只给日期时按 end 取当天结束或开始"""
+        row = self.conn.execute("SELECT id, ts, source FROM snapshots WHERE ts <= ? ORDER BY id DESC LIMIT 1",
+                                (parse_time(ts, end=end),)).fetchone()
+        return row and {"id": row[0], "ts": row[1], "source": row[2]}
+
+    def price_matrix(self, names, snapshot_ids) -> np.ndarray:
+        """各快照生效的单价矩阵 (快照数 × 物料数)，列与物料名称列表 names 对齐
+
+        只读取不晚于最后一个快照的变化记录，按快照顺序向前填充；从未记录或已移除的物料为 NaN。
+        """
+        snapshot_ids = list(snapshot_ids)
+        out = np.full((len(snapshot_ids), len(names)), np.nan)
+        if not snapshot_ids:
+            return out
+        col_of = {name: i for i, name in enumerate(names)}
+        rows = self.conn.execute("SELECT snapshot, material, price FROM prices WHERE snapshot <= ? ORDER BY snapshot",
+                                 (max(snapshot_ids),)).fetchall()
+        rows = [(s, col_of[m], np.nan if p is None else p) for s, m, p in rows if m in col_of]
+        snap = np.fromiter((r[0] for r in rows), dtype=np.int64, count=len(rows))
+        col = np.fromiter((r[1] for r in rows), dtype=np.int64, count=len(rows))
+        price = np.fromiter((r[2] for r in rows), dtype=float, count=len(rows))
+
+        current = np.full(len(names), np.nan)
+        lo = 0
+        for k in np.argsort(snapshot_ids, kind='stable'):
+            hi = np.searchsorted(snap, snapshot_ids[k], side='right')
+            current[col[lo:hi]] = price[lo:hi]
+            lo = max(lo, hi)
+            out[k] = current
+        return out
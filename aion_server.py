@@ -0,0 +1,334 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AION 本地定价服务（asyncio，仅标准库 + numpy），供公会工具按 HTTP 查询成本
+数据只在启动时载入一次；轮询两份 CSV 的修改时间，变化后在后台线程重新载入并整体替换，
+BOM 与物料名称都未变时复用已展开的配方，只更新单价。接口在线程池中计算，慢请求不阻塞其他连接与重载轮询。
+所有接口均为 GET（HEAD 只返回响应头），返回 JSON：
+  /api/status                              数据规模、载入时间与重载次数
+  /api/cost?product=名称或编号&rate=50      单件成本（product 可重复；省略时返回全部产品）
+  /api/breakdown?product=...&rate=50       原料构成（按成本降序）
+  /api/tree?product=...&rate=50&depth=3    BOM 树：各节点用量与成本，深度超过 depth（或节点超过上限）的子树只给成本
+  /api/search?q=关键词&limit=20            按名称、编号、拼音 / 首字母检索产品（空格分隔的关键词须全部命中）
+  service = PricingService(loader, indexer, watch=[物料CSV, BOM CSV])
+  asyncio.run(service.serve("127.0.0.1", 8765))
+"""
+import asyncio, heapq, json, os, threading, time
+from datetime import datetime
+from urllib.parse import parse_qs, urlsplit
+
+import numpy as np
+
+from aion_cost import CostEngine
+
+RATE_CACHE = 16       # 每份数据最多缓存的成功率档数（price_all 结果）
+MAX_HEADER = 64 * 1024
+MAX_TREE_NODES = 20000  # BOM 树展开节点上限；共用中间品多的深层配方按路径展开会指数增长
+
+
+class HTTPError(Exception):
+    def __init__(self, status, message):
+        super().__init__(message)
+        self.status = status
+
+
+class Dataset:
+    """一次载入的不可变数据；重载时整体替换，处理中的请求继续使用旧对象"""
+
+    def __init__(self, materials, recipes, name2id, engine, index, version):
+        self.materials = materials
+        self.recipes = recipes
+        self.name2id = name2id
+        self.engine = engine
+        self.index = index
+        self.version = version
+        self.loaded_at = datetime.now().isoformat(timespec='seconds')
+        self.material_names = [(m['id'], m['name']) for m in materials]
+        self.price_of = {m['id']: m['price'] for m in materials}
+        self._costs = {}
+        self._lock = threading.Lock()
+
+    def costs(self, rate) -> dict:
+        """price_all 结果按成功率缓存；请求在线程池中并发执行，缓存读写加锁，计算在锁外（同档并发时可能重复算一次）"""
+        with self._lock:
+            if rate in self._costs:
+                return self._costs[rate]
+        costs = self.engine.price_all(None, rate)
+        with self._lock:
+            if rate not in self._costs and len(self._costs) >= RATE_CACHE:
+                self._costs.pop(next(iter(self._costs)))
+            return self._costs.setdefault(rate, costs)
+
+
+class PricingService:
+    """loader() 返回 {"materials", "recipes", "name2id", "bom"}（bom 为 BOM 文件的内容哈希）；
+    indexer(recipes) 返回页面同款检索索引 {"keys", "grams", "stop"}（见 search_index），仅在配方变化时调用"""
+
+    STATUS = {200: 'OK', 400: 'Bad Request', 404: 'Not Found', 405: 'Method Not Allowed', 500: 'Internal Server Error'}
+
+    def __init__(self, loader, indexer, watch=(), interval=1.0, log=print):
+        self.loader = loader
+        self.indexer = indexer
+        self.watch_paths = [str(p) for p in watch]
+        self.interval = interval
+        self.log = log
+        self.data = None
+        self.reloads = 0
+        self.bom = None
+        self.routes = {
+            '/api/status': self.api_status,
+            '/api/cost': self.api_cost,
+            '/api/breakdown': self.api_breakdown,
+            '/api/tree': self.api_tree,
+            '/api/search': self.api_search,
+        }
+
+    # ----------  载入与热重载  ----------
+    def load(self) -> Dataset:
+        """载入一份数据；BOM 哈希与物料编号、名称都未变时复用已展开的配方和检索键，只换单价"""
+        raw = self.loader()
+        prev, names = self.data, [(m['id'], m['name']) for m in raw["materials"]]
+        version = prev.version + 1 if prev else 1
+        if prev and raw["bom"] == self.bom and names == prev.material_names:
+            data = Dataset(raw["materials"], prev.recipes, prev.name2id, prev.engine.with_materials(raw["materials"]),
+                           prev.index, version)
+        else:
+            data = Dataset(raw["materials"], raw["recipes"], raw["name2id"], CostEngine(raw["recipes"], raw["materials"]),
+                           SearchIndex(self.indexer(raw["recipes"])), version)
+        self.bom = raw["bom"]
+        return data
+
+    def signature(self):
+        sig = []
+        for p in self.watch_paths:
+            try:
+                st = os.stat(p)
+                sig.append((st.st_mtime_ns, st.st_size))
+            except OSError:
+                sig.append(None)
+        return sig
+
+    async def watch(self):
+        """轮询 CSV 修改时间；连续两次轮询一致（文件已写完）后在后台线程重载，失败时保留旧数据"""
+        loop = asyncio.get_running_loop()
+        seen = self.signature()
+        while True:
+            await asyncio.sleep(self.interval)
+            sig = self.signature()
+            if sig == seen:
+                continue
+            await asyncio.sleep(self.interval)
+            if self.signature() != sig:
+                continue
+            seen = sig
+            t0 = time.perf_counter()
+            try:
+                self.data = await loop.run_in_executor(None, self.load)
+            except SystemExit:
+                self.log("[✗] 重载失败（原因见上方输出），继续使用旧数据")
+                continue
+            except Exception as e:
+                self.log(f"[✗] 重载失败，继续使用旧数据: {e}")
+                continue
+            self.reloads += 1
+            self.log(f"[♻] 数据已重载（第 {self.reloads} 次，{time.perf_counter() - t0:.2f}s）："
+                     f"物料 {len(self.data.materials)} 种，配方 {len(self.data.recipes)} 条")
+
+    # ----------  HTTP  ----------
+    async def serve(self, host='127.0.0.1', port=8765, ready=None):
+        if self.data is None:
+            self.data = self.load()
+        server = await asyncio.start_server(self.handle, host, port, limit=MAX_HEADER)
+        watcher = asyncio.create_task(self.watch()) if self.interval > 0 and self.watch_paths else None
+        addr = server.sockets[0].getsockname()
+        self.log(f"[✓] 定价服务已启动: http://{addr[0]}:{addr[1]}/api/status"
+                 + (f"（每 {self.interval:g}s 检查 CSV 变化）" if watcher else ""))
+        if ready:
+            ready(addr)
+        try:
+            async with server:
+                await server.serve_forever()
+        finally:
+            if watcher:
+                watcher.cancel()
+
+    async def handle(self, reader, writer):
+        """HTTP/1.1 keep-alive：同一连接上依次处理请求，直到客户端关闭或要求 Connection: close；
+        路由计算与 JSON 编码都在线程池中进行，事件循环继续服务其他连接与重载轮询"""
+        loop = asyncio.get_running_loop()
+        try:
+            while True:
+                line = await reader.readline()
+                if not line:
+                    break
+                try:
+                    method, target, version = line.decode('latin-1').split()
+                except ValueError:
+                    await self.respond(writer, 400, self.encode({"error": "请求行无效"}), False)
+                    break
+                headers = {}
+                while (h := await reader.readline()) not in (b'\r\n', b'\n', b''):
+                    k, _, v = h.decode('latin-1').partition(':')
+                    headers[k.strip().lower()] = v.strip()
+                if int(headers.get('content-length') or 0):
+                    await reader.readexactly(int(headers['content-length']))
+                keep = version == 'HTTP/1.1' and headers.get('connection', '').lower() != 'close'
+                status, payload = await loop.run_in_executor(None, self.render, method, target)
+                await self.respond(writer, status, payload, keep, head=method == 'HEAD')
+                if not keep:
+                    break
+        except (ConnectionError, asyncio.IncompleteReadError, asyncio.LimitOverrunError, ValueError):
+            pass
+        finally:
+            writer.close()
+
+    @staticmethod
+    def encode(body) -> bytes:
+        return json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode('utf-8')
+
+    def render(self, method, target):
+        status, body = self.dispatch(method, target)
+        return status, self.encode(body)
+
+    async def respond(self, writer, status, payload, keep, head=False):
+        """HEAD 请求只写响应头，Content-Length 仍为对应 GET 的正文长度"""
+        writer.write((f"HTTP/1.1 {status} {self.STATUS[status]}\r\n"
+                      "Content-Type: application/json; charset=utf-8\r\n"
+                      f"Content-Length: {len(payload)}\r\n"
+                      "Access-Control-Allow-Origin: *\r\n"
+                      f"Connection: {'keep-alive' if keep else 'close'}\r\n\r\n").encode('latin-1')
+                     + (b'' if head else payload))
+        await writer.drain()
+
+    def dispatch(self, method, target):
+        url = urlsplit(target)
+        route = self.routes.get(url.path.rstrip('/') or '/')
+        try:
+            if route is None:
+                raise HTTPError(404, f"未知接口: {url.path}（可用: {', '.join(self.routes)}）")
+            if method not in ('GET', 'HEAD'):
+                raise HTTPError(405, "只支持 GET")
+            return 200, route(self.data, parse_qs(url.query))
+        except HTTPError as e:
+            return e.status, {"error": str(e)}
+        except Exception as e:
+            self.log(f"[✗] {method} {target}: {e}")
+            return 500, {"error": str(e)}
+
+    # ----------  参数  ----------
+    @staticmethod
+    def rate(query):
+        try:
+            rate = float(query.get('rate', ['100'])[0])
+        except ValueError:
+            raise HTTPError(400, "rate 应为数字") from None
+        if not 0 < rate <= 100:
+            raise HTTPError(400, "rate 应在 (0, 100] 之间")
+        return int(rate) if rate.is_integer() else rate
+
+    @staticmethod
+    def products(data, query, required=True):
+        keys = query.get('product', [])
+        if required and not keys:
+            raise HTTPError(400, "缺少参数 product（产品名称或编号）")
+        out = []
+        for key in keys:
+            pid = key if key in data.recipes else data.name2id.get(key)
+            if pid not in data.recipes:
+                raise HTTPError(404, f"未知产品: {key}")
+            out.append(pid)
+        return out
+
+    # ----------  接口  ----------
+    def api_status(self, data, query):
+        return {"materials": len(data.materials), "recipes": len(data.recipes), "version": data.version,
+                "loaded_at": data.loaded_at, "reloads": self.reloads, "watch": self.watch_paths}
+
+    def api_cost(self, data, query):
+        rate = self.rate(query)
+        costs = data.costs(rate)
+        pids = self.products(data, query, required=False) or list(data.recipes)
+        return {"rate": rate, "version": data.version,
+                "products": [{"id": pid, "name": data.recipes[pid]['name'], "cost": round(costs[pid], 2)} for pid in pids]}
+
+    def api_breakdown(self, data, query):
+        rate, (pid,) = self.rate(query), self.products(data, query)[:1]
+        items = data.engine.breakdown(pid, None, rate)
+        return {"id": pid, "name": data.recipes[pid]['name'], "rate": rate, "cost": round(data.costs(rate)[pid], 2),
+                "materials": [{"id": mid, "name": b["name"], "qty": round(float(b["qty"]), 4), "cost": round(float(b["cost"]), 2)}
+                              for mid, b in items.items()]}
+
+    def api_tree(self, data, query):
+        """节点用量为每件成品所需件数（已计入计算系数与成功率系数），子树成本 = 用量 × 单件成本；环上的产品不再展开"""
+        rate, (pid,) = self.rate(query), self.products(data, query)[:1]
+        try:
+            depth = int(query.get('depth', ['64'])[0])
+        except ValueError:
+            raise HTTPError(400, "depth 应为整数") from None
+        if depth < 0:
+            raise HTTPError(400, "depth 应为非负整数")
+        costs, mult = data.costs(rate), 100 / rate
+        budget = {"left": MAX_TREE_NODES, "truncated": False}
+
+        def node(pid, qty, path, level):
+            p = data.recipes[pid]
+            out = {"id": pid, "name": p['name'], "qty": round(qty, 4), "coef": p['calculation_coefficient'],
+                   "unit_cost": round(costs[pid], 2), "cost": round(qty * costs[pid], 2)}
+            if level >= depth or pid in path:
+                return out
+            if budget["left"] < len(p['materials']):
+                budget["truncated"] = True
+                return out
+            budget["left"] -= len(p['materials'])
+            children = []
+            for m in p['materials']:
+                q = qty * m['qty'] * p['calculation_coefficient'] * mult
+                if m.get('ref') in data.recipes:
+                    children.append(node(m['ref'], q, path | {pid}, level + 1))
+                elif m.get('id') in data.price_of:
+                    price = data.price_of[m['id']]
+                    children.append({"id": m['id'], "name": m['name'], "qty": round(q, 4), "price": price,
+                                     "cost": round(q * price, 2)})
+            out["children"] = children
+            return out
+
+        tree = node(pid, 1, frozenset(), 0)
+        return {"rate": rate, "truncated": budget["truncated"], "tree": tree}
+
+    def api_search(self, data, query):
+        terms = ' '.join(query.get('q', [])).lower().split()
+        if not terms:
+            raise HTTPError(400, "缺少参数 q")
+        try:
+            limit = max(1, min(200, int(query.get('limit', ['20'])[0])))
+        except ValueError:
+            raise HTTPError(400, "limit 应为整数") from None
+        ids, keys = list(data.recipes), data.index.keys
+        hits = [k for k in data.index.candidates(terms) if all(t in keys[k] for t in terms)]
+        # 名称以首个关键词开头的排前，其次名称较短的
+        first, name_len = terms[0], data.index.name_len
+        top = heapq.nsmallest(limit, hits, key=lambda k: (not keys[k].startswith(first), name_len[k], k))
+        return {"total": len(hits), "products": [
+            {"id": ids[k], "name": data.recipes[ids[k]]['name'], "profession": data.recipes[ids[k]]['profession'],
+             "level": data.recipes[ids[k]]['level']} for k in top]}
+
+
+class SearchIndex:
+    """检索键 + 二元组倒排表：关键词中非停用二元组的倒排表求交得到候选，再逐条核对子串"""
+
+    def __init__(self, index: dict):
+        self.keys = index["keys"]
+        self.name_len = [len(key.split('\n', 1)[0]) for key in self.keys]  # 检索键首段即小写名称
+        self.stop = set(index["stop"])
+        self.postings = {g: np.cumsum(d, dtype=np.int64) for g, d in index["grams"].items()}
+
+    def candidates(self, terms):
+        lists = [self.postings.get(g, np.empty(0, dtype=np.int64))
+                 for t in terms for g in dict.fromkeys(t[i:i + 2] for i in range(len(t) - 1)) if g not in self.stop]
+        if not lists:
+            return range(len(self.keys))
+        lists.sort(key=len)
+        out = lists[0]
+        for post in lists[1:]:
+            out = np.intersect1d(out, post, assume_unique=True)
+        return out.tolist()
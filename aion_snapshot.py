@@ -0,0 +1,206 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+AION 二进制数据快照（物料、名称→编码映射、配方边），可内存映射，不依赖 pandas / chardet
+文件布局：
+  AIONSNAP | 版本 u32 | 头部长度 u32 | 头部 JSON {数组名: [偏移, dtype, 元素数]} | 按 8 字节对齐的数组
+所有字符串进同一张表（UTF-8 拼接 + 偏移数组），其余字段均为平行整数/数值数组，配方材料按 CSR 排列。
+整数列按取值范围选用最小的类型（uint8 / uint16 / int32 / int64）；配方材料的名称不逐条存储，
+读取时由材料编号查物料表 / 配方表得到，只有与之不符的少数边另存为稀疏覆盖表。
+  save_snapshot(path, material_items, recipes, name2id)
+  snap = load_snapshot(path)           # 只映射文件，数组为零拷贝视图
+  snap.material_items(), snap.recipes(), snap.name2id()   # 还原为 convert_material / convert_bom 的结构
+"""
+import json, os, struct
+from pathlib import Path
+
+import numpy as np
+
+MAGIC = b"AIONSNAP"
+SNAPSHOT_VERSION = 2
+_PREFIX = struct.Struct("<8sII")
+
+
+# --------------------  写入  --------------------
+def save_snapshot(path, material_items, recipes: dict, name2id: dict = None):
+    """写入快照（先写临时文件再替换，中途失败不会留下半个文件）"""
+    strings, index = [], {}
+    def sid(v):
+        k = index.get(v)
+        if k is None:
+            k = index[v] = len(strings)
+            strings.append(v)
+        return k
+
+    cols = {k: [] for k in ("mat_id", "mat_name", "mat_source", "mat_price", "mat_prof",
+                            "rec_id", "rec_name", "rec_level", "rec_level_num", "rec_prof", "rec_coef",
+                            "edge_mat", "edge_qty", "edge_ref", "edge_name_pos", "edge_name", "n2i_name", "n2i_id")}
+    cols["mat_prof_ptr"], cols["rec_ptr"] = [0], [0]
+    for m in material_items:
+        cols["mat_id"].append(sid(m['id']))
+        cols["mat_name"].append(sid(m['name']))
+        cols["mat_source"].append(sid(m['source']))
+        cols["mat_price"].append(m['price'])
+        cols["mat_prof"].extend(sid(p) for p in m['professions'])
+        cols["mat_prof_ptr"].append(len(cols["mat_prof"]))
+    for pid, p in recipes.items():
+        cols["rec_id"].append(sid(pid))
+        cols["rec_name"].append(sid(p['name']))
+        cols["rec_level"].append(sid(p['level']))
+        cols["rec_level_num"].append(p['levelNum'])
+        cols["rec_prof"].append(sid(p['profession']))
+        cols["rec_coef"].append(p['calculation_coefficient'])
+    # 材料名称默认取自其编号对应的物料 / 配方名称（未知材料以名称本身为编号），不一致的边单独记下
+    name_of = dict(zip(cols["mat_id"], cols["mat_name"]))
+    name_of.update(zip(cols["rec_id"], cols["rec_name"]))
+    for p in recipes.values():
+        for m in p['materials']:
+            mat, name = sid(m.get('ref', m.get('id'))), sid(m['name'])
+            if name_of.get(mat, mat) != name:
+                cols["edge_name_pos"].append(len(cols["edge_qty"]))
+                cols["edge_name"].append(name)
+            cols["edge_ref"].append('ref' in m)
+            cols["edge_mat"].append(mat)
+            cols["edge_qty"].append(m['qty'])
+        cols["rec_ptr"].append(len(cols["edge_qty"]))
+    for name, mid in (name2id or {}).items():
+        cols["n2i_name"].append(sid(name))
+        cols["n2i_id"].append(sid(mid))
+
+    encoded = [s.encode('utf-8') for s in strings]
+    arrays = {
+        "str_blob": np.frombuffer(b"".join(encoded), dtype=np.uint8),
+        "str_off": _numeric(np.concatenate([[0], np.cumsum([len(b) for b in encoded], dtype=np.int64)])),
+    }
+    for k, v in cols.items():
+        arrays[k] = np.asarray(v, dtype=np.bool_) if k == "edge_ref" else _numeric(v)
+
+    header, offset = {}, 0
+    for k, a in arrays.items():
+        header[k] = [offset, a.dtype.str, len(a)]
+        offset += _aligned(a.nbytes)
+    head = json.dumps(header, separators=(',', ':')).encode('utf-8')
+    base = _aligned(_PREFIX.size + len(head))
+
+    path = Path(path)
+    tmp = path.with_name(path.name + ".tmp")
+    with tmp.open('wb') as f:
+        f.write(_PREFIX.pack(MAGIC, SNAPSHOT_VERSION, len(head)))
+        f.write(head.ljust(base - _PREFIX.size, b" "))
+        for a in arrays.values():
+            f.write(a.tobytes().ljust(_aligned(a.nbytes), b"\0"))
+    os.replace(tmp, path)
+
+
+def _numeric(values):
+    """数值列：全为整数时存能容纳取值范围的最小整数类型，出现小数（如手填单价）时退回 float64"""
+    arr = np.asarray(values)
+    if arr.size == 0:
+        return arr.astype(np.uint8)
+    if arr.dtype.kind not in "iub":
+        return arr.astype(np.float64)
+    lo, hi = int(arr.min()), int(arr.max())
+    for dt in (np.uint8, np.uint16, np.int32):
+        info = np.iinfo(dt)
+        if info.min <= lo and hi <= info.max:
+            return arr.astype(dt)
+    return arr.astype(np.int64)
+
+
+def _aligned(n, k=8):
+    return (n + k - 1) // k * k
+
+
+# --------------------  读取  --------------------
+def load_snapshot(path):
+    """内存映射快照；文件缺失、损坏或版本不符时返回 None（调用方回退到重新解析 CSV）"""
+    try:
+        return Snapshot(path)
+    except (OSError, ValueError, KeyError, struct.error):
+        return None
+
+
+class Snapshot:
+    """快照的只读视图：数组直接引用映射内存，按需还原为 Python 结构"""
+
+    def __init__(self, path):
+        self.path = Path(path)
+        self._mm = np.memmap(self.path, dtype=np.uint8, mode='r')
+        magic, version, head_len = _PREFIX.unpack(self._mm[:_PREFIX.size].tobytes())
+        if magic != MAGIC or version != SNAPSHOT_VERSION:
+            raise ValueError(f"不是受支持的快照文件: {self.path}")
+        end = _PREFIX.size + head_len
+        header = json.loads(self._mm[_PREFIX.size:end].tobytes())
+        base = _aligned(end)
+        self.arrays = {k: np.frombuffer(self._mm, dtype=np.dtype(dt), count=n, offset=base + off)
+                       for k, (off, dt, n) in header.items()}
+        self._strings = None
+
+    def __getitem__(self, name):
+        return self.arrays[name]
+
+    @property
+    def strings(self) -> list:
+        """字符串表（首次访问时整体解码一次）"""
+        if self._strings is None:
+            blob = self["str_blob"].tobytes()
+            off = self["str_off"].tolist()
+            self._strings = [blob[a:b].decode('utf-8') for a, b in zip(off, off[1:])]
+        return self._strings
+
+    def material_items(self) -> list:
+        S, a = self.strings, self.arrays
+        ptr, prof = a["mat_prof_ptr"].tolist(), a["mat_prof"].tolist()
+        return [{
+            "id": S[i],
+            "name": S[n],
+            "professions": [S[p] for p in prof[ptr[k]:ptr[k + 1]]],
+            "source": S[s],
+            "price": price,
+        } for k, (i, n, s, price) in enumerate(zip(a["mat_id"].tolist(), a["mat_name"].tolist(),
+                                                   a["mat_source"].tolist(), a["mat_price"].tolist()))]
+
+    def edge_names(self) -> np.ndarray:
+        """各条配方边的材料名称（字符串下标）：编号 → 物料 / 配方名称，再套用稀疏覆盖表"""
+        a = self.arrays
+        lut = np.arange(len(a["str_off"]) - 1, dtype=np.int64)
+        lut[a["mat_id"]] = a["mat_name"]
+        lut[a["rec_id"]] = a["rec_name"]
+        names = lut[a["edge_mat"]]
+        names[a["edge_name_pos"]] = a["edge_name"]
+        return names
+
+    def recipes(self) -> dict:
+        S, a = self.strings, self.arrays
+        ptr = a["rec_ptr"].tolist()
+        mats = [
+            {"ref": S[m], "qty": q, "name": S[n]} if r else {"id": S[m], "qty": q, "name": S[n]}
+            for m, n, q, r in zip(a["edge_mat"].tolist(), self.edge_names().tolist(),
+                                  a["edge_qty"].tolist(), a["edge_ref"].tolist())
+        ]
+        out = {}
+        for k, (i, n, lvl, num, prof, coef) in enumerate(zip(
+                a["rec_id"].tolist(), a["rec_name"].tolist(), a["rec_level"].tolist(),
+                a["rec_level_num"].tolist(), a["rec_prof"].tolist(), a["rec_coef"].tolist())):
+            out[S[i]] = {
+                "id": S[i],
+                "name": S[n],
+                "level": S[lvl],
+                "levelNum": num,
+                "profession": S[prof],
+                "calculation_coefficient": coef,
+                "materials": mats[ptr[k]:ptr[k + 1]],
+            }
+        return out
+
+    def name2id(self) -> dict:
+        S = self.strings
+        return {S[n]: S[i] for n, i in zip(self["n2i_name"].tolist(), self["n2i_id"].tolist())}
+
+    def edges(self):
+        """配方边的列式视图 (产品下标, 材料字符串下标, 数量, 是否子配方)，供下游工具直接做向量化计算
+
+        数量列为按取值范围选定的紧凑类型（常为 uint8 / uint16），参与乘法前请先转换为 int64 / float64。
+        """
+        ptr = self["rec_ptr"]
+        return np.repeat(np.arange(len(ptr) - 1), np.diff(ptr)), self["edge_mat"], self["edge_qty"], self["edge_ref"]
@@ -0,0 +1,133 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+BOM 解析基准：对比旧版逐行 iterrows 实现与列式长表实现的吞吐（行/秒）
+用法：python benchmarks/bench_bom.py [--rows 200000] [--skip-legacy]
+"""
+import argparse, contextlib, importlib.util, io, random, sys, time
+from collections import defaultdict, deque
+from pathlib import Path
+
+SCRIPT = Path(__file__).resolve().parent.parent / "转换 - 副本.py"
+
+
+def load_tool():
+    sys.path.insert(0, str(SCRIPT.parent))
+    spec = importlib.util.spec_from_file_location("aion_tool", SCRIPT)
+    mod = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(mod)
+    mod.load_deps()
+    return mod
+
+
+def make_bom(pd, rows, raw=500, seed=42, ref_ratio=0.3):
+    """合成 BOM：每个产品 1~9 种材料，取自原料或编号更小的产品（概率 ref_ratio），保证无环"""
+    rnd = random.Random(seed)
+    data = []
+    for i in range(rows):
+        r = {'制作职业': f'职业{i % 7}', '名称': f'产品{i}', '需求等级': f'专业{i % 50}', '计算系数': 1}
+        for k in range(1, 10):
+            if k <= rnd.randint(1, 9):
+                use_prod = i and rnd.random() < ref_ratio
+                r[f'材料{k}'] = f'产品{rnd.randrange(i)}' if use_prod else f'原料{rnd.randrange(raw)}'
+                r[f'数量{k}'] = rnd.randint(1, 20)
+            else:
+                r[f'材料{k}'], r[f'数量{k}'] = '', ''
+        data.append(r)
+    return pd.DataFrame(data).astype(str)
+
+
+def legacy_build(df, base_map, safe_int, parse_level):
+    """v5.5 原始实现（三次 iterrows + df.iloc），仅用于基准对照"""
+    name2id = base_map.copy()
+    all_prod = set(df['名称'].astype(str).str.strip().tolist())
+    for idx, r in df.iterrows():
+        name = str(r.get('名称', '')).strip()
+        if name and name not in name2id:
+            name2id[name] = f"COMP{len(name2id):04d}"
+
+    graph, reverse, nodes = defaultdict(list), defaultdict(list), set()
+    for _, r in df.iterrows():
+        prod = str(r.get('名称', '')).strip()
+        if not prod:
+            continue
+        nodes.add(prod)
+        for i in range(1, 10):
+            m = str(r.get(f'材料{i}', '')).strip()
+            if m:
+                nodes.add(m)
+                graph[prod].append(m)
+                reverse[m].append(prod)
+    in_deg = {n: 0 for n in nodes}
+    for vs in graph.values():
+        for v in vs:
+            in_deg[v] += 1
+    q = deque([n for n, d in in_deg.items() if d == 0])
+    out = []
+    while q:
+        cur = q.popleft()
+        if cur in df['名称'].values:
+            out.append(cur)
+        for d in reverse[cur]:
+            in_deg[d] -= 1
+            if in_deg[d] == 0:
+                q.append(d)
+    exist = set(out)
+    for _, r in df.iterrows():
+        name = str(r.get('名称', '')).strip()
+        if name and name not in exist:
+            out.append(name)
+    name2idx = {str(r['名称']).strip(): i for i, r in df.iterrows() if str(r.get('名称', '')).strip()}
+    sorted_idx = [name2idx[n] for n in out if n in name2idx]
+
+    recipes = {}
+    for idx in sorted_idx:
+        r = df.iloc[idx]
+        name = str(r.get('名称', '')).strip()
+        mats = []
+        for i in range(1, 10):
+            m_name = str(r.get(f'材料{i}', '')).strip()
+            qty = safe_int(r.get(f'数量{i}', '0'), 0)
+            if not m_name or qty <= 0:
+                continue
+            if m_name not in name2id:
+                name2id[m_name] = f"COMP{len(name2id):04d}" if m_name in all_prod else m_name
+            mid = name2id[m_name]
+            mats.append({"ref" if m_name in all_prod else "id": mid, "qty": qty, "name": m_name})
+        lvl_str = str(r.get('需求等级', '')).strip()
+        recipes[name2id[name]] = {
+            "id": name2id[name], "name": name, "level": lvl_str, "levelNum": parse_level(lvl_str)[1],
+            "profession": str(r.get('制作职业', '')).strip(),
+            "calculation_coefficient": safe_int(r.get('计算系数', 1), 1) or 1, "materials": mats
+        }
+    return recipes, name2id
+
+
+def timed(label, rows, fn):
+    with contextlib.redirect_stdout(io.StringIO()):
+        t0 = time.perf_counter()
+        res = fn()
+        dt = time.perf_counter() - t0
+    print(f"  {label:<8} {dt:8.3f}s  {rows / dt:12,.0f} 行/秒")
+    return res
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=20000)
+    ap.add_argument('--skip-legacy', action='store_true', help='跳过旧实现（大行数时旧实现为平方复杂度）')
+    args = ap.parse_args()
+
+    tool = load_tool()
+    df = make_bom(tool.pd, args.rows)
+    base_map = {f'原料{i}': f'M{i + 1:03d}' for i in range(500)}
+    print(f"[bench] BOM {args.rows:,} 行")
+    new = timed('columnar', args.rows, lambda: tool.build_recipes(df, base_map))
+    if not args.skip_legacy:
+        old = timed('legacy', args.rows, lambda: legacy_build(df, base_map, tool.safe_int, tool.parse_level))
+        assert old[0] == new[0], "新旧实现结果不一致"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,111 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+HTML 内嵌数据基准：对比 legacy（缩进完整对象）与 compact（字符串表 + 整数数组）的体积与解析耗时
+解析耗时用 node 执行页面脚本中「数据注入」一段（到「全局变量」为止）测得，并核对两种格式还原出的物料与配方完全一致；
+未安装 node 时只报告体积。
+用法：python benchmarks/bench_payload.py [--rows 5000] [--repeat 20]
+"""
+import argparse, contextlib, io, json, shutil, subprocess, sys, tempfile
+from pathlib import Path
+
+from bench_bom import load_tool, make_bom
+
+NODE_TIMER = r"""
+const fs = require('fs'), vm = require('vm');
+const src = fs.readFileSync(process.argv[2], 'utf8');
+const code = src.slice(src.indexOf('<script>') + 8, src.indexOf('// ====================  全局变量'));
+const runs = +process.argv[3], times = [];
+for (let i = 0; i < runs; i++) {
+  const t0 = process.hrtime.bigint();
+  vm.runInNewContext(code, {});
+  times.push(Number(process.hrtime.bigint() - t0) / 1e6);
+}
+const first = times[0];
+times.sort((a, b) => a - b);
+console.log(first.toFixed(2), times[times.length >> 1].toFixed(2));
+"""
+
+# 执行同一段数据注入代码，输出还原后的物料与配方（紧凑格式的材料列表按需还原，这里逐个读取）
+NODE_DUMP = r"""
+const fs = require('fs'), vm = require('vm');
+const src = fs.readFileSync(process.argv[2], 'utf8');
+const code = src.slice(src.indexOf('<script>') + 8, src.indexOf('// ====================  全局变量'));
+const ctx = {};
+vm.runInNewContext(code + `;__out = JSON.stringify({materials: RAW_MATERIALS, recipes: Object.fromEntries(
+  Object.entries(PRODUCT_BOM).map(([id, p]) => [id, {...p, materials: p.materials}]))});`, ctx);
+fs.writeFileSync(process.argv[3], ctx.__out);
+"""
+
+
+def render(tool, mats, recipes, payload, out):
+    tool.CFG["PAYLOAD"], tool.CFG["HTML_OUT"] = payload, str(out)
+    with contextlib.redirect_stdout(io.StringIO()):
+        tool.generate_html(mats, recipes)
+    html = out.read_text(encoding='utf-8')
+    data = html[html.index('<script>'):html.index('// ====================  全局变量')]
+    return len(html.encode('utf-8')), len(data.encode('utf-8'))
+
+
+def decoded(node, dump, html, out):
+    subprocess.run([node, str(dump), str(html), str(out)], check=True)
+    return json.loads(out.read_text(encoding='utf-8'))
+
+
+def parse_ms(node, timer, html, repeat):
+    """(首次, 中位数) 毫秒；首次含冷启动编译，更接近真实页面加载"""
+    res = subprocess.run([node, str(timer), str(html), str(repeat)], capture_output=True, text=True, check=True)
+    first, median = map(float, res.stdout.split())
+    return first, median
+
+
+def datasets(tool, rows, tmp):
+    root = Path(tool.__file__).parent
+    tool.CFG["MATERIAL_CSV"], tool.CFG["BOM_CSV"] = str(root / "aion-物料.csv"), str(root / "bom.csv")
+    # 编码缓存写到临时目录，也不记物价历史，基准不在仓库里留下文件
+    tool.CFG.update(CACHE_DIR=str(tmp / "cache"), HISTORY_DB="")
+    with contextlib.redirect_stdout(io.StringIO()):
+        mats = tool.convert_material()
+        recipes, _ = tool.convert_bom({m['name']: m['id'] for m in mats})
+    yield "bundled", mats, recipes
+    if rows:
+        syn_mats = [{"id": f"M{i + 1:03d}", "name": f"天族原料{i}/魔族原料{i}", "professions": [f"职业{i % 7}"],
+                     "source": "采集", "price": 100 + i} for i in range(500)]
+        base = {m['name']: m['id'] for m in syn_mats}
+        df = make_bom(tool.pd, rows, ref_ratio=0.05)
+        df = df.replace({f'原料{i}': f'天族原料{i}/魔族原料{i}' for i in range(500)})
+        with contextlib.redirect_stdout(io.StringIO()):
+            recipes, _ = tool.build_recipes(df, base)
+        yield f"synthetic {rows:,}", syn_mats, recipes
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=5000, help='合成 BOM 行数（0 跳过）')
+    ap.add_argument('--repeat', type=int, default=20, help='每种格式解析次数（取中位数）')
+    args = ap.parse_args()
+
+    tool = load_tool()
+    node = shutil.which('node')
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        timer = tmp / "timer.js"
+        timer.write_text(NODE_TIMER, encoding='utf-8')
+        dump = tmp / "dump.js"
+        dump.write_text(NODE_DUMP, encoding='utf-8')
+        for label, mats, recipes in datasets(tool, args.rows, tmp):
+            print(f"[bench] {label}: 物料 {len(mats):,} / 配方 {len(recipes):,}")
+            pages = {}
+            for payload in ("legacy", "compact"):
+                out = pages[payload] = tmp / f"{payload}.html"
+                total, data = render(tool, mats, recipes, payload, out)
+                ms = "首次 {:7.2f} ms  中位 {:7.2f} ms".format(*parse_ms(node, timer, out, args.repeat)) if node else "(无 node)"
+                print(f"  {payload:<8} HTML {total / 1024:9.1f} KB  数据段 {data / 1024:9.1f} KB  解析 {ms}")
+            if node:
+                legacy, compact = (decoded(node, dump, pages[k], tmp / f"{k}.json") for k in ("legacy", "compact"))
+                assert legacy == compact, "compact 还原结果与 legacy 不一致"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
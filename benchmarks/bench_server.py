@@ -0,0 +1,186 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+本地定价服务压测：用合成 CSV 启动 serve 子进程，多个 keep-alive 连接并发请求成本、构成、BOM 树与搜索接口，
+统计每秒请求数与延迟分位数；压测前后核对响应（成本 / 构成 / BOM 树彼此一致、检索命中、HEAD 无正文），
+任何非 200 响应或核对失败都以退出码 1 结束；--reload 时压测中途把物料单价翻倍，验证热重载期间请求不中断且成本随之翻倍
+用法：python benchmarks/bench_server.py [--rows 20000] [--clients 32] [--duration 10] [--reload]
+"""
+import argparse, asyncio, json, random, socket, subprocess, sys, tempfile, time
+from pathlib import Path
+from urllib.parse import quote
+
+from bench_bom import SCRIPT, load_tool, make_bom
+
+
+async def request(reader, writer, path, method='GET'):
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: bench\r\n\r\n".encode())
+    line = await reader.readline()
+    if not line.startswith(b'HTTP/1.1 '):
+        raise AssertionError(f"响应状态行无效: {line[:80]!r}")
+    status = int(line.split()[1])
+    length = 0
+    while (line := await reader.readline()) != b'\r\n':
+        k, _, v = line.decode('latin-1').partition(':')
+        if k.lower() == 'content-length':
+            length = int(v)
+    return status, (length if method == 'HEAD' else await reader.readexactly(length))
+
+
+async def client(port, paths, deadline, stats, seed):
+    rnd = random.Random(seed)
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        while time.perf_counter() < deadline:
+            kind, path = rnd.choice(paths)
+            t0 = time.perf_counter()
+            status, body = await request(reader, writer, path)
+            stats.setdefault(kind, []).append(time.perf_counter() - t0)
+            if status != 200 or 'error' in json.loads(body):
+                stats.setdefault('errors', []).append(status)
+    finally:
+        writer.close()
+
+
+async def load_test(port, paths, clients, duration, on_half=None):
+    stats = {}
+    deadline = time.perf_counter() + duration
+    tasks = [asyncio.create_task(client(port, paths, deadline, stats, k)) for k in range(clients)]
+    if on_half:
+        await asyncio.sleep(duration / 2)
+        await asyncio.get_running_loop().run_in_executor(None, on_half)
+    await asyncio.gather(*tasks)
+    return stats
+
+
+async def fetch(port, path):
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        status, body = await request(reader, writer, path)
+        if status != 200:
+            raise AssertionError(f"{path} → {status}: {body.decode('utf-8', 'replace')}")
+        return json.loads(body)
+    finally:
+        writer.close()
+
+
+async def verify(port, names):
+    """逐个产品核对：/api/cost 与 BOM 树根节点、原料构成合计、子节点合计一致；按名称检索能命中；HEAD 只回响应头"""
+    costs = {}
+    for n in names:
+        q = quote(n)
+        cost = (await fetch(port, f'/api/cost?product={q}&rate=50'))['products'][0]['cost']
+        parts = await fetch(port, f'/api/breakdown?product={q}&rate=50')
+        tree = (await fetch(port, f'/api/tree?product={q}&rate=50'))['tree']
+        tol = max(0.01 * cost, 0.01 * len(parts['materials']) + 0.01)
+        assert parts['cost'] == cost == tree['cost'], (n, cost, parts['cost'], tree['cost'])
+        assert abs(sum(m['cost'] for m in parts['materials']) - cost) <= tol, (n, 'breakdown')
+        assert abs(sum(c['cost'] for c in tree.get('children', [])) - cost) <= tol, (n, 'tree')
+        found = await fetch(port, f'/api/search?q={q}&limit=200')
+        assert n in [p['name'] for p in found['products']], (n, 'search')
+        costs[n] = cost
+    reader, writer = await asyncio.open_connection('127.0.0.1', port)
+    try:
+        path = f'/api/cost?product={quote(names[0])}'
+        _, body = await request(reader, writer, path)
+        status, length = await request(reader, writer, path, 'HEAD')
+        assert status == 200 and length == len(body), ('HEAD', length, len(body))
+        assert (await request(reader, writer, '/api/status'))[0] == 200, 'HEAD 后连接错位'
+    finally:
+        writer.close()
+    return costs
+
+
+def wait_ready(port, proc, timeout):
+    deadline = time.perf_counter() + timeout
+    while time.perf_counter() < deadline:
+        if proc.poll() is not None:
+            raise SystemExit(f"服务进程已退出（退出码 {proc.returncode}）")
+        try:
+            return asyncio.run(fetch(port, '/api/status'))
+        except OSError:
+            time.sleep(0.2)
+    raise SystemExit(f"服务 {timeout}s 内未就绪")
+
+
+def free_port():
+    with socket.socket() as s:
+        s.bind(('127.0.0.1', 0))
+        return s.getsockname()[1]
+
+
+def report(stats, elapsed):
+    errors = stats.pop('errors', [])
+    total = sum(len(v) for v in stats.values())
+    print(f"  {'接口':<12}{'请求数':>10}{'P50 ms':>10}{'P99 ms':>10}")
+    for kind, lat in sorted(stats.items()):
+        lat.sort()
+        print(f"  {kind:<12}{len(lat):>10,}{lat[len(lat) // 2] * 1000:>10.2f}{lat[int(len(lat) * 0.99)] * 1000:>10.2f}")
+    print(f"  合计 {total:,} 个请求，{total / elapsed:,.0f} 请求/秒，错误 {len(errors)} 个")
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=20000, help='合成 BOM 行数')
+    ap.add_argument('--clients', type=int, default=32, help='并发 keep-alive 连接数')
+    ap.add_argument('--duration', type=float, default=10, help='压测秒数')
+    ap.add_argument('--reload', action='store_true', help='压测中途改写物料表单价，触发热重载')
+    args = ap.parse_args()
+
+    tool = load_tool()
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        mat_csv, bom_csv = tmp / "mat.csv", tmp / "bom.csv"
+        mat = tool.pd.DataFrame({
+            '原料名称': [f'原料{i}' for i in range(500)], '制作职业': '职业0', '来源': '采集', '单价': range(100, 600),
+        })
+        mat.to_csv(mat_csv, index=False, encoding='utf-8-sig')
+        make_bom(tool.pd, args.rows).to_csv(bom_csv, index=False, encoding='utf-8-sig')
+
+        port = free_port()
+        t0 = time.perf_counter()
+        proc = subprocess.Popen([sys.executable, str(SCRIPT), 'serve', '--headless', '--history', '',
+                                 '--material-csv', str(mat_csv), '--bom-csv', str(bom_csv),
+                                 '--port', str(port), '--interval', '0.5'],
+                                stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL)
+        try:
+            status = wait_ready(port, proc, 300)
+            print(f"[bench] 服务就绪 {time.perf_counter() - t0:.2f}s：物料 {status['materials']} 种，配方 {status['recipes']:,} 条")
+
+            rnd = random.Random(0)
+            names = [f'产品{rnd.randrange(args.rows)}' for _ in range(200)]
+            before = asyncio.run(verify(port, names[:20]))
+            print(f"[bench] 响应核对通过（{len(before)} 个产品）")
+            paths = ([('cost', f'/api/cost?product={quote(n)}&rate={rnd.choice((100, 50, 25))}') for n in names]
+                     + [('breakdown', f'/api/breakdown?product={quote(n)}&rate=50') for n in names]
+                     + [('tree', f'/api/tree?product={quote(n)}&rate=50&depth=3') for n in names]
+                     + [('search', f'/api/search?q={quote(n[:4])}&limit=20') for n in names])
+
+            def rewrite():
+                mat.assign(单价=mat['单价'] * 2).to_csv(mat_csv, index=False, encoding='utf-8-sig')
+
+            print(f"[bench] {args.clients} 个连接 × {args.duration:g}s" + ("（中途改写物料表）" if args.reload else ""))
+            t0 = time.perf_counter()
+            stats = asyncio.run(load_test(port, paths, args.clients, args.duration, rewrite if args.reload else None))
+            errors = len(stats.get('errors', []))
+            report(stats, time.perf_counter() - t0)
+            if args.reload:
+                after = asyncio.run(fetch(port, '/api/status'))
+                print(f"  热重载 {after['reloads']} 次，数据版本 {status['version']} → {after['version']}")
+                if after['reloads'] < 1:
+                    raise AssertionError("压测期间未发生热重载")
+            after_costs = asyncio.run(verify(port, names[:20]))
+            for n, cost in before.items():
+                want = 2 * cost if args.reload else cost
+                assert abs(after_costs[n] - want) <= 0.01 * want + 0.02, (n, cost, after_costs[n])
+            if errors:
+                print(f"[✗] 压测期间 {errors} 个请求失败")
+                return 1
+        finally:
+            proc.terminate()
+            proc.wait()
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,62 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+数据快照基准：对比从 CSV 重新解析（pandas + chardet）与内存映射二进制快照的载入耗时
+用法：python benchmarks/bench_snapshot.py [--rows 20000] [--repeat 5]
+"""
+import argparse, contextlib, io, statistics, sys, tempfile, time
+from pathlib import Path
+
+from bench_bom import load_tool, make_bom
+
+
+def best_ms(fn, repeat):
+    times = []
+    for _ in range(repeat):
+        with contextlib.redirect_stdout(io.StringIO()):
+            t0 = time.perf_counter()
+            res = fn()
+            times.append((time.perf_counter() - t0) * 1000)
+    return res, min(times), statistics.median(times)
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=20000, help='合成 BOM 行数')
+    ap.add_argument('--repeat', type=int, default=5)
+    args = ap.parse_args()
+
+    tool = load_tool()
+    from aion_snapshot import load_snapshot, save_snapshot
+    with tempfile.TemporaryDirectory() as tmp:
+        tmp = Path(tmp)
+        mat_csv, bom_csv, snap = tmp / "mat.csv", tmp / "bom.csv", tmp / "data.snap"
+        tool.pd.DataFrame({
+            '原料名称': [f'原料{i}' for i in range(500)], '制作职业': '职业0', '来源': '采集', '单价': range(100, 600),
+        }).to_csv(mat_csv, index=False, encoding='utf-8-sig')
+        make_bom(tool.pd, args.rows).to_csv(bom_csv, index=False, encoding='utf-8-sig')
+        tool.CFG.update(MATERIAL_CSV=str(mat_csv), BOM_CSV=str(bom_csv), CACHE_DIR=str(tmp / "cache"), HISTORY_DB="")
+
+        def parse():
+            mats = tool.convert_material()
+            return (mats, *tool.convert_bom({m['name']: m['id'] for m in mats}))
+
+        def mapped():
+            s = load_snapshot(snap)
+            return s.material_items(), s.recipes(), s.name2id()
+
+        print(f"[bench] BOM {args.rows:,} 行，物料 500 种")
+        data, best, med = best_ms(parse, args.repeat)
+        print(f"  csv       最快 {best:9.1f} ms  中位 {med:9.1f} ms")
+        save_snapshot(snap, *data)
+        print(f"  快照文件  {snap.stat().st_size / 1024:9.1f} KB（CSV {(mat_csv.stat().st_size + bom_csv.stat().st_size) / 1024:.1f} KB）")
+        _, best, med = best_ms(lambda: load_snapshot(snap), args.repeat)
+        print(f"  mmap      最快 {best:9.1f} ms  中位 {med:9.1f} ms（仅映射）")
+        res, best, med = best_ms(mapped, args.repeat)
+        print(f"  snapshot  最快 {best:9.1f} ms  中位 {med:9.1f} ms（还原为 Python 结构）")
+        assert res == data, "快照还原结果与 CSV 解析不一致"
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
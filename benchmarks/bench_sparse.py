@@ -0,0 +1,79 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+稀疏矩阵 BOM 基准：对比逐产品字典递归展开与按拓扑分层稀疏矩阵乘法展开的耗时，
+以及多组单价下逐组 price_all 与一次稀疏 × 稠密乘法（price_scenarios）的定价吞吐
+用法：python benchmarks/bench_sparse.py [--rows 20000] [--ref-ratio 0.1] [--scenarios 200]
+"""
+import argparse, contextlib, io, sys, time
+
+import numpy as np
+
+from bench_bom import load_tool, make_bom
+
+
+def legacy_flatten(recipes, material_ids):
+    """逐产品字典递归展开（分层稀疏乘法之前的实现），仅用于基准对照"""
+    from aion_cost import _flatten_one, _flatten_path
+    col_of = {mid: i for i, mid in enumerate(material_ids)}
+    flat = {}
+    for pid, p in recipes.items():
+        vec = _flatten_one(p, col_of, lambda ref: flat.get(ref))
+        if vec is not None:
+            flat[pid] = vec
+    flat.update({pid: _flatten_path(pid, recipes, col_of, flat, frozenset()) for pid in recipes if pid not in flat})
+    out = {"cols": list(material_ids), "rows": {}, "ptr": [0], "col": [], "depth": [], "qty": []}
+    for pid in recipes:
+        out["rows"][pid] = len(out["ptr"]) - 1
+        for (c, d), q in sorted(flat[pid].items()):
+            out["col"].append(c)
+            out["depth"].append(d)
+            out["qty"].append(q)
+        out["ptr"].append(len(out["col"]))
+    return out
+
+
+def timed(label, fn):
+    t0 = time.perf_counter()
+    res = fn()
+    dt = time.perf_counter() - t0
+    print(f"  {label:<20} {dt:8.3f}s")
+    return res, dt
+
+
+def main():
+    ap = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    ap.add_argument('--rows', type=int, default=20000, help='合成 BOM 行数')
+    ap.add_argument('--ref-ratio', type=float, default=0.1, help='材料引用子配方的概率（越大层数越深、展开越稠密）')
+    ap.add_argument('--scenarios', type=int, default=200, help='单价场景数')
+    ap.add_argument('--rate', type=float, default=50)
+    args = ap.parse_args()
+
+    tool = load_tool()
+    from aion_cost import CostEngine, flatten_recipes
+    df = make_bom(tool.pd, args.rows, ref_ratio=args.ref_ratio)
+    base_map = {f'原料{i}': f'M{i + 1:03d}' for i in range(500)}
+    with contextlib.redirect_stdout(io.StringIO()):
+        recipes, _ = tool.build_recipes(df, base_map)
+    mids = list(base_map.values())
+    print(f"[bench] BOM {args.rows:,} 行，子配方引用概率 {args.ref_ratio}")
+
+    old, t_old = timed('展开 字典递归', lambda: legacy_flatten(recipes, mids))
+    new, t_new = timed('展开 分层稀疏乘法', lambda: flatten_recipes(recipes, mids))
+    assert old == new, "新旧展开结果不一致"
+    print(f"  展开非零元 {len(new['col']):,}，加速 {t_old / t_new:.1f}×")
+
+    materials = [{'id': mid, 'name': name, 'price': 100} for name, mid in base_map.items()]
+    engine = CostEngine(recipes, materials)
+    prices = np.random.default_rng(0).uniform(1, 1000, (args.scenarios, len(mids)))
+    print(f"[bench] {args.scenarios} 组单价 × {len(engine.products):,} 个产品（成功率 {args.rate}%）")
+    loop, t_loop = timed('逐组 price_all', lambda: [engine.price_all(p, args.rate) for p in prices])
+    batch, t_batch = timed('price_scenarios', lambda: engine.price_scenarios(prices, args.rate))
+    ref = np.array([[c[pid] for pid in engine.products] for c in loop])
+    assert np.allclose(ref, batch, rtol=1e-9), "逐组定价与矩阵乘法结果不一致"
+    print(f"  {args.scenarios / t_loop:,.0f} → {args.scenarios / t_batch:,.0f} 组/秒")
+    return 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
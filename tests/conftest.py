@@ -0,0 +1,8 @@
+# -*- coding: utf-8 -*-
+"""测试共用的配方构造；pytest 会把本目录加入 sys.path，测试模块以 from conftest import recipe 引用"""
+
+
+def recipe(pid, materials, coef=1, name=None):
+    """最小配方记录（与 convert_bom 输出同结构），name 缺省时与编号相同"""
+    return {"id": pid, "name": name or pid, "level": "专业1", "levelNum": 1, "profession": "锻造",
+            "calculation_coefficient": coef, "materials": materials}
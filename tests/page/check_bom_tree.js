@@ -0,0 +1,63 @@
+// BOM 树：按路径索引的增量更新与整树重绘结果一致，只改写变化的文本；展开状态按路径保留；遍历不改写配方数据
+const assert = require('assert');
+const { load } = require('./harness');
+const { g } = load();
+const BOM = g('PRODUCT_BOM'), M = g('ALL_MATERIALS_MAP');
+
+function depth(id, seen = new Set()) {
+  if (seen.has(id)) return 0;
+  seen.add(id);
+  let d = 0;
+  for (const m of BOM[id].materials) if (m.ref && BOM[m.ref]) d = Math.max(d, depth(m.ref, new Set(seen)));
+  return d + 1;
+}
+let root = null, deepest = 0;
+for (const id in BOM) {
+  const d = depth(id);
+  if (d > deepest) [root, deepest] = [id, d];
+}
+// 从 HTML 中按 data-path 收集各节点的 data-f 文本字段，代替 DOM 查询
+function index(html) {
+  const nodes = new Map(), re = /data-path="([^"]+)"|data-f="(\w+)">([^<]*)</g;
+  let cur;
+  for (let m; (m = re.exec(html));) {
+    if (m[1]) nodes.set(m[1], cur = {});
+    else cur[m[2]] = { textContent: m[3] };
+  }
+  return nodes;
+}
+
+const before = JSON.stringify(BOM[root]);
+const html = g('renderBOMTree')(root);
+assert.strictEqual(JSON.stringify(BOM[root]), before, 'renderBOMTree 改写了配方数据');
+assert.strictEqual((html.match(/<div/g) || []).length, (html.match(/<\/div>/g) || []).length, 'div 未闭合');
+const view = g('bomView');
+view.nodes = index(html);
+assert(view.nodes.size > 1);
+
+let writes = 0, fields = 0;
+for (const f of view.nodes.values()) {
+  for (const k in f) {
+    let v = f[k].textContent;
+    fields++;
+    Object.defineProperty(f[k], 'textContent', { get: () => v, set: x => { v = x; writes++; } });
+  }
+}
+const mid = Object.keys(M).find(id => html.includes(M[id].name.split('/')[0]));
+M[mid].price += 1234;
+g('currentSuccessRate = 40');
+g('updateBOMTree')(root);
+const fresh = index(g('renderBOMTree')(root));
+for (const [path, f] of fresh) for (const k in f) assert.strictEqual(view.nodes.get(path)[k].textContent, f[k].textContent, `${path} ${k}`);
+assert(writes > 0 && writes < fields, `改写 ${writes} / ${fields} 个字段`);
+const changed = writes;
+g('updateBOMTree')(root);
+assert.strictEqual(writes, changed, '数据未变时不应改写任何字段');
+
+// 中间节点的子节点容器紧跟在其标题之后
+const path = [...fresh.keys()].find(p => p !== root && fresh.has(`${p}/0`));
+const open = h => h.slice(h.indexOf(`data-path="${path}"`)).match(/class="children( expanded)?"/)[1] !== undefined;
+assert(!open(html));
+view.expanded = new Set([root, path]);
+assert(open(g('renderBOMTree')(root)), '展开状态未保留');
+console.log(`bom tree: ${root} 深度 ${deepest}，${view.nodes.size} 个节点，改价后改写 ${changed} / ${fields} 个字段`);
@@ -0,0 +1,29 @@
+// 成本缓存：随机改价、切换成功率后，带缓存的 productCost 与不经缓存的计算一致；改价只失效用到该物料的产品；
+// 按展开行取得的物料集合与递归遍历一致
+const assert = require('assert');
+const { load } = require('./harness');
+const { g } = load();
+const BOM = g('PRODUCT_BOM'), M = g('ALL_MATERIALS_MAP'), ids = Object.keys(BOM), mids = Object.keys(M);
+const cache = g('costCache'), cost = g('productCost'), uncached = g('computeProductCost'), materialIds = g('getProductMaterialIds');
+
+let dropped = 0;
+for (let it = 0; it < 300; it++) {
+  if (it % 50 === 0) g(`currentSuccessRate = ${[100, 40, 25][(it / 50) % 3]}`);
+  ids.forEach(id => cost(id));
+  const before = cache.size, mid = mids[(it * 37) % mids.length];
+  g('setMaterialPrice')(mid, M[mid].price + 17 + it);
+  dropped += before - cache.size;
+  for (const id of cache.keys()) assert(!materialIds(id).has(mid), `${id} 用到 ${mid}，改价后仍在缓存中`);
+  for (const id of ids) {
+    const a = cost(id).cost, b = uncached(id).cost;
+    assert(Math.abs(a - b) <= 1e-6 * Math.max(1, b), `${id}: 缓存 ${a} ≠ 重算 ${b}`);
+  }
+}
+assert(dropped / 300 < ids.length, '每次改价都清空了全部缓存');
+
+// 未登记物料（__x）只用于绕过展开行，走递归遍历；结果只保留物料表中存在的物料
+for (const id of ids) {
+  const flat = materialIds(id), walked = [...materialIds(id, new Set(['__x']))].filter(x => M[x]);
+  assert.deepStrictEqual(new Set(walked), new Set(flat), `${id} 物料集合不一致`);
+}
+console.log(`cost cache: 300 次改价后 ${ids.length} 个产品缓存与重算一致，平均每次失效 ${(dropped / 300).toFixed(1)} 个`);
@@ -0,0 +1,22 @@
+// 自制 / 购买：含循环依赖时最优成本不高于全自制成本（productCost），买不到的自引用产品按全自制计
+const assert = require('assert');
+const { load, addCycles } = require('./harness');
+const { g } = load();
+const ids = addCycles(g), cost = g('productCost'), bestCost = g('bestCost');
+
+for (const market of [null, 5]) {
+  if (market) g(`ALL_MATERIALS_MAP.YB = { id: 'YB', name: 'YB', price: ${market} }`);
+  for (const rate of [100, 50]) {
+    g(`currentSuccessRate = ${rate}; bestCache.clear()`);
+    for (const id of ids) {
+      const best = bestCost(id), full = cost(id).cost;
+      assert(best.craft <= full * (1 + 1e-12), `${rate}% ${id}: 自制 ${best.craft} > 全自制 ${full}`);
+      assert.strictEqual(best.cost, best.buy !== null ? Math.min(best.craft, best.buy) : best.craft);
+    }
+  }
+}
+g('currentSuccessRate = 100; bestCache.clear()');
+assert.strictEqual(bestCost('XA').craft, 10);
+assert.strictEqual(bestCost('YA').cost, 15);
+assert.deepStrictEqual({ ...g('makeBuyPlan')('YA') }, { YB: 1 });
+console.log(`make or buy: ${ids.length} 个环上产品最优成本不高于全自制`);
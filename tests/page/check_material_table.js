@@ -0,0 +1,65 @@
+// 物料表虚拟滚动：任意滚动位置下 DOM 中只有窗口内的行，行序与预计算排序一致（高亮物料在前），占位行高度补足其余行；
+// 表格隐藏时首次渲染（尺寸全为 0）不会锁定默认行高
+const assert = require('assert');
+const { load } = require('./harness');
+const { g, els, ctx } = load();
+
+// 桩 tbody：只模拟虚拟滚动用到的子节点增删与几何信息；行高 ROW 与默认 48 不同，检验按实测行高计算窗口
+const view = { scroll: 0, rowH: 40, header: 300, height: 800, hidden: false };
+function node() {
+  return {
+    style: {}, parent: null,
+    remove() { const c = this.parent.children; c.splice(c.indexOf(this), 1); this.parent = null; },
+    getBoundingClientRect: () => ({ height: view.hidden ? 0 : view.rowH }),
+    set innerHTML(v) { this._h = v; }, get innerHTML() { return this._h; },
+  };
+}
+const tbody = {
+  children: [],
+  closest: () => ({ getBoundingClientRect: () => ({ top: 0, bottom: view.hidden ? 0 : view.height }) }),
+  getBoundingClientRect: () => ({ top: view.hidden ? 0 : view.header - view.scroll }),
+  set innerHTML(v) { this.children = [node(), node()]; this.children.forEach(c => c.parent = this); },
+  get firstElementChild() { return this.children[0]; }, get lastElementChild() { return this.children.at(-1); },
+  insertBefore(n, ref) { n.parent = this; this.children.splice(this.children.indexOf(ref), 0, n); },
+};
+els.materialTableBody = tbody;
+ctx.document.createElement = node;
+ctx.window = { innerHeight: view.height };
+
+// 追加 2 万条合成物料，并把它们并入预计算排序（页面数组属于 vm 上下文，比较前用 Array.from 转为本上下文数组）
+const RAW = g('RAW_MATERIALS');
+for (let i = 0; i < 20000; i++) RAW.push({ id: 'X' + i, name: `料${i}/魔料${i}`, professions: ['p'], source: '采集', price: i });
+const order = RAW.map((m, i) => i).sort((a, b) => RAW[a].name.localeCompare(RAW[b].name));
+if (g('MATERIAL_ORDER')) g('MATERIAL_ORDER')[g('currentRace')] = order;
+else g('materialOrderCache')[g('currentRace')] = order;
+
+function check() {
+  const mv = g('matView'), rows = tbody.children.slice(1, -1);
+  const ids = rows.map(r => /data-material-id="([^"]+)"/.exec(r._h)[1]);
+  assert.deepStrictEqual(ids, Array.from(mv.list.slice(mv.first, mv.last), m => m.id), `窗口 ${mv.first}`);
+  assert.strictEqual(tbody.children[0].style.height, `${mv.first * view.rowH}px`);
+  assert.strictEqual(tbody.children.at(-1).style.height, `${(mv.list.length - mv.last) * view.rowH}px`);
+  assert(mv.first <= Math.floor(Math.max(0, view.scroll - view.header) / view.rowH));
+  return rows.length;
+}
+const highlight = new Set(['X5', RAW[0].id]);
+view.hidden = true;
+g('initMaterialTable')(highlight);
+const mv = g('matView');
+assert.strictEqual(mv.rowH, 0, '表格隐藏时记住了行高');
+view.hidden = false;
+g('renderMaterialRows')();
+assert.strictEqual(mv.rowH, view.rowH, '未按实测行高计算');
+check();
+g('initMaterialTable')(highlight);
+assert.deepStrictEqual(new Set(mv.list.slice(0, mv.used).map(m => m.id)), new Set([...highlight].filter(id => RAW.find(m => m.id === id).source !== '商店')));
+const rest = Array.from(mv.list.slice(mv.used), m => m.id), want = Array.from(order, i => RAW[i]).filter(m => m.source !== '商店' && !highlight.has(m.id)).map(m => m.id);
+assert.deepStrictEqual(rest, want, '行序与预计算排序不一致');
+const shown = check();
+assert(shown > 0 && shown < 100, `渲染了 ${shown} 行`);
+for (const s of [100, 500, 520, 20000, 19990, 0, 799000, 1e9]) {
+  view.scroll = s;
+  g('renderMaterialRows')();
+  check();
+}
+console.log(`material table: ${mv.list.length} 条物料，窗口 ${shown} 行，滚动位置全部一致`);
@@ -0,0 +1,32 @@
+// 产品搜索：倒排索引的结果与逐条比对检索键一致，且包含旧版线性过滤（名称 / 本地化名称 / 编号）的全部结果
+const assert = require('assert');
+const { load } = require('./harness');
+const { g } = load();
+const LIST = g('PRODUCT_LIST'), SEARCH = g('SEARCH'), localized = g('getLocalizedName');
+assert(SEARCH, '页面未内嵌检索索引');
+const keyOf = {};
+SEARCH.ids.forEach((id, k) => keyOf[id] = SEARCH.keys[k]);
+const race = g('currentRace');
+const linear = (q, prof) => LIST.filter(p => (prof === 'all' || p.profession === prof) && (!q ||
+  localized(p.name, race).toLowerCase().includes(q) || p.name.toLowerCase().includes(q) || p.id.toLowerCase().includes(q)));
+
+const queries = new Set(['', 'zzzz', 'comp', '0']);
+LIST.forEach(p => {
+  const name = Array.from(p.name.toLowerCase());
+  for (const [a, b] of [[0, 1], [0, 2], [1, 3], [2, 5]]) if (name.length >= b) queries.add(name.slice(a, b).join(''));
+  queries.add(p.id.toLowerCase().slice(-3));
+});
+const profs = ['all', ...new Set(LIST.map(p => p.profession))];
+let checked = 0;
+for (const q of queries) {
+  for (const prof of checked % 7 ? ['all'] : profs) {
+    g(`currentProfession = ${JSON.stringify(prof)}`);
+    const got = g('searchProducts')(q).map(p => p.id);
+    const want = LIST.filter(p => (prof === 'all' || p.profession === prof) && (!q || keyOf[p.id].includes(q))).map(p => p.id);
+    assert.deepStrictEqual(got, want, `查询 ${JSON.stringify(q)}（${prof}）与逐条比对不一致`);
+    const hits = new Set(got);
+    for (const p of linear(q, prof)) assert(hits.has(p.id), `查询 ${JSON.stringify(q)}（${prof}）漏掉 ${p.id}`);
+    checked++;
+  }
+}
+console.log(`search: ${queries.size} 个查询，${checked} 次比对一致`);
@@ -0,0 +1,18 @@
+// 合并采购清单：含循环依赖时合计与单件成本口径一致（合计 = Σ 件数 × productCost），环上产品计入产品清单
+const assert = require('assert');
+const { load, addCycles } = require('./harness');
+const { g } = load();
+const ids = addCycles(g), cost = g('productCost'), shoppingList = g('shoppingList');
+const close = (a, b, msg) => assert(Math.abs(a - b) <= 1e-9 * Math.max(1, b), `${msg}: ${a} ≠ ${b}`);
+
+for (const rate of [100, 50]) {
+  g(`currentSuccessRate = ${rate}`);
+  for (const id of ids) close(shoppingList(new Map([[id, 3]])).total, 3 * cost(id).cost, `${rate}% ${id}×3`);
+  const orders = new Map([['ZA', 1], ['ZC', 2], ['XA', 1]]), list = shoppingList(orders);
+  close(list.total, [...orders].reduce((s, [id, n]) => s + n * cost(id).cost, 0), `${rate}% 合并`);
+  assert.deepStrictEqual(Object.keys(list.products).sort(), ['XA', 'ZA', 'ZB', 'ZC', 'ZD']);
+}
+// 自引用：XA = M = 10，而非按 XA + M 再展开一层得到的 20
+g('currentSuccessRate = 100');
+assert.strictEqual(shoppingList(new Map([['XA', 1]])).total, 10);
+console.log(`shopping list: ${ids.length} 个环上产品合计与单件成本一致`);
@@ -0,0 +1,46 @@
+// 在 node 的 vm 中运行生成页面的脚本（桩 DOM），供同目录下的 check_*.js 使用
+// 用法：node tests/page/check_xxx.js 页面.html；检查失败时抛出 AssertionError，进程以非零退出码结束
+const fs = require('fs'), vm = require('vm');
+
+function el() {
+  return {
+    style: {}, dataset: {}, textContent: '', innerHTML: '', value: '',
+    classList: { toggle() {}, contains() { return false; }, add() {} },
+    addEventListener() {}, appendChild() {}, querySelectorAll() { return []; }, querySelector() { return null; }, contains() { return false; },
+  };
+}
+
+// 返回 { ctx, g, els }：g(表达式) 在页面脚本的顶层作用域求值（可读写 let/const 全局），els 为按编号创建的桩元素
+function load(file = process.argv[2]) {
+  const src = fs.readFileSync(file, 'utf8');
+  const code = src.slice(src.indexOf('<script>\n//') + 8, src.lastIndexOf('</script>'));
+  const els = {};
+  const ctx = {
+    console, setTimeout, clearTimeout, performance, requestAnimationFrame: f => setTimeout(f, 0),
+    document: {
+      getElementById: id => els[id] || (els[id] = el()), addEventListener() {}, querySelectorAll() { return []; },
+      createElement: el, head: el(), body: el(),
+    },
+    alert() {}, Blob: class {}, URL: {},
+  };
+  vm.createContext(ctx);
+  vm.runInContext(code + '\n;this.__g = n => eval(n);', ctx);
+  return { ctx, g: ctx.__g, els };
+}
+
+// 向页面注入带循环依赖的配方（均只用单价 10 的物料 M，不在展开行中，按递归路径去重计算）：
+// XA 引用自身；YA ↔ YB；ZB ↔ ZC，ZD → ZC，ZA → ZB + 2×ZD。返回注入的产品编号
+function addCycles(g) {
+  const mid = g('Object.keys(ALL_MATERIALS_MAP)[0]');
+  g(`ALL_MATERIALS_MAP['${mid}'].price = 10`);
+  const M = { id: mid, qty: 1, name: 'M' }, ref = (id, qty = 1) => ({ ref: id, qty, name: id });
+  const bom = {
+    XA: [ref('XA'), M], YA: [ref('YB'), M], YB: [ref('YA'), M],
+    ZB: [ref('ZC'), M], ZC: [ref('ZB'), M], ZD: [ref('ZC'), M], ZA: [ref('ZB'), ref('ZD', 2)],
+  };
+  Object.entries(bom).forEach(([id, materials]) => g(`PRODUCT_BOM['${id}'] =
+    { id: '${id}', name: '${id}', calculation_coefficient: 1, materials: ${JSON.stringify(materials)} }`));
+  return Object.keys(bom);
+}
+
+module.exports = { load, el, addCycles };
@@ -0,0 +1,134 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+成本引擎：统一成功率下 expected_costs / monte_carlo 与 price_all 同口径（含循环依赖）
+用法：python -m pytest tests
+"""
+import sys
+from pathlib import Path
+
+import numpy as np
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from aion_cost import CostEngine, CSRMatrix
+from conftest import recipe
+
+
+def ref(pid, qty=1):
+    return {"ref": pid, "qty": qty, "name": pid}
+
+
+def raw(mid, qty=1):
+    return {"id": mid, "qty": qty, "name": mid}
+
+
+MATERIALS = [{"id": "M1", "name": "M1", "price": 10}, {"id": "M2", "name": "M2", "price": 7}]
+
+# 子配方在前（拓扑顺序）
+ACYCLIC = {
+    "B": recipe("B", [raw("M1", 3), raw("M2")]),
+    "A": recipe("A", [ref("B", 2), raw("M1")], coef=2),
+    "C": recipe("C", [ref("A"), ref("B"), raw("M2", 4)]),
+}
+
+# A→B→C→B 的环，D 引用环上的 C；与拓扑排序一致，受环影响的产品按原顺序排在末尾
+CYCLIC = {
+    "E": recipe("E", [raw("M2", 2)]),
+    "A": recipe("A", [ref("B")]),
+    "B": recipe("B", [ref("C"), raw("M1")]),
+    "C": recipe("C", [ref("B"), raw("M1"), ref("E")]),
+    "D": recipe("D", [ref("C"), raw("M1")]),
+}
+
+# 自引用与两产品互相引用
+SELF_LOOP = {"A": recipe("A", [ref("A"), raw("M1")])}
+PAIR = {"A": recipe("A", [ref("B"), raw("M1")]), "B": recipe("B", [ref("A"), raw("M1")])}
+
+
+@pytest.mark.parametrize("recipes", [ACYCLIC, CYCLIC], ids=["acyclic", "cyclic"])
+@pytest.mark.parametrize("rate", [100, 50])
+def test_expected_costs_match_price_all(recipes, rate):
+    engine = CostEngine(recipes, MATERIALS)
+    cost = engine.price_all(None, rate)
+    expected = engine.expected_costs(default_rate=rate)
+    for pid in recipes:
+        assert expected[pid]["mean"] == pytest.approx(cost[pid], rel=1e-12)
+        if rate == 100:
+            assert expected[pid]["std"] == pytest.approx(0.0)
+        else:
+            assert expected[pid]["std"] > 0
+
+
+def test_cyclic_prices_follow_path_expansion():
+    cost = CostEngine(CYCLIC, MATERIALS).price_all()
+    # C 经 B 回到 C 时不再计入：C = M1 + E + (B 中的 M1) = 10 + 14 + 10
+    assert cost["C"] == pytest.approx(34)
+    assert cost["D"] == pytest.approx(44)
+
+
+@pytest.mark.parametrize("recipes", [ACYCLIC, CYCLIC], ids=["acyclic", "cyclic"])
+def test_monte_carlo_matches_price_all(recipes):
+    engine = CostEngine(recipes, MATERIALS)
+    cost = engine.price_all()
+    for pid in recipes:
+        samples = engine.monte_carlo({pid: 3}, samples=200, seed=0)
+        assert samples == pytest.approx(3 * cost[pid], rel=1e-12)
+    cost = engine.price_all(None, 50)
+    for pid in recipes:
+        samples = engine.monte_carlo({pid: 1}, default_rate=50, samples=40000, seed=0)
+        assert samples.mean() == pytest.approx(cost[pid], rel=0.03)
+
+
+@pytest.mark.parametrize("recipes", [ACYCLIC, CYCLIC, SELF_LOOP, PAIR], ids=["acyclic", "cyclic", "self-loop", "pair"])
+@pytest.mark.parametrize("rate", [100, 50])
+def test_shopping_list_total_matches_price_all(recipes, rate):
+    engine = CostEngine(recipes, MATERIALS)
+    cost = engine.price_all(None, rate)
+    for pid in recipes:
+        assert engine.shopping_list({pid: 3}, success_rate=rate)["total"] == pytest.approx(3 * cost[pid], rel=1e-12)
+    orders = {pid: k + 1 for k, pid in enumerate(recipes)}
+    listing = engine.shopping_list(orders, success_rate=rate)
+    assert listing["total"] == pytest.approx(sum(n * cost[pid] for pid, n in orders.items()), rel=1e-12)
+    assert set(orders) <= set(listing["products"])
+
+
+def test_shopping_list_cycles_count_each_product_once_per_path():
+    # A = A + M1 展开时路径上的 A 不再计入：A = 10，而非 20
+    assert CostEngine(SELF_LOOP, MATERIALS).shopping_list({"A": 1})["total"] == pytest.approx(10)
+    assert CostEngine(PAIR, MATERIALS).shopping_list({"A": 1, "B": 1})["total"] == pytest.approx(40)
+
+
+@pytest.mark.parametrize("recipes", [ACYCLIC, CYCLIC, SELF_LOOP, PAIR], ids=["acyclic", "cyclic", "self-loop", "pair"])
+@pytest.mark.parametrize("rate", [100, 50])
+def test_make_or_buy_never_exceeds_full_crafting(recipes, rate):
+    engine = CostEngine(recipes, MATERIALS)
+    cost = engine.price_all(None, rate)
+    for market in [{}, {pid: 0.5 * cost[pid] for pid in list(recipes)[:1]}]:
+        for pid, d in engine.make_or_buy(market=market, success_rate=rate).items():
+            assert d["craft"] <= cost[pid] * (1 + 1e-12)
+            assert d["cost"] == min(d["craft"], d["buy"] or d["craft"])
+
+
+def test_make_or_buy_cycles():
+    # 自引用且买不到：只能全自制，A = M1 = 10，而非把 A 再按全自制成本计入一次得到的 20
+    assert CostEngine(SELF_LOOP, MATERIALS).make_or_buy()["A"] == {"craft": 10, "buy": None, "cost": 10, "decision": "make"}
+    decisions = CostEngine(PAIR, MATERIALS).make_or_buy(market={"B": 5})
+    assert decisions["B"]["decision"] == "buy" and decisions["A"]["cost"] == pytest.approx(15)
+
+
+def csr(dense):
+    rows, cols = np.nonzero(dense)
+    return CSRMatrix(dense[rows, cols], cols, np.searchsorted(rows, np.arange(dense.shape[0] + 1)), dense.shape)
+
+
+@pytest.mark.parametrize("density", [0.5, 0.005], ids=["dense-blocks", "sparse-rows"])
+@pytest.mark.parametrize("shape", [(40, 30), (40, 0), (0, 30), (0, 0)])
+@pytest.mark.parametrize("k", [None, 3, 0])
+def test_csr_dot_matches_dense(density, shape, k):
+    rng = np.random.default_rng(0)
+    dense = rng.random(shape) * (rng.random(shape) < density)
+    x = rng.random(shape[1] if k is None else (shape[1], k))
+    got = csr(dense).dot(x, block=64)
+    assert got.shape == (dense @ x).shape
+    assert got == pytest.approx(dense @ x)
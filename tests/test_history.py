@@ -0,0 +1,71 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+物价历史库：时间段查询的起点语义；按物料名称记录（物料表行序变化不错位），旧库迁移
+用法：python -m pytest tests
+"""
+import sqlite3, sys
+from pathlib import Path
+
+import numpy as np
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from aion_history import PriceHistory, record_prices
+
+
+def items(**prices):
+    return [{"id": f"M{k + 1:03d}", "name": name, "price": price} for k, (name, price) in enumerate(prices.items())]
+
+
+def history(tmp_path, snapshots):
+    db = tmp_path / "history.sqlite"
+    for ts, prices in snapshots:
+        record_prices(db, items(**prices), ts=ts)
+    return PriceHistory(db)
+
+
+def test_since_date_starts_at_midnight_and_includes_snapshot_in_effect(tmp_path):
+    hist = history(tmp_path, [("2026-08-31T10:00:00", {"铁矿": 10}), ("2026-09-01T08:00:00", {"铁矿": 11}),
+                              ("2026-09-01T20:00:00", {"铁矿": 12}), ("2026-09-02T20:00:00", {"铁矿": 13})])
+    assert [s["id"] for s in hist.snapshots("2026-09-01")] == [1, 2, 3, 4]
+    assert [s["id"] for s in hist.snapshots("2026-09-01T12:00")] == [2, 3, 4]
+    assert [s["id"] for s in hist.snapshots("2026-09-01", "2026-09-01")] == [1, 2, 3]
+    assert hist.snapshot_at("2026-09-01")["id"] == 3
+    assert hist.snapshot_at("2026-09-01", end=False)["id"] == 1
+    assert hist.snapshot_at("2026-08-30") is None
+    hist.close()
+
+
+def test_prices_follow_material_names_when_rows_move(tmp_path):
+    db = tmp_path / "history.sqlite"
+    record_prices(db, items(铁矿=10, 木炭=4), ts="2026-09-01T00:00:00")
+    # 物料表插入一行：原有物料的编号（行号）全部后移
+    record_prices(db, items(银矿=30, 铁矿=11, 木炭=4), ts="2026-09-02T00:00:00")
+    record_prices(db, items(银矿=30, 铁矿=11), ts="2026-09-03T00:00:00")
+    hist = PriceHistory(db)
+    prices = hist.price_matrix(["铁矿", "木炭", "银矿"], [1, 2, 3])
+    hist.close()
+    assert prices[0, :2].tolist() == [10, 4] and np.isnan(prices[0, 2])
+    assert prices[1].tolist() == [11, 4, 30]
+    assert prices[2, [0, 2]].tolist() == [11, 30] and np.isnan(prices[2, 1])
+
+
+def test_legacy_id_keyed_history_is_migrated(tmp_path):
+    db = tmp_path / "history.sqlite"
+    conn = sqlite3.connect(str(db))
+    conn.executescript("""
+        CREATE TABLE snapshots (id INTEGER PRIMARY KEY, ts TEXT NOT NULL, source TEXT NOT NULL DEFAULT '', sha TEXT);
+        CREATE TABLE prices (material TEXT NOT NULL, snapshot INTEGER NOT NULL, price REAL,
+                             PRIMARY KEY (material, snapshot)) WITHOUT ROWID;
+        CREATE TABLE materials (id TEXT PRIMARY KEY, name TEXT NOT NULL, price REAL) WITHOUT ROWID;
+        INSERT INTO snapshots (id, ts) VALUES (1, '2026-09-01T00:00:00');
+        INSERT INTO prices VALUES ('M001', 1, 10), ('M002', 1, 4);
+        INSERT INTO materials VALUES ('M001', '铁矿', 10), ('M002', '木炭', 4);
+    """)
+    conn.close()
+    hist = PriceHistory(db)
+    assert hist.price_matrix(["木炭", "铁矿"], [1]).tolist() == [[4, 10]]
+    hist.close()
+    # 迁移后按名称比对：单价未变时不新增快照
+    assert record_prices(db, items(木炭=4, 铁矿=10)) is None
+    assert record_prices(db, items(木炭=5, 铁矿=10)) == 2
@@ -0,0 +1,64 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+生成页面的脚本检查：用打包数据生成单文件页面，在 node 中（桩 DOM）运行 tests/page/ 下的检查脚本
+未安装 node 时跳过
+用法：python -m pytest tests
+"""
+import contextlib, importlib.util, io, shutil, subprocess
+from pathlib import Path
+
+import pytest
+
+ROOT = Path(__file__).resolve().parent.parent
+SCRIPT = ROOT / "转换 - 副本.py"
+CHECKS = Path(__file__).resolve().parent / "page"
+NODE = shutil.which('node')
+
+pytestmark = pytest.mark.skipif(NODE is None, reason="未安装 node")
+
+
+@pytest.fixture(scope='module')
+def page(tmp_path_factory):
+    pytest.importorskip('pandas')
+    tmp = tmp_path_factory.mktemp("page")
+    spec = importlib.util.spec_from_file_location("aion_tool_page", SCRIPT)
+    tool = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(tool)
+    tool.load_deps()
+    tool.CFG.update(MATERIAL_CSV=str(ROOT / "aion-物料.csv"), BOM_CSV=str(ROOT / "bom.csv"), CACHE_DIR=str(tmp / "cache"),
+                    HISTORY_DB="", HTML_OUT=str(tmp / "index.html"), OUTPUT_MODE="single")
+    with contextlib.redirect_stdout(io.StringIO()):
+        mats = tool.convert_material()
+        recipes, _ = tool.convert_bom({m['name']: m['id'] for m in mats})
+        tool.generate_html(mats, recipes)
+    return tmp / "index.html"
+
+
+def run(check, page):
+    res = subprocess.run([NODE, str(CHECKS / check), str(page)], capture_output=True, text=True, encoding='utf-8')
+    assert res.returncode == 0, res.stdout + res.stderr
+
+
+def test_search_index_matches_linear_filter(page):
+    run("check_search.js", page)
+
+
+def test_bom_tree_incremental_update(page):
+    run("check_bom_tree.js", page)
+
+
+def test_material_table_virtual_scroll(page):
+    run("check_material_table.js", page)
+
+
+def test_cost_cache_invalidation(page):
+    run("check_cost_cache.js", page)
+
+
+def test_shopping_list_cycles(page):
+    run("check_shopping.js", page)
+
+
+def test_make_or_buy_cycles(page):
+    run("check_make_buy.js", page)
@@ -0,0 +1,171 @@
+#!/usr/bin/env python3
+# -*- coding: utf-8 -*-
+"""
+定价服务：进程内启动 PricingService，经真实 HTTP 连接核对各接口响应、HEAD、错误码、热重载与慢请求并发
+用法：python -m pytest tests
+"""
+import asyncio, json, sys, time
+from pathlib import Path
+from urllib.parse import quote
+
+import pytest
+
+sys.path.insert(0, str(Path(__file__).resolve().parent.parent))
+from aion_server import PricingService
+from conftest import recipe
+
+
+RECIPES = {
+    "P1": recipe("P1", [{"id": "M1", "qty": 2, "name": "铁矿石"}, {"id": "M2", "qty": 1, "name": "木炭"}], name="铁锭"),
+    "P2": recipe("P2", [{"ref": "P1", "qty": 3, "name": "铁锭"}, {"id": "M2", "qty": 2, "name": "木炭"}], coef=2, name="精炼铁锭"),
+    "P3": recipe("P3", [{"ref": "P2", "qty": 1, "name": "精炼铁锭"}, {"ref": "P1", "qty": 2, "name": "铁锭"}], name="铁剑"),
+}
+
+
+def materials(scale=1):
+    return [{"id": "M1", "name": "铁矿石", "price": 10 * scale}, {"id": "M2", "name": "木炭", "price": 4 * scale}]
+
+
+def indexer(recipes):
+    """与页面检索索引同格式的最小实现（无拼音、无停用二元组）"""
+    keys, grams = [], {}
+    for k, (pid, p) in enumerate(recipes.items()):
+        key = f"{p['name'].lower()}\n{pid.lower()}"
+        keys.append(key)
+        for g in dict.fromkeys(key[i:i + 2] for i in range(len(key) - 1)):
+            if '\n' not in g:
+                grams.setdefault(g, []).append(k)
+    return {"keys": keys, "stop": [],
+            "grams": {g: [b - a for a, b in zip([0] + post, post)] for g, post in grams.items()}}
+
+
+class Loader:
+    def __init__(self):
+        self.scale = 1
+
+    def __call__(self):
+        return {"materials": materials(self.scale), "recipes": RECIPES,
+                "name2id": {p['name']: pid for pid, p in RECIPES.items()}, "bom": "bom-v1"}
+
+
+async def request(reader, writer, method, path):
+    writer.write(f"{method} {path} HTTP/1.1\r\nHost: test\r\n\r\n".encode())
+    line = await reader.readline()
+    assert line.startswith(b'HTTP/1.1 '), line
+    status = int(line.split()[1])
+    length = 0
+    while (line := await reader.readline()) != b'\r\n':
+        k, _, v = line.decode('latin-1').partition(':')
+        if k.lower() == 'content-length':
+            length = int(v)
+    if method == 'HEAD':
+        return status, length
+    return status, json.loads(await reader.readexactly(length))
+
+
+def serving(service, scenario):
+    """启动服务（端口 0），对一条 keep-alive 连接执行 scenario(port, reader, writer)"""
+    async def main():
+        ready = asyncio.get_running_loop().create_future()
+        task = asyncio.create_task(service.serve('127.0.0.1', 0, ready=ready.set_result))
+        port = (await ready)[1]
+        reader, writer = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            return await scenario(port, reader, writer)
+        finally:
+            writer.close()
+            task.cancel()
+    return asyncio.run(main())
+
+
+@pytest.fixture
+def service():
+    return PricingService(Loader(), indexer, interval=0, log=lambda *a: None)
+
+
+def test_cost_breakdown_and_tree_agree(service):
+    async def scenario(port, reader, writer):
+        expected = service.load().engine.price_all(None, 50)
+        status, body = await request(reader, writer, 'GET', f"/api/cost?product={quote('铁剑')}&product=P1&rate=50")
+        assert status == 200
+        assert [(p['id'], p['cost']) for p in body['products']] == [("P3", round(expected["P3"], 2)),
+                                                                    ("P1", round(expected["P1"], 2))]
+        status, body = await request(reader, writer, 'GET', "/api/cost")
+        assert [p['id'] for p in body['products']] == list(RECIPES)
+
+        _, body = await request(reader, writer, 'GET', "/api/breakdown?product=P3&rate=50")
+        assert sum(m['cost'] for m in body['materials']) == pytest.approx(body['cost'], abs=0.05)
+
+        _, body = await request(reader, writer, 'GET', "/api/tree?product=P3&rate=50")
+        tree = body['tree']
+        assert not body['truncated'] and tree['cost'] == round(expected["P3"], 2)
+        assert sum(c['cost'] for c in tree['children']) == pytest.approx(tree['cost'], abs=0.05)
+        _, body = await request(reader, writer, 'GET', "/api/tree?product=P3&rate=50&depth=0")
+        assert "children" not in body['tree']
+    serving(service, scenario)
+
+
+def test_search(service):
+    async def scenario(port, reader, writer):
+        _, body = await request(reader, writer, 'GET', f"/api/search?q={quote('铁锭')}")
+        # 名称以关键词开头的排前
+        assert body['total'] == 2 and [p['id'] for p in body['products']] == ["P1", "P2"]
+        _, body = await request(reader, writer, 'GET', f"/api/search?q={quote('精炼 锭')}&limit=1")
+        assert [p['id'] for p in body['products']] == ["P2"]
+        _, body = await request(reader, writer, 'GET', "/api/search?q=p3")
+        assert [p['name'] for p in body['products']] == ["铁剑"]
+    serving(service, scenario)
+
+
+@pytest.mark.parametrize("method, path, status", [
+    ('GET', "/api/nope", 404),
+    ('GET', "/api/cost?product=不存在", 404),
+    ('GET', "/api/cost?rate=0", 400),
+    ('GET', "/api/cost?rate=abc", 400),
+    ('GET', "/api/breakdown", 400),
+    ('GET', "/api/tree?product=P1&depth=x", 400),
+    ('GET', "/api/tree?product=P1&depth=-1", 400),
+    ('GET', "/api/search", 400),
+    ('POST', "/api/cost", 405),
+])
+def test_errors(service, method, path, status):
+    async def scenario(port, reader, writer):
+        got, body = await request(reader, writer, method, path)
+        assert got == status and body['error']
+    serving(service, scenario)
+
+
+def test_head_sends_headers_only(service):
+    async def scenario(port, reader, writer):
+        _, body = await request(reader, writer, 'GET', "/api/cost?product=P2")
+        status, length = await request(reader, writer, 'HEAD', "/api/cost?product=P2")
+        assert status == 200 and length == len(json.dumps(body, ensure_ascii=False, separators=(',', ':')).encode())
+        # 若 HEAD 写出了正文，同一连接上的下一条响应会错位
+        status, body = await request(reader, writer, 'GET', "/api/status")
+        assert status == 200 and body['recipes'] == len(RECIPES)
+    serving(service, scenario)
+
+
+def test_reload_reuses_recipes_and_updates_prices(service):
+    first = service.data = service.load()
+    service.loader.scale = 2
+    second = service.load()
+    assert second.version == 2 and second.recipes is first.recipes and second.index is first.index
+    assert second.costs(100)["P3"] == pytest.approx(2 * first.costs(100)["P3"])
+
+
+def test_slow_request_does_not_block_other_connections(service):
+    service.routes['/api/slow'] = lambda data, query: time.sleep(1) or {}
+
+    async def scenario(port, reader, writer):
+        # 服务与客户端共用事件循环：路由若在循环内同步执行，第二条连接要等慢请求结束才有响应
+        slow = asyncio.create_task(request(reader, writer, 'GET', "/api/slow"))
+        await asyncio.sleep(0.1)
+        r2, w2 = await asyncio.open_connection('127.0.0.1', port)
+        try:
+            status, _ = await request(r2, w2, 'GET', "/api/status")
+        finally:
+            w2.close()
+        assert status == 200 and not slow.done()
+        assert (await slow)[0] == 200
+    serving(service, scenario)
@@ -5,21 +5,24 @@ AION 综合转换工具 v5.5  终极修复版
 适配 CSV：
   aion-物料.csv : 原料名称,制作职业,来源,单价
   bom.csv       : 制作职业,名称,需求等级,计算系数,材料1,数量1,...,材料9,数量9
+无人值守：加 --headless 或设置环境变量 AION_HEADLESS=1，不自动安装依赖、不等待回车，以退出码报告结果
 """
-import sys, subprocess, json, re, traceback, os, importlib
+from __future__ import annotations
+import sys, subprocess, json, re, traceback, os, importlib, argparse, codecs, hashlib, contextlib, io, time
 # ↓↓ 修复：显式导入 importlib.util
 import importlib.util
 from pathlib import Path
 from collections import defaultdict, deque
 
 # --------------------  依赖自检（终极修复）  --------------------
+REQUIRED = {'pandas': 'pandas', 'chardet': 'chardet'}
+
 def check_and_install():
-    """检查并安装依赖，修复了 importlib.util 的兼容性问题"""
+    """检查并安装依赖，修复了 importlib.util 的兼容性问题；无人值守模式只检查、不安装"""
     print("\n[🔍] 检查运行环境...")
-    required = {'pandas': 'pandas', 'chardet': 'chardet'}
     missing = []
     
-    for mod, pip in required.items():
+    for mod, pip in REQUIRED.items():
         # 正确的检测方式，兼容所有Python版本
         if importlib.util.find_spec(mod) is None:
             missing.append(pip)
@@ -27,6 +30,9 @@ def check_and_install():
         else:
             print(f"[✓] 依赖正常: {mod}")
     
+    if missing and CFG["HEADLESS"]:
+        print(f"[✗] 无人值守模式不自动安装依赖，请先执行: pip install {' '.join(missing)}")
+        sys.exit(1)
     if missing:
         print(f"\n[⚠] 发现 {len(missing)} 个缺失依赖，正在自动安装...")
         cmd = [sys.executable, '-m', 'pip', 'install', *missing]
@@ -37,46 +43,125 @@ def check_and_install():
             if result.returncode == 0:
                 print("[✓] 依赖安装成功！")
                 print("    请重新运行此脚本")
-                input("\n按 Enter 退出...")
+                pause()
                 sys.exit(0)
             else:
                 print(f"[✗] 安装失败 (返回码: {result.returncode})")
                 print("    错误信息:", result.stderr)
-                input("\n按 Enter 退出...")
-                sys.exit(1)
+                fail()
         except Exception as e:
             print(f"[✗] 安装时出错: {e}")
             print("    请手动执行: pip install " + " ".join(missing))
-            input("\n按 Enter 退出...")
-            sys.exit(1)
+            fail()
     else:
         print("[✓] 所有依赖已就绪！")
 
-# 强制在脚本所在目录运行，防止路径问题
-os.chdir(os.path.dirname(os.path.abspath(__file__)))
-print(f"[📁] 当前工作目录: {Path.cwd()}")
+# 命令行传入的相对路径相对于启动目录；默认数据文件相对于脚本目录（main 中切换）
+LAUNCH_DIR = Path.cwd()
+SCRIPT_DIR = Path(__file__).resolve().parent
 
-# 检查依赖（必须先执行，再导入模块）
-check_and_install()
+# pandas / numpy / chardet 延迟到真正处理 CSV 时才导入，--help 与空操作运行无需加载
+pd = np = chardet = None
 
-# 现在安全地导入模块
-import pandas as pd
-import chardet
+def load_deps():
+    global pd, np, chardet
+    if pd is None:
+        import numpy as np
+        import pandas as pd
+        import chardet
 
 # --------------------  配置  --------------------
 CFG = {
     "MATERIAL_CSV": "aion-物料.csv",
     "BOM_CSV":      "bom.csv",
-    "HTML_OUT":     "index_generated.html"
+    "HTML_OUT":     "index_generated.html",
+    "CHUNKSIZE":    0,          # >0 时按块流式读取 CSV（行数），0 为整表读取
+    "ENCODING_SAMPLE": 1 << 20, # 编码检测仅采样文件前 N 字节
+    "CACHE_DIR":    ".aion_cache",
+    "PAYLOAD":      "compact",  # compact：字符串表 + 整数数组；legacy：缩进的完整对象
+    "OUTPUT_MODE":  "single",   # single：单个 HTML；shards：HTML 外壳 + 按职业懒加载的数据分片
+    "SALE_PRICES":  "",         # 产品售价表（可选），供页面盈利排行使用
+    "HISTORY_DB":   "price_history.sqlite",  # 物价历史库（只追加），每次解析物料表时记录单价；空字符串关闭
+    "HEADLESS":     os.environ.get("AION_HEADLESS", "").strip().lower() in ("1", "true", "yes", "on")
 }
 
 # --------------------  工具函数  --------------------
+def pause(msg="\n按 Enter 退出..."):
+    """交互运行时等待回车，便于双击运行时查看输出；无人值守或无终端输入时直接返回"""
+    if CFG["HEADLESS"] or not sys.stdin or not sys.stdin.isatty():
+        return
+    try:
+        input(msg)
+    except EOFError:
+        pass
+
+def fail(code=1):
+    pause()
+    sys.exit(code)
+
+BOM_ENCODINGS = [
+    (codecs.BOM_UTF8, 'utf-8-sig'),
+    (codecs.BOM_UTF32_LE, 'utf-32'), (codecs.BOM_UTF32_BE, 'utf-32'),
+    (codecs.BOM_UTF16_LE, 'utf-16'), (codecs.BOM_UTF16_BE, 'utf-16'),
+]
+
+def cache_dir() -> Path:
+    """缓存目录；相对路径按脚本目录解析，不随启动目录（或以模块方式导入时的当前目录）变化"""
+    return SCRIPT_DIR / CFG["CACHE_DIR"]
+
+def history_db() -> Path:
+    """物价历史库；相对路径与缓存目录一样按脚本目录解析"""
+    return SCRIPT_DIR / CFG["HISTORY_DB"]
+
 def detect_encoding(p: Path) -> str:
+    """检测 CSV 编码：缓存命中 → BOM → UTF-8 校验 → chardet 增量检测（仅采样前缀）"""
     print(f"[📖] 检测编码: {p.name}")
-    enc = chardet.detect(p.read_bytes())['encoding'] or 'utf-8'
+    st = p.stat()
+    key = str(p.resolve())
+    cache_file = cache_dir() / "encoding.json"
+    try:
+        cache = json.loads(cache_file.read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        cache = {}
+    hit = cache.get(key)
+    if hit and hit.get('size') == st.st_size and hit.get('mtime_ns') == st.st_mtime_ns:
+        print(f"[✓] 编码: {hit['encoding']}（缓存）")
+        return hit['encoding']
+    
+    enc = sniff_encoding(p)
+    cache[key] = {'size': st.st_size, 'mtime_ns': st.st_mtime_ns, 'encoding': enc}
+    try:
+        cache_file.parent.mkdir(parents=True, exist_ok=True)
+        cache_file.write_text(json.dumps(cache, ensure_ascii=False, indent=2), encoding='utf-8')
+    except OSError as e:
+        print(f"[⚠] 编码缓存写入失败: {e}")
     print(f"[✓] 编码: {enc}")
     return enc
 
+def sniff_encoding(p: Path, block: int = 64 * 1024) -> str:
+    """不读缓存的编码检测，最多读取 CFG['ENCODING_SAMPLE'] 字节"""
+    load_deps()
+    with p.open('rb') as f:
+        head = f.read(4)
+        for bom, enc in BOM_ENCODINGS:
+            if head.startswith(bom):
+                return enc
+        # 无 BOM：前缀若是合法 UTF-8（末尾允许截断的多字节字符）直接采用
+        f.seek(0)
+        sample = f.read(CFG["ENCODING_SAMPLE"])
+    try:
+        codecs.getincrementaldecoder('utf-8')().decode(sample, final=False)
+        return 'utf-8'
+    except UnicodeDecodeError:
+        pass
+    det = chardet.UniversalDetector()
+    for i in range(0, len(sample), block):
+        det.feed(sample[i:i + block])
+        if det.done:
+            break
+    det.close()
+    return det.result['encoding'] or 'utf-8'
+
 def safe_int(v, d=0):
     try:
         return int(float(str(v).strip()))
@@ -87,76 +172,158 @@ def parse_level(s):
     m = re.fullmatch(r'(\D+)(\d+)', str(s).strip())
     return (m.group(1), int(m.group(2))) if m else (str(s).strip(), 0)
 
+def read_csv_chunks(p: Path, need: set):
+    """逐块读取 CSV（CFG['CHUNKSIZE'] 为 0 时整表作为一块），每块校验必要列"""
+    load_deps()
+    if not p.exists():
+        print(f"[✗] 文件不存在: {p.resolve()}")
+        print("提示: 请确保CSV文件与脚本在同一目录")
+        fail()
+    
+    enc = detect_encoding(p)
+    chunksize = CFG["CHUNKSIZE"] or None
+    total = 0
+    try:
+        reader = pd.read_csv(p, encoding=enc, keep_default_na=False, dtype=str, chunksize=chunksize)
+        for df in (reader if chunksize else [reader]):
+            if (miss := need - set(df.columns)):
+                print(f"[✗] 缺少必要列: {miss}")
+                fail()
+            total += len(df)
+            yield df
+    except Exception as e:
+        print(f"[✗] 读取失败: {e}")
+        fail()
+    print(f"[✓] 成功读取 {total} 行数据" + (f"（分块 {chunksize} 行）" if chunksize else ""))
+
+# --------------------  BOM 宽表 → 长表  --------------------
+def melt_bom(df: pd.DataFrame, start: int = 0) -> pd.DataFrame:
+    """将 材料1..9/数量1..9 一次性展开为 (row, slot, product, material, qty) 长表
+
+    只保留产品名与材料名均非空的行；数量按 safe_int 语义向零截断，非法值记为 0，
+    数量 ≤ 0 的行仍保留，由调用方自行过滤。分块读取时 start 为本块首行的全局行号。
+    """
+    n = len(df)
+    prod = df['名称'].astype(str).str.strip().to_numpy()
+    rows = np.arange(start, start + n)
+    parts = []
+    for i in range(1, 10):
+        qty = pd.to_numeric(df[f'数量{i}'].astype(str).str.strip(), errors='coerce').to_numpy(dtype=float)
+        parts.append(pd.DataFrame({
+            'row': rows,
+            'slot': i,
+            'product': prod,
+            'material': df[f'材料{i}'].astype(str).str.strip().to_numpy(),
+            'qty': np.trunc(np.where(np.isfinite(qty), qty, 0)).astype('int64'),
+        }))
+    long = pd.concat(parts, ignore_index=True)
+    long = long[(long['product'] != '') & (long['material'] != '')]
+    return long.sort_values(['row', 'slot'], kind='stable').reset_index(drop=True)
+
 # --------------------  拓扑排序（防循环依赖）  --------------------
-def topological_sort(df: pd.DataFrame):
+def topological_sort(names, edges: pd.DataFrame):
+    """Kahn 拓扑排序：节点为整数产品编号，子配方排在引用它的产品之前
+
+    names 为 BOM 各行产品名（按行号），edges 为 melt_bom 长表；同名产品以最后一行为准。
+    返回排序后的行号列表。存在循环依赖时打印环上的产品，并按出现顺序附加在末尾。
+    """
     print("[🔀] 开始拓扑排序...")
-    graph, reverse, nodes = defaultdict(list), defaultdict(list), set()
-    for _, r in df.iterrows():
-        prod = str(r.get('名称', '')).strip()
-        if not prod:
-            continue
-        nodes.add(prod)
-        for i in range(1, 10):
-            m = str(r.get(f'材料{i}', '')).strip()
-            if m:
-                nodes.add(m)
-                graph[prod].append(m)
-                reverse[m].append(prod)
-    in_deg = {n: 0 for n in nodes}
-    for vs in graph.values():
-        for v in vs:
-            in_deg[v] += 1
-    q = deque([n for n, d in in_deg.items() if d == 0])
+    name2idx = {n: i for i, n in enumerate(names) if n}
+    prods = list(name2idx)
+    node = {n: k for k, n in enumerate(prods)}
+    n = len(prods)
+
+    # 只保留 产品 → 子产品 的有效引用，转为整数边 src(子产品) → dst(引用方)
+    sub = edges[(edges['qty'] > 0) & edges['material'].isin(prods)]
+    src = sub['material'].map(node).to_numpy(dtype=np.int64)
+    dst = sub['product'].map(node).to_numpy(dtype=np.int64)
+    users, users_ptr = _adjacency(src, dst, n)
+    in_deg = np.bincount(dst, minlength=n).tolist()
+
+    q = deque(k for k in range(n) if in_deg[k] == 0)
     out = []
     while q:
         cur = q.popleft()
-        if cur in df['名称'].values:
-            out.append(cur)
-        for d in reverse[cur]:
-            in_deg[d] -= 1
-            if in_deg[d] == 0:
-                q.append(d)
-    exist = set(out)
-    for _, r in df.iterrows():
-        name = str(r.get('名称', '')).strip()
-        if name and name not in exist:
-            out.append(name)
-    name2idx = {str(r['名称']).strip(): i for i, r in df.iterrows() if str(r.get('名称', '')).strip()}
-    sorted_idx = [name2idx[n] for n in out if n in name2idx]
+        out.append(cur)
+        for u in users[users_ptr[cur]:users_ptr[cur + 1]]:
+            in_deg[u] -= 1
+            if in_deg[u] == 0:
+                q.append(u)
+
+    if len(out) < n:
+        rest = [k for k in range(n) if in_deg[k] > 0]
+        cycle = _cycle_members(rest, src, dst, n)
+        shown = '、'.join(prods[k] for k in cycle[:20])
+        more = f" 等 {len(cycle)} 个" if len(cycle) > 20 else ""
+        print(f"[⚠] 检测到循环依赖，环上产品: {shown}{more}")
+        print(f"    受影响的 {len(rest)} 个产品将按原顺序附加在末尾")
+        out.extend(rest)
+
+    sorted_idx = [name2idx[prods[k]] for k in out]
     print(f"[✓] 拓扑排序完成，共 {len(sorted_idx)} 个产品")
     return sorted_idx
 
+def _adjacency(src, dst, n):
+    """邻接数组（CSR）：adj[ptr[v]:ptr[v+1]] 为 v 指向的所有节点"""
+    order = np.argsort(src, kind='stable')
+    ptr = np.searchsorted(src[order], np.arange(n + 1))
+    return dst[order].tolist(), ptr.tolist()
+
+def _cycle_members(rest, src, dst, n):
+    """Kahn 剩余节点中剔除仅位于环下游的产品，剩下的即环上（或环间）的产品"""
+    alive = np.zeros(n, dtype=bool)
+    alive[rest] = True
+    keep = alive[src] & alive[dst]
+    src, dst = src[keep], dst[keep]
+    deps, deps_ptr = _adjacency(dst, src, n)
+    out_deg = np.bincount(src, minlength=n).tolist()
+    q = deque(k for k in rest if out_deg[k] == 0)
+    while q:
+        cur = q.popleft()
+        alive[cur] = False
+        for d in deps[deps_ptr[cur]:deps_ptr[cur + 1]]:
+            out_deg[d] -= 1
+            if out_deg[d] == 0:
+                q.append(d)
+    return [k for k in rest if alive[k]]
+
 # --------------------  物料 CSV → JSON  --------------------
 def convert_material():
     print("\n" + "="*60)
     print("[步骤1] 物料CSV → JSON")
     print("="*60)
     
-    p = Path(CFG["MATERIAL_CSV"])
-    if not p.exists():
-        print(f"[✗] 文件不存在: {p.resolve()}")
-        print("提示: 请确保CSV文件与脚本在同一目录")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
+    items = []
+    for df in read_csv_chunks(Path(CFG["MATERIAL_CSV"]), {'原料名称', '制作职业', '来源', '单价'}):
+        items.extend(material_items(df))
     
-    enc = detect_encoding(p)
+    print(f"[✓] 物料记录: {len(items)}")
+    record_history(items)
+    return items
+
+def record_history(items):
+    """把本次物料单价追加到物价历史库；与上次相比没有变化时不新增快照"""
+    if not CFG["HISTORY_DB"]:
+        return
+    import sqlite3
+    from aion_history import record_prices
+    src = Path(CFG["MATERIAL_CSV"])
     try:
-        df = pd.read_csv(p, encoding=enc, keep_default_na=False)
-        print(f"[✓] 成功读取 {len(df)} 行数据")
-    except Exception as e:
-        print(f"[✗] 读取失败: {e}")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
-    
-    need = {'原料名称', '制作职业', '来源', '单价'}
-    if (miss := need - set(df.columns)):
-        print(f"[✗] 缺少必要列: {miss}")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
-    
+        sid = record_prices(history_db(), items, source=src.name, sha=sha256_file(src))
+    except (OSError, sqlite3.Error) as e:
+        print(f"[⚠] 物价历史写入失败: {e}")
+        return
+    if sid is not None:
+        print(f"[✓] 物价历史: 新增快照 #{sid}（{history_db().name}）")
+
+def material_items(df: pd.DataFrame):
+    """物料 DataFrame（或其中一块）→ 物料记录，编号取自全局行号"""
+    names = df['原料名称'].astype(str).str.strip().tolist()
+    profs = df['制作职业'].astype(str).tolist()
+    sources = df['来源'].astype(str).str.strip().tolist()
+    prices = df['单价'].tolist()
     items = []
-    for idx, r in df.iterrows():
-        name = str(r.get('原料名称', '')).strip()
+    for idx, name, prof, source, price in zip(df.index, names, profs, sources, prices):
         if not name:
             continue
         # ========== 核心修复：将 split(',') 改为 split('/') ==========
@@ -164,91 +331,112 @@ def convert_material():
         items.append({
             "id": f"M{idx+1:03d}",
             "name": name,
-            "professions": [p.strip() for p in str(r.get('制作职业', '')).split('/') if p.strip()],
-            "source": str(r.get('来源', '未知')).strip() or '未知',
-            "price": safe_int(r.get('单价', 0))
+            "professions": [p.strip() for p in prof.split('/') if p.strip()],
+            "source": source or '未知',
+            "price": safe_int(price)
         })
-    
-    print(f"[✓] 物料记录: {len(items)}")
     return items
 
 # --------------------  BOM CSV → Recipe JSON  --------------------
+BOM_COLUMNS = {'制作职业', '名称', '需求等级', '计算系数', *(f'{c}{i}' for i in range(1, 10) for c in ('材料', '数量'))}
+
 def convert_bom(base_map):
     print("\n" + "="*60)
     print("[步骤2] BOM → Recipe JSON")
     print("="*60)
     
-    p = Path(CFG["BOM_CSV"])
-    if not p.exists():
-        print(f"[✗] 文件不存在: {p.resolve()}")
-        print("提示: 请确保CSV文件与脚本在同一目录")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
-    
-    enc = detect_encoding(p)
-    try:
-        df = pd.read_csv(p, encoding=enc, keep_default_na=False)
-        print(f"[✓] 成功读取 {len(df)} 行数据")
-    except Exception as e:
-        print(f"[✗] 读取失败: {e}")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
-    
-    need = {'制作职业', '名称', '需求等级', '计算系数'}
-    for i in range(1, 10):
-        need.update({f'材料{i}', f'数量{i}'})
-    if (miss := need - set(df.columns)):
-        print(f"[✗] 缺少必要列: {miss}")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
+    parsed = parse_bom()
+    if parsed is None:
+        return {}, base_map.copy()
+    recipes, name2id = assemble_recipes(*parsed, base_map)
     
+    print(f"[✓] 配方记录: {len(recipes)}")
+    return recipes, name2id
+
+def parse_bom():
+    """读取 BOM → (逐行标量表, 材料长表)，与物料表无关，可供多份物料表共用；BOM 为空时返回 None"""
+    # 分块时只保留逐行标量列与展开后的长表，宽表不驻留内存
+    rows, edges, start = [], [], 0
+    for df in read_csv_chunks(Path(CFG["BOM_CSV"]), BOM_COLUMNS):
+        rows.append(bom_rows(df))
+        edges.append(melt_bom(df, start))
+        start += len(df)
+    if not rows:
+        return None
+    return pd.concat(rows, ignore_index=True), pd.concat(edges, ignore_index=True)
+
+def bom_rows(df: pd.DataFrame) -> pd.DataFrame:
+    """BOM 每行的标量字段：名称、等级、等级数字、职业、计算系数"""
+    level = df['需求等级'].astype(str).str.strip()
+    coef = pd.to_numeric(df['计算系数'].astype(str).str.strip(), errors='coerce').to_numpy(dtype=float)
+    coef = np.trunc(np.where(np.isfinite(coef), coef, 1)).astype('int64')
+    return pd.DataFrame({
+        'name': df['名称'].astype(str).str.strip().to_numpy(),
+        'level': level.to_numpy(),
+        'levelNum': level.str.extract(r'^(\D+)(\d+)$')[1].fillna(0).astype('int64').to_numpy(),
+        'profession': df['制作职业'].astype(str).str.strip().to_numpy(),
+        'coef': np.where(coef == 0, 1, coef),
+    })
+
+def build_recipes(df: pd.DataFrame, base_map):
+    """由 BOM DataFrame 生成 (recipes, name2id)，全程基于列式长表，不逐行 iterrows"""
+    load_deps()
+    return assemble_recipes(bom_rows(df), melt_bom(df), base_map)
+
+def assemble_recipes(rows: pd.DataFrame, long: pd.DataFrame, base_map, sorted_idx=None):
+    """由逐行标量表 (bom_rows) 与材料长表 (melt_bom) 组装配方
+
+    拓扑顺序只取决于 BOM 本身；多份物料表共用同一 BOM 时可传入已排好的 sorted_idx。
+    """
+    names = rows['name']
+    all_prod = set(names)
+
     # 预生成编码
     name2id = base_map.copy()
-    all_prod = set(df['名称'].astype(str).str.strip().tolist())
-    for idx, r in df.iterrows():
-        name = str(r.get('名称', '')).strip()
-        if name and name not in name2id:
-            name2id[name] = f"COMP{len(name2id):04d}"
-    
+    new = [n for n in pd.unique(names[names != '']) if n not in name2id]
+    name2id.update({n: f"COMP{len(base_map) + k:04d}" for k, n in enumerate(new)})
+
     # 拓扑排序
-    sorted_idx = topological_sort(df)
+    if sorted_idx is None:
+        sorted_idx = topological_sort(names.tolist(), long)
+
+    # 有效材料行（数量 > 0），按行号分段
+    mats_df = long[long['qty'] > 0]
+    row_arr = mats_df['row'].to_numpy()
+    bounds = np.searchsorted(row_arr, np.arange(len(rows) + 1))
+    # 自动补全缺失编码：不在物料表也不是产品的材料，以名称本身作为编码
+    for m_name in pd.unique(mats_df['material']):
+        name2id.setdefault(m_name, m_name)
+    mat_names = mats_df['material'].tolist()
+    mat_ids = mats_df['material'].map(name2id).tolist()
+    mat_qty = mats_df['qty'].tolist()
+    mat_ref = mats_df['material'].isin(all_prod).tolist()
+
+    names = names.tolist()
+    lvl_strs = rows['level'].tolist()
+    lvl_nums = rows['levelNum'].tolist()
+    profs = rows['profession'].tolist()
+    coef = rows['coef'].tolist()
+
     recipes = {}
     for idx in sorted_idx:
-        r = df.iloc[idx]
-        name = str(r.get('名称', '')).strip()
+        name = names[idx]
         if not name:
             continue
-        
-        mats = []
-        for i in range(1, 10):
-            m_name = str(r.get(f'材料{i}', '')).strip()
-            qty = safe_int(r.get(f'数量{i}', '0'), 0)
-            if not m_name or qty <= 0:
-                continue
-            
-            # 自动补全缺失编码
-            if m_name not in name2id:
-                name2id[m_name] = f"COMP{len(name2id):04d}" if m_name in all_prod else m_name
-            
-            mid = name2id[m_name]
-            if m_name in all_prod:
-                mats.append({"ref": mid, "qty": qty, "name": m_name})
-            else:
-                mats.append({"id": mid, "qty": qty, "name": m_name})
-        
-        lvl_str = str(r.get('需求等级', '')).strip()
-        lvl, lvl_num = parse_level(lvl_str)
+        lo, hi = bounds[idx], bounds[idx + 1]
+        mats = [
+            {"ref": mid, "qty": qty, "name": m_name} if is_ref else {"id": mid, "qty": qty, "name": m_name}
+            for m_name, mid, qty, is_ref in zip(mat_names[lo:hi], mat_ids[lo:hi], mat_qty[lo:hi], mat_ref[lo:hi])
+        ]
         recipes[name2id[name]] = {
             "id": name2id[name],
             "name": name,
-            "level": lvl_str,
-            "levelNum": lvl_num,
-            "profession": str(r.get('制作职业', '')).strip(),
-            "calculation_coefficient": safe_int(r.get('计算系数', 1), 1) or 1,
+            "level": lvl_strs[idx],
+            "levelNum": lvl_nums[idx],
+            "profession": profs[idx],
+            "calculation_coefficient": coef[idx],
             "materials": mats
         }
-    
-    print(f"[✓] 配方记录: {len(recipes)}")
     return recipes, name2id
 
 # --------------------  HTML 模板（完整，修复职业筛选）  --------------------
@@ -414,6 +602,16 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             transition: background-color 0.3s ease;
         }
 
+        /* 虚拟滚动占位行：撑起未渲染行的高度 */
+        tr.row-spacer td {
+            padding: 0;
+            border: none;
+        }
+
+        tr.row-spacer:hover {
+            background: none;
+        }
+
         td[contenteditable="true"] {
             cursor: text;
             transition: background 0.2s;
@@ -952,6 +1150,82 @@ HTML_TEMPLATE = """<!DOCTYPE html>
             color: #5856d6;
             font-weight: 700;
         }
+
+        /* 产品面板标签页 */
+        .panel-tabs {
+            display: flex;
+            gap: 8px;
+            margin-bottom: 20px;
+        }
+
+        .tab-btn {
+            padding: 10px 18px;
+            border: 1px solid #d1d1d6;
+            border-radius: 10px;
+            background: rgba(255, 255, 255, 0.9);
+            color: #1d1d1f;
+            font-size: 14px;
+            font-weight: 500;
+            cursor: pointer;
+            transition: all 0.2s;
+        }
+
+        .tab-btn.active {
+            background: #007AFF;
+            border-color: #007AFF;
+            color: white;
+        }
+
+        /* 盈利排行 */
+        #rankTable th[data-sort] {
+            cursor: pointer;
+        }
+
+        #rankTable tbody tr {
+            cursor: pointer;
+        }
+
+        .loss {
+            color: #ff3b30;
+        }
+
+        /* 制作队列 */
+        .queue-panel {
+            margin-top: 20px;
+            padding: 16px;
+            background: rgba(88, 86, 214, 0.06);
+            border-radius: 12px;
+        }
+
+        .queue-add {
+            display: flex;
+            align-items: center;
+            gap: 12px;
+            margin: 12px 0;
+        }
+
+        .queue-panel .detail-row {
+            border-bottom: 1px solid #e5e5ea;
+        }
+
+        .queue-panel .export-btn {
+            margin-top: 12px;
+            background: #5856d6;
+            border: none;
+        }
+
+        .queue-panel .export-btn:hover {
+            background: #4b49c0;
+        }
+
+        .remove-btn {
+            margin-left: 10px;
+            border: none;
+            background: none;
+            color: #ff3b30;
+            cursor: pointer;
+            font-size: 14px;
+        }
 </style>
 </head>
 <body>
@@ -993,6 +1267,11 @@ HTML_TEMPLATE = """<!DOCTYPE html>
   </div>
 
   <div class="product-panel">
+    <div class="panel-tabs">
+      <button class="tab-btn active" data-tab="costTab" onclick="showTab('costTab')">成本计算</button>
+      <button class="tab-btn" data-tab="rankTab" onclick="showTab('rankTab')">盈利排行</button>
+    </div>
+    <div id="costTab">
     <div class="product-selector">
       <div class="product-selector-header">
         <div class="product-selector-title">
@@ -1030,21 +1309,157 @@ HTML_TEMPLATE = """<!DOCTYPE html>
       <button class="export-btn" onclick="exportCostReport()">📄 导出成本报告</button>
     </div>
 
+    <div class="queue-panel">
+      <h3>制作队列</h3>
+      <div class="queue-add">
+        <input type="number" class="success-rate-input" id="queueQty" min="1" value="1">
+        <span class="percent-label">件</span>
+        <button class="tab-btn" onclick="addToQueue()">＋ 加入当前产品</button>
+      </div>
+      <div id="queueList">队列为空：选择产品后加入，可合并计算多个产品的原料</div>
+      <button class="export-btn" onclick="exportShoppingList()">🛒 导出合并采购清单</button>
+    </div>
+
     <div class="bom-panel">
       <h3>产品结构BOM</h3>
       <div id="treeContainer">请选择产品</div>
     </div>
+    </div>
+
+    <div id="rankTab" style="display:none">
+      <div class="profession-filter">
+        <label for="rankProfession">制作职业：</label>
+        <select id="rankProfession"></select>
+        <label for="rankLevel">需求等级：</label>
+        <select id="rankLevel"></select>
+      </div>
+      <table id="rankTable"><thead><tr>
+        <th>产品</th><th>职业</th><th>等级</th><th data-sort="cost">成本</th><th data-sort="sale">售价</th>
+        <th data-sort="margin">利润</th><th data-sort="pct">利润率</th><th data-sort="perCraft">每次制作利润</th>
+      </tr></thead><tbody id="rankTableBody"></tbody></table>
+      <div class="stats" id="rankStats"></div>
+    </div>
   </div>
 </div>
 
+<!--AUTO_GENERATED_DATA_SCRIPTS-->
 <script>
 // ====================  数据注入  ====================
-const RAW_MATERIALS = [
+// 紧凑模式：字符串表 + 平行整数数组，由 decodeMaterials / decodeRecipes 还原；完整模式直接内联对象
+// 分片模式：物料来自 materials.js（AION_MATERIALS），此处只有产品索引，配方按职业分片懒加载
+const PAYLOAD = /*AUTO_GENERATED_PAYLOAD*/null;
+const SHARDS = /*AUTO_GENERATED_SHARDS*/null;
+// 产品搜索索引（构建时生成）：小写名称/编号/拼音/首字母拼成的检索键、二元组倒排表、职业分桶
+const SEARCH = /*AUTO_GENERATED_SEARCH*/null;
+// 物料排序（构建时生成）：各种族下按本地化名称排序后的物料下标，分片模式随 materials.js 加载
+const COLLATION = /*AUTO_GENERATED_COLLATION*/null;
+// 反向依赖索引（构建时生成）：物料/子产品 → 直接引用它的产品，改价时据此只失效受影响的成本缓存
+const REVERSE = /*AUTO_GENERATED_REVERSE*/null;
+// 产品售价（构建时 --sale-prices 提供）：产品编号 → 售价，供盈利排行使用
+const SALE_PRICES = /*AUTO_GENERATED_SALE*/null;
+const MATERIALS_PAYLOAD = typeof AION_MATERIALS !== 'undefined' ? AION_MATERIALS : PAYLOAD;
+const MATERIAL_ORDER = typeof AION_COLLATION !== 'undefined' ? AION_COLLATION : COLLATION;
+const RAW_MATERIALS = MATERIALS_PAYLOAD ? decodeMaterials(MATERIALS_PAYLOAD) : [
 /*AUTO_GENERATED_MATERIALS*/
 ];
-const PRODUCT_BOM = {
+const PRODUCT_BOM = PAYLOAD ? decodeRecipes(PAYLOAD) : {
 /*AUTO_GENERATED_RECIPES*/
 };
+function decodeMaterials(P) {
+  const S = P.strings, M = P.materials, out = new Array(M.id.length);
+  for (let i = 0; i < out.length; i++) {
+    const professions = [];
+    for (let k = M.profPtr[i]; k < M.profPtr[i + 1]; k++) professions.push(S[M.prof[k]]);
+    out[i] = { id: S[M.id[i]], name: S[M.name[i]], professions, source: S[M.source[i]], price: M.price[i] };
+  }
+  return out;
+}
+// 配方的材料列表按需还原：首次读取 p.materials 时才从 CSR 数组生成对象并缓存为自有属性，
+// 载入时只为每个配方建一个对象（未展开过的配方不产生逐行材料对象）
+function decodeRecipes(P) {
+  const S = P.strings, R = P.recipes, bom = {}, row = Symbol('row');
+  class Recipe {
+    constructor(i) {
+      this.id = S[R.id[i]];
+      this.name = S[R.name[i]];
+      this.level = S[R.level[i]];
+      this.levelNum = R.levelNum[i];
+      this.profession = S[R.profession[i]];
+      this.calculation_coefficient = R.coef[i];
+      this[row] = i;
+    }
+    get materials() {
+      const materials = [];
+      for (let k = R.ptr[this[row]]; k < R.ptr[this[row] + 1]; k++) {
+        materials.push(R.ref[k]
+          ? { ref: S[R.mat[k]], qty: R.qty[k], name: S[R.matName[k]] }
+          : { id: S[R.mat[k]], qty: R.qty[k], name: S[R.matName[k]] });
+      }
+      Object.defineProperty(this, 'materials', { value: materials, writable: true, enumerable: true, configurable: true });
+      return materials;
+    }
+  }
+  for (let i = 0; i < R.id.length; i++) {
+    const p = new Recipe(i);
+    bom[p.id] = p;
+  }
+  return bom;
+}
+// 展开后的原料用量（CSR 稀疏矩阵）：行 = 产品，列 = cols 中的物料编号，depth = 成功率系数的次数
+const FLAT_BOM = {
+/*AUTO_GENERATED_FLAT*/
+};
+if (SHARDS) FLAT_BOM.cols = RAW_MATERIALS.map(m => m.id);
+const USERS = REVERSE ? decodeReverse(REVERSE) : {};
+function decodeReverse(P) {
+  const out = {};
+  for (let k = 0; k < P.nodes.length; k++) {
+    if (P.ptr[k] === P.ptr[k + 1]) continue;
+    out[P.nodes[k]] = P.users.slice(P.ptr[k], P.ptr[k + 1]).map(u => P.nodes[u]);
+  }
+  return out;
+}
+// ====================  数据分片懒加载  ====================
+const loadedShards = {};
+// 以 <script> 注入加载（file:// 下同样可用），分片文件内容为 registerShard(...)
+function loadShard(file) {
+  if (!loadedShards[file]) {
+    loadedShards[file] = new Promise((resolve, reject) => {
+      const s = document.createElement('script');
+      s.src = `${SHARDS.dir}/${file}`;
+      s.onload = resolve;
+      s.onerror = () => { delete loadedShards[file]; reject(new Error(`数据分片加载失败: ${s.src}`)); };
+      document.head.appendChild(s);
+    });
+  }
+  return loadedShards[file];
+}
+// 加载某职业的配方分片及其引用到的其他职业分片；单文件模式直接完成
+function ensureShards(profession) {
+  if (!SHARDS || profession === 'all') return Promise.resolve();
+  return Promise.all((SHARDS.deps[profession] || []).map(loadShard));
+}
+function registerShard(P) {
+  const recipes = decodeRecipes(P);
+  Object.assign(PRODUCT_BOM, recipes);
+  // 分片内配方的反向依赖边随分片加入（引用方总在本分片内）
+  for (const [pid, p] of Object.entries(recipes)) {
+    for (const m of p.materials) (USERS[m.ref || m.id] = USERS[m.ref || m.id] || []).push(pid);
+  }
+  const S = P.strings, F = P.flat;
+  const colOf = {};
+  FLAT_BOM.cols.forEach((id, c) => colOf[id] = c);
+  for (let i = 0; i < F.rows.length; i++) {
+    FLAT_BOM.rows[S[F.rows[i]]] = FLAT_BOM.ptr.length - 1;
+    for (let k = F.ptr[i]; k < F.ptr[i + 1]; k++) {
+      FLAT_BOM.col.push(colOf[S[F.mat[k]]]);
+      FLAT_BOM.depth.push(F.depth[k]);
+      FLAT_BOM.qty.push(F.qty[k]);
+    }
+    FLAT_BOM.ptr.push(FLAT_BOM.col.length);
+  }
+}
+
 // ====================  全局变量  ====================
 const ALL_MATERIALS_MAP = {};
 RAW_MATERIALS.forEach(m => ALL_MATERIALS_MAP[m.id] = m);
@@ -1082,6 +1497,8 @@ function updateSuccessRate(rate) {
     calculateAndDisplayCost(currentProduct.id);
     generateBOMTree(currentProduct.id);
   }
+  if (rankTabVisible()) renderRankTable();
+  if (craftQueue.size) renderQueue();
 }
 function toggleInstantSuccess(checked) {
   isInstantSuccess = checked;
@@ -1112,39 +1529,108 @@ function initProfessionFilter() {
   sel.addEventListener('change', e => {
     currentProfession = e.target.value;
     clearProductSelection();
+    ensureShards(currentProfession).catch(err => console.error(err));
   });
 }
 
-// ====================  物料表格（包含即显示）  ====================
+// ====================  物料表格（虚拟滚动）  ====================
+// 只渲染可见区域（上下各多渲染 MATERIAL_OVERSCAN 行）的 <tr>，其余行高由首尾占位行撑起；
+// 滚动时只增删窗口边缘的行，正在编辑的单价格只要仍在窗口内就不会被重建
+const MATERIAL_OVERSCAN = 10;
+const matView = { list: [], used: 0, first: 0, last: 0, rowH: 0, rows: new Map(), top: null, bottom: null, pending: false };
+const materialOrderCache = {};
+
+// 当前种族下按本地化名称排序的物料下标；旧版数据无预计算排序时退回 localeCompare（每种族只排一次）
+function materialOrder(race) {
+  if (MATERIAL_ORDER) return MATERIAL_ORDER[race];
+  if (!materialOrderCache[race]) {
+    const names = RAW_MATERIALS.map(m => getLocalizedName(m.name, race));
+    materialOrderCache[race] = RAW_MATERIALS.map((m, i) => i).sort((a, b) => names[a].localeCompare(names[b]));
+  }
+  return materialOrderCache[race];
+}
 function initMaterialTable(highlightIds = new Set()) {
+  const used = [], rest = [];
+  for (const i of materialOrder(currentRace)) {
+    const m = RAW_MATERIALS[i];
+    if (m.source === '商店') continue;
+    if (currentProfession !== 'all' && !m.professions.includes(currentProfession)) continue;
+    (highlightIds.has(m.id) ? used : rest).push(m);
+  }
+  matView.list = used.concat(rest);
+  matView.used = used.length;
+  matView.first = matView.last = 0;
+  matView.rows.clear();
+  const tbody = document.getElementById('materialTableBody');
+  tbody.innerHTML = '<tr class="row-spacer"><td colspan="3"></td></tr><tr class="row-spacer"><td colspan="3"></td></tr>';
+  matView.top = tbody.firstElementChild;
+  matView.bottom = tbody.lastElementChild;
+  renderMaterialRows();
+  document.getElementById('materialStats').textContent = `使用到的物料：${used.length} / ${matView.list.length}`;
+}
+// 按物料面板与视口的可见交集计算行窗口，增删窗口边缘的行并更新占位高度
+function renderMaterialRows() {
   const tbody = document.getElementById('materialTableBody');
-  tbody.innerHTML = '';
-  let used = 0, total = 0;
-  const arr = [];
-  RAW_MATERIALS.forEach(m => {
-    if (m.source === '商店') return;
-    if (currentProfession !== 'all') {
-      const profs = m.professions.map(p => p.trim());
-      if (!profs.includes(currentProfession)) return;
+  const panel = tbody.closest('.material-panel').getBoundingClientRect();
+  const body = tbody.getBoundingClientRect();
+  const viewTop = Math.max(panel.top, 0), viewBottom = Math.min(panel.bottom, window.innerHeight);
+  const rowH = matView.rowH || 48, n = matView.list.length;
+  const first = Math.min(n, Math.max(0, Math.floor((viewTop - body.top) / rowH) - MATERIAL_OVERSCAN));
+  const last = Math.min(n, first + Math.ceil(Math.max(0, viewBottom - viewTop) / rowH) + 2 * MATERIAL_OVERSCAN);
+
+  for (let k = matView.first; k < matView.last; k++) {
+    if (k < first || k >= last) {
+      matView.rows.get(k).remove();
+      matView.rows.delete(k);
     }
-    arr.push(m);
-  });
-  arr.sort((a, b) => highlightIds.has(b.id) - highlightIds.has(a.id) || getLocalizedName(a.name, currentRace).localeCompare(getLocalizedName(b.name, currentRace)));
-  arr.forEach(m => {
-    total++;
-    const isUsed = highlightIds.has(m.id);
-    if (isUsed) used++;
-    const tr = document.createElement('tr');
-    tr.className = isUsed ? 'highlighted' : '';
-    // 使用本地化名称
-    const localizedName = getLocalizedName(m.name, currentRace);
-    tr.innerHTML = `
+  }
+  const keepLo = Math.max(first, matView.first), keepHi = Math.min(last, matView.last);
+  if (keepLo < keepHi) {
+    const head = matView.rows.get(keepLo);
+    for (let k = first; k < keepLo; k++) tbody.insertBefore(materialRow(k), head);
+    for (let k = keepHi; k < last; k++) tbody.insertBefore(materialRow(k), matView.bottom);
+  } else {
+    for (let k = first; k < last; k++) tbody.insertBefore(materialRow(k), matView.bottom);
+  }
+  matView.first = first;
+  matView.last = last;
+  setSpacerHeight(matView.top, first * rowH);
+  setSpacerHeight(matView.bottom, (n - last) * rowH);
+
+  // 首次渲染后以实际行高为准（移动端样式行高不同）；表格隐藏时量得 0，不记住，等下次可见时再量
+  if (!matView.rowH && last > first) {
+    const h = matView.rows.get(first).getBoundingClientRect().height;
+    if (h > 0) {
+      matView.rowH = h;
+      if (h !== rowH) renderMaterialRows();
+    }
+  }
+}
+function materialRow(k) {
+  const m = matView.list[k];
+  const tr = document.createElement('tr');
+  tr.className = k < matView.used ? 'highlighted' : '';
+  // 使用本地化名称
+  const localizedName = getLocalizedName(m.name, currentRace);
+  tr.innerHTML = `
       <td>${localizedName}</td>
       <td>${m.source}</td>
       <td contenteditable="true" data-material-id="${m.id}">${m.price}</td>`;
-    tbody.appendChild(tr);
+  matView.rows.set(k, tr);
+  return tr;
+}
+function setSpacerHeight(tr, h) {
+  tr.style.display = h > 0 ? '' : 'none';
+  tr.style.height = `${h}px`;
+}
+// 面板或页面滚动、窗口缩放时，每帧最多重算一次窗口
+function scheduleMaterialRows() {
+  if (matView.pending) return;
+  matView.pending = true;
+  requestAnimationFrame(() => {
+    matView.pending = false;
+    renderMaterialRows();
   });
-  document.getElementById('materialStats').textContent = `使用到的物料：${used} / ${total}`;
 }
 
 // ====================  产品搜索  ====================
@@ -1190,6 +1676,78 @@ const PRODUCT_LIST = (() => {
   return list;
 })();
 
+// ====================  产品搜索  ====================
+const SEARCH_RANK = SEARCH && (() => {
+  // 索引下标 → PRODUCT_LIST 中的显示顺序，结果按显示顺序排列
+  const pos = {};
+  PRODUCT_LIST.forEach((p, i) => pos[p.id] = i);
+  return Int32Array.from(SEARCH.ids, id => pos[id]);
+})();
+const SEARCH_STOP = new Set(SEARCH ? SEARCH.stop : []);
+const searchPostings = {};
+// 倒排表以差分存储，首次用到时还原
+function gramPostings(g) {
+  let list = searchPostings[g];
+  if (!list) {
+    const d = SEARCH.grams[g];
+    list = searchPostings[g] = new Int32Array(d.length);
+    for (let i = 0, v = 0; i < d.length; i++) list[i] = v += d[i];
+  }
+  return list;
+}
+function intersectSorted(a, b) {
+  const out = [];
+  for (let i = 0, j = 0; i < a.length && j < b.length;) {
+    if (a[i] < b[j]) i++;
+    else if (a[i] > b[j]) j++;
+    else { out.push(a[i]); i++; j++; }
+  }
+  return out;
+}
+// 候选下标：查询中每个二元组的倒排表求交（从最短的开始，跳过高频二元组）；返回 null 表示需逐条比对
+function searchCandidates(query) {
+  const chars = Array.from(query), lists = [];
+  for (let i = 0; i + 1 < chars.length; i++) {
+    const g = chars[i] + chars[i + 1];
+    if (SEARCH_STOP.has(g)) continue;
+    if (!Object.prototype.hasOwnProperty.call(SEARCH.grams, g)) return [];
+    lists.push(gramPostings(g));
+  }
+  if (!lists.length) return null;
+  lists.sort((a, b) => a.length - b.length);
+  return lists.reduce((acc, l) => acc.length ? intersectSorted(acc, l) : acc);
+}
+// 匹配名称（含天魔两族）、编号、拼音全拼或首字母，按显示顺序返回
+function searchProducts(query) {
+  if (!SEARCH) {
+    return PRODUCT_LIST.filter(p => {
+      if (currentProfession !== 'all' && p.profession !== currentProfession) return false;
+      if (!query) return true;
+      const localizedName = getLocalizedName(p.name, currentRace).toLowerCase();
+      return localizedName.includes(query) || p.name.toLowerCase().includes(query) || p.id.toLowerCase().includes(query);
+    });
+  }
+  const bucket = currentProfession === 'all' ? null : (SEARCH.buckets[currentProfession] || []);
+  if (!query) {
+    if (!bucket) return PRODUCT_LIST;
+    return byDisplayOrder(Array.from(bucket, k => SEARCH_RANK[k]));
+  }
+  let idx = searchCandidates(query);
+  if (bucket) idx = idx ? intersectSorted(idx, bucket) : bucket;
+  const keys = SEARCH.keys, ranks = [];
+  if (idx) {
+    for (const k of idx) if (keys[k].includes(query)) ranks.push(SEARCH_RANK[k]);
+  } else {
+    for (let k = 0; k < keys.length; k++) if (keys[k].includes(query)) ranks.push(SEARCH_RANK[k]);
+  }
+  return byDisplayOrder(ranks);
+}
+function byDisplayOrder(ranks) {
+  const sorted = Int32Array.from(ranks).sort(), out = new Array(sorted.length);
+  for (let i = 0; i < sorted.length; i++) out[i] = PRODUCT_LIST[sorted[i]];
+  return out;
+}
+
 function initProductSearch() {
   const box = document.getElementById('productSearch');
   const drop = document.getElementById('productDropdown');
@@ -1208,16 +1766,8 @@ function initProductSearch() {
 function showProductDropdown(query = '') {
   const drop = document.getElementById('productDropdown');
   drop.innerHTML = '';
-  const filtered = PRODUCT_LIST.filter(p => {
-    if (currentProfession !== 'all' && p.profession !== currentProfession) return false;
-    if (!query) return true;
-    
-    // 允许匹配原始名称、本地化名称或ID
-    const localizedName = getLocalizedName(p.name, currentRace).toLowerCase();
-    const rawNameLower = p.name.toLowerCase();
-
-    return localizedName.includes(query) || rawNameLower.includes(query) || p.id.toLowerCase().includes(query);
-  });
+  // 允许匹配原始名称、本地化名称、ID 或拼音
+  const filtered = searchProducts(query);
   if (filtered.length === 0) {
     drop.innerHTML = '<div style="padding:16px;color:#86868b;text-align:center">无匹配产品</div>';
   } else {
@@ -1241,15 +1791,20 @@ function selectProduct(p) {
   currentProduct = p;
   // 使用本地化名称显示在搜索框中
   document.getElementById('productSearch').value = getLocalizedName(p.name, currentRace);
-  const highlightIds = getProductMaterialIds(p.id);
-  initMaterialTable(highlightIds);
-  generateBOMTree(p.id);
-  calculateAndDisplayCost(p.id);
+  ensureShards(p.profession).then(() => {
+    if (currentProduct !== p) return;
+    const highlightIds = getProductMaterialIds(p.id);
+    initMaterialTable(highlightIds);
+    generateBOMTree(p.id);
+    calculateAndDisplayCost(p.id);
+  }, err => {
+    document.getElementById('treeContainer').textContent = err.message;
+  });
 }
 function clearProductSelection() {
   currentProduct = null;
   document.getElementById('productSearch').value = '';
-  document.getElementById('treeContainer').innerHTML = '<div style="color:#86868b;text-align:center;padding:20px">请选择产品</div>';
+  generateBOMTree(null);
   document.getElementById('totalCost').textContent = '0';
   document.getElementById('costDetailsBody').innerHTML = '请选择产品查看明细';
   initMaterialTable();
@@ -1257,7 +1812,44 @@ function clearProductSelection() {
 }
 
 // ====================  成本计算  ====================
+// 产品编号 → 当前成功率下的 {cost, breakdown}；改价时只沿 USERS 失效该物料的全部上游产品，成功率变化时整体清空
+const costCache = new Map();
+let costCacheRate = null;
+// 产品编号 → 用到的物料编号集合，只取决于配方结构，算过即不再变
+const materialIdsCache = new Map();
+
+function setMaterialPrice(id, price) {
+  const mat = ALL_MATERIALS_MAP[id];
+  if (!mat || mat.price === price) return;
+  mat.price = price;
+  invalidateCost(id);
+}
+function invalidateCost(id) {
+  const stack = [id], seen = new Set(stack);
+  while (stack.length) {
+    const cur = stack.pop();
+    costCache.delete(cur);
+    bestCache.delete(cur);
+    for (const u of USERS[cur] || []) {
+      if (!seen.has(u)) {
+        seen.add(u);
+        stack.push(u);
+      }
+    }
+  }
+}
+// 优先取展开行的物料列（环上产品的展开行同样按路径去重），无展开行时递归收集
 function getProductMaterialIds(productId, visited = new Set()) {
+  if (!visited.size) {
+    let ids = materialIdsCache.get(productId);
+    const row = FLAT_BOM.rows[productId];
+    if (!ids && row !== undefined) {
+      ids = new Set();
+      for (let k = FLAT_BOM.ptr[row]; k < FLAT_BOM.ptr[row + 1]; k++) ids.add(FLAT_BOM.cols[FLAT_BOM.col[k]]);
+      materialIdsCache.set(productId, ids);
+    }
+    if (ids) return ids;
+  }
   if (visited.has(productId)) return new Set();
   visited.add(productId);
   const p = PRODUCT_BOM[productId];
@@ -1299,14 +1891,96 @@ function calculateProductCost(productId, visited = new Set()) {
   });
   return { cost: total, breakdown };
 }
+function syncCostCacheRate() {
+  if (costCacheRate !== currentSuccessRate) {
+    costCache.clear();
+    bestCache.clear();
+    costCacheRate = currentSuccessRate;
+  }
+}
+// 带缓存的产品成本
+function productCost(productId) {
+  syncCostCacheRate();
+  let res = costCache.get(productId);
+  if (!res) {
+    res = computeProductCost(productId);
+    costCache.set(productId, res);
+  }
+  return res;
+}
+// 展开向量与价格的点积；无展开行（循环依赖）时退回递归计算
+function computeProductCost(productId) {
+  const row = FLAT_BOM.rows[productId];
+  if (row === undefined) return calculateProductCost(productId);
+  const rateMult = 100 / currentSuccessRate;
+  let total = 0;
+  const breakdown = {};
+  for (let k = FLAT_BOM.ptr[row]; k < FLAT_BOM.ptr[row + 1]; k++) {
+    const id = FLAT_BOM.cols[FLAT_BOM.col[k]];
+    const mat = ALL_MATERIALS_MAP[id];
+    const qty = FLAT_BOM.qty[k] * Math.pow(rateMult, FLAT_BOM.depth[k]);
+    const cost = mat.price * qty;
+    if (!breakdown[id]) breakdown[id] = { name: mat.name, qty: 0, cost: 0 };
+    breakdown[id].qty += qty;
+    breakdown[id].cost += cost;
+    total += cost;
+  }
+  return { cost: total, breakdown };
+}
+// ====================  自制 / 购买  ====================
+// 子产品出现在物料表中（编号相同）且单价 > 0 时可直接购买；每个产品取 自制 与 购买 的较小者，
+// 子配方按其最优成本计入。结果与成本缓存一同按成功率和反向依赖失效
+const bestCache = new Map();
+function marketPrice(pid) {
+  const mat = ALL_MATERIALS_MAP[pid];
+  return mat && mat.price > 0 ? mat.price : null;
+}
+function bestCost(pid, visited = new Set()) {
+  syncCostCacheRate();
+  const hit = bestCache.get(pid);
+  if (hit) return hit;
+  const p = PRODUCT_BOM[pid];
+  // 循环依赖上的子配方：能买则按市场价，否则按全自制成本
+  if (visited.has(pid) || !p) return { cost: marketPrice(pid) ?? productCost(pid).cost };
+  visited.add(pid);
+  const mult = (100 / currentSuccessRate) * p.calculation_coefficient;
+  let craft = 0;
+  p.materials.forEach(m => {
+    if (m.ref) craft += m.qty * mult * bestCost(m.ref, new Set(visited)).cost;
+    else if (ALL_MATERIALS_MAP[m.id]) craft += m.qty * mult * ALL_MATERIALS_MAP[m.id].price;
+  });
+  // 环上产品逐层展开会把环重复计入：自制成本以全自制成本（按路径去重）为上限，无环时不起作用
+  craft = Math.min(craft, productCost(pid).cost);
+  const buy = marketPrice(pid);
+  const res = buy !== null && buy < craft ? { craft, buy, cost: buy, decision: 'buy' } : { craft, buy, cost: craft, decision: 'make' };
+  bestCache.set(pid, res);
+  return res;
+}
+// 自制一件 productId 的最优方案中需要购买的中间品 {产品编号: 数量}
+function makeBuyPlan(productId) {
+  const buy = {}, stack = [[productId, 1, new Set()]];
+  while (stack.length) {
+    const [pid, qty, path] = stack.pop();
+    const p = PRODUCT_BOM[pid];
+    if (!p || path.has(pid)) continue;
+    const next = new Set(path).add(pid);
+    const mult = qty * (100 / currentSuccessRate) * p.calculation_coefficient;
+    p.materials.forEach(m => {
+      if (!m.ref) return;
+      const q = m.qty * mult;
+      if (bestCost(m.ref).decision === 'buy') buy[m.ref] = (buy[m.ref] || 0) + q;
+      else stack.push([m.ref, q, next]);
+    });
+  }
+  return buy;
+}
 function calculateAndDisplayCost(productId) {
   // 同步价格
   document.querySelectorAll('#materialTableBody td[contenteditable=true]').forEach(cell => {
     const id = cell.dataset.materialId;
-    const price = parseInt(cell.textContent) || 0;
-    if (ALL_MATERIALS_MAP[id]) ALL_MATERIALS_MAP[id].price = price;
+    setMaterialPrice(id, parseInt(cell.textContent) || 0);
   });
-  const res = calculateProductCost(productId);
+  const res = productCost(productId);
   const final = res.cost;
   document.getElementById('totalCost').textContent = `${final.toFixed(0)}G`;
   const body = document.getElementById('costDetailsBody');
@@ -1325,86 +1999,352 @@ function calculateAndDisplayCost(productId) {
   totalRow.className = 'detail-row';
   totalRow.innerHTML = `<span>总成本 (${rateText})</span><span>${final.toFixed(0)}G</span>`;
   body.appendChild(totalRow);
+
+  // 有中间品买比做便宜时，附上最优方案
+  const buy = makeBuyPlan(productId);
+  if (Object.keys(buy).length) {
+    const best = bestCost(productId).craft;
+    const rows = [`<span>最优方案：中间品择优买或做</span><span>${best.toFixed(0)}G</span>`];
+    Object.entries(buy).forEach(([pid, qty]) => {
+      const name = getLocalizedName(PRODUCT_BOM[pid].name, currentRace);
+      rows.push(`<span>　购买 ${name} (${Math.round(qty)}个)</span><span>${(qty * marketPrice(pid)).toFixed(0)}G</span>`);
+    });
+    rows.forEach(html => {
+      const row = document.createElement('div');
+      row.className = 'detail-row';
+      row.innerHTML = html;
+      body.appendChild(row);
+    });
+  }
 }
 
-// ====================  BOM 树  ====================
+// ====================  BOM 树（按路径键控的增量渲染）  ====================
+// 节点以路径为键（根产品编号 + 各层材料下标，如 "COMP0001/2/0"）；同一产品再次渲染时只改写变化的
+// 名称/用量/单价/小计文本，不重建 DOM；展开状态按路径保存，改价、调成功率、切换种族都不会折叠节点
+const bomView = { productId: null, root: null, nodes: new Map(), expanded: new Set() };
+
+// 深度优先遍历 BOM 树：enter/leave 包围子产品节点，leaf 为原料节点
+function walkBOMTree(productId, enter, leave, leaf) {
+  const rateMult = 100 / currentSuccessRate;
+  (function visit(path, p, level, qty, parentMult) {
+    const mult = parentMult * p.calculation_coefficient * rateMult;
+    const node = { path, level, name: getLocalizedName(p.name, currentRace), coef: p.calculation_coefficient, qty, hasChildren: p.materials.length > 0 };
+    enter(node);
+    p.materials.forEach((m, i) => {
+      const q = m.qty * mult;
+      if (m.ref) {
+        const child = PRODUCT_BOM[m.ref];
+        if (child) visit(`${path}/${i}`, child, level + 1, q, mult);
+      } else if (m.id) {
+        const mat = ALL_MATERIALS_MAP[m.id];
+        if (mat) leaf({ path: `${path}/${i}`, level: level + 1, name: getLocalizedName(mat.name, currentRace), qty: q, price: mat.price, sub: mat.price * q });
+      }
+    });
+    leave(node);
+  })(productId, PRODUCT_BOM[productId], 0, 1, 1);
+}
+function treeNodeText(node) {
+  const text = { name: node.name, qty: `用量: ${Math.round(node.qty)}个` };
+  if (node.price !== undefined) {
+    text.price = `单价: ${node.price}`;
+    text.sub = `小计: ${node.sub.toFixed(0)}`;
+  }
+  return text;
+}
 function generateBOMTree(productId) {
   const container = document.getElementById('treeContainer');
   const p = PRODUCT_BOM[productId];
   if (!p) {
     container.innerHTML = '<div style="color:#86868b;text-align:center;padding:20px">请选择产品</div>';
+    bomView.productId = null;
+    return;
+  }
+  if (bomView.productId === productId && container.contains(bomView.root)) {
+    updateBOMTree(productId);
     return;
   }
+  // 换产品时整树重建，默认只展开根节点
+  bomView.productId = productId;
+  bomView.expanded = new Set([productId]);
   // 注意：BOM面板已经有H3“产品结构BOM”，这里不再重复添加主产品H2/H3
-  const html = createTreeNode(productId, p, 0);
-  container.innerHTML = html;
-  const rootBtn = container.querySelector('.toggle-btn');
-  if (rootBtn) rootBtn.click();
+  container.innerHTML = renderBOMTree(productId);
+  bomView.root = container.firstElementChild;
+  bomView.nodes.clear();
+  container.querySelectorAll('.tree-node[data-path]').forEach(el => {
+    const fields = {};
+    el.firstElementChild.querySelectorAll('[data-f]').forEach(f => fields[f.dataset.f] = f);
+    bomView.nodes.set(el.dataset.path, fields);
+  });
 }
-function createTreeNode(pid, p, level, parentMult = 1) {
-  const hasChildren = p.materials && p.materials.length;
-  const margin = level * 12;
-  const mult = parentMult * p.calculation_coefficient * (100 / currentSuccessRate);
-  
-  // 使用本地化产品名称
-  const localizedProductName = getLocalizedName(p.name, currentRace);
-
-  let html = `<div class="tree-node" style="margin-left:${margin}px;${level ? 'border-left:1px solid #e5e5ea' : ''}">
-    <div class="node-header ${level === 0 ? 'tree-root' : ''}" onclick="toggleNode(this)">
-      ${hasChildren ? '<button class="toggle-btn">+</button>' : '<div style="width:24px"></div>'}
+function renderBOMTree(productId) {
+  const html = [];
+  walkBOMTree(productId, node => {
+    const t = treeNodeText(node), open = bomView.expanded.has(node.path);
+    html.push(`<div class="tree-node" data-path="${node.path}" style="margin-left:${node.level * 12}px;${node.level ? 'border-left:1px solid #e5e5ea' : ''}">
+    <div class="node-header ${node.level === 0 ? 'tree-root' : ''}" onclick="toggleNode(this)">
+      ${node.hasChildren ? `<button class="toggle-btn">${open ? '−' : '+'}</button>` : '<div style="width:24px"></div>'}
       <div class="node-info" style="flex:1">
         <div style="display:flex;justify-content:space-between;align-items:center">
-          <div><span class="node-name">${localizedProductName}</span>${p.calculation_coefficient !== 1 ? `<span class="coefficient-tag">系数: ${p.calculation_coefficient}x</span>` : ''}</div>
-          ${level ? `<div class="material-info"><span class="qty-info">用量: ${Math.round(p.qty || 1)}个</span></div>` : ''}
+          <div><span class="node-name" data-f="name">${t.name}</span>${node.coef !== 1 ? `<span class="coefficient-tag">系数: ${node.coef}x</span>` : ''}</div>
+          ${node.level ? `<div class="material-info"><span class="qty-info" data-f="qty">${t.qty}</span></div>` : ''}
         </div>
       </div>
-    </div>`;
-  if (hasChildren) {
-    html += '<div class="children">';
-    p.materials.forEach(m => {
-      const qty = m.qty * mult;
-      if (m.ref) {
-        const child = PRODUCT_BOM[m.ref];
-        if (child) {
-          child.qty = qty;
-          html += createTreeNode(m.ref, child, level + 1, mult);
-        }
-      } else if (m.id) {
-        const mat = ALL_MATERIALS_MAP[m.id];
-        if (mat) {
-          const sub = mat.price * qty;
-          // 使用本地化物料名称
-          const localizedMaterialName = getLocalizedName(mat.name, currentRace);
-          html += `<div class="tree-node" style="margin-left:${margin + 12}px">
+    </div>`);
+    if (node.hasChildren) html.push(`<div class="children${open ? ' expanded' : ''}">`);
+  }, node => {
+    html.push(node.hasChildren ? '</div></div>' : '</div>');
+  }, node => {
+    const t = treeNodeText(node);
+    html.push(`<div class="tree-node" data-path="${node.path}" style="margin-left:${node.level * 12}px">
             <div class="node-header">
               <div style="width:24px"></div>
               <div class="node-info" style="flex:1">
                 <div style="display:flex;justify-content:space-between;align-items:center">
-                  <span class="node-name">${localizedMaterialName}</span>
+                  <span class="node-name" data-f="name">${t.name}</span>
                   <div class="material-info">
-                    <span class="qty-info">用量: ${Math.round(qty)}个</span>
-                    <span class="price-info">单价: ${mat.price}</span>
-                    <span class="subtotal-info">小计: ${sub.toFixed(0)}</span>
+                    <span class="qty-info" data-f="qty">${t.qty}</span>
+                    <span class="price-info" data-f="price">${t.price}</span>
+                    <span class="subtotal-info" data-f="sub">${t.sub}</span>
                   </div>
                 </div>
               </div>
             </div>
-          </div>`;
-        }
-      }
-    });
-    html += '</div>';
-  }
-  html += '</div>';
-  return html;
+          </div>`);
+  });
+  return html.join('');
+}
+// 重新计算各节点文本，只改写与当前 DOM 不同的字段
+function updateBOMTree(productId) {
+  const patch = node => {
+    const fields = bomView.nodes.get(node.path);
+    if (!fields) return;
+    const text = treeNodeText(node);
+    for (const f in fields) {
+      if (fields[f].textContent !== text[f]) fields[f].textContent = text[f];
+    }
+  };
+  walkBOMTree(productId, patch, () => {}, patch);
 }
 function toggleNode(header) {
   const children = header.nextElementSibling;
   if (children && children.classList.contains('children')) {
-    children.classList.toggle('expanded');
+    const open = children.classList.toggle('expanded');
     const btn = header.querySelector('.toggle-btn');
-    btn.textContent = children.classList.contains('expanded') ? '−' : '+';
+    btn.textContent = open ? '−' : '+';
+    const path = header.parentElement.dataset.path;
+    if (open) bomView.expanded.add(path);
+    else bomView.expanded.delete(path);
+  }
+}
+
+// 改价防抖：连续输入只在停顿后重算一次，并合并到下一帧渲染
+const RECALC_DELAY = 120;
+let recalcTimer = 0;
+function scheduleRecalc() {
+  clearTimeout(recalcTimer);
+  recalcTimer = setTimeout(() => requestAnimationFrame(() => {
+    if (currentProduct) {
+      calculateAndDisplayCost(currentProduct.id);
+      generateBOMTree(currentProduct.id);
+    }
+    if (rankTabVisible()) renderRankTable();
+    if (craftQueue.size) renderQueue();
+  }), RECALC_DELAY);
+}
+
+// ====================  盈利排行  ====================
+// 成本取自带缓存的 productCost：改价后只有受影响的产品会重算；每次制作利润 = 利润 × 成功率（每次尝试的期望利润）
+const RANK_LIMIT = 200;
+const rankView = { sort: 'margin', desc: true };
+
+function showTab(id) {
+  document.querySelectorAll('.tab-btn').forEach(b => b.classList.toggle('active', b.dataset.tab === id));
+  ['costTab', 'rankTab'].forEach(t => document.getElementById(t).style.display = t === id ? '' : 'none');
+  if (id === 'rankTab') renderRankTable();
+}
+function initRankFilters() {
+  const profs = new Set(), levels = new Set();
+  PRODUCT_LIST.forEach(p => {
+    if (!SALE_PRICES || !SALE_PRICES[p.id]) return;
+    profs.add(p.profession);
+    levels.add(p.level);
+  });
+  const fill = (id, all, values) => {
+    const sel = document.getElementById(id);
+    sel.innerHTML = `<option value="all">${all}</option>`;
+    values.forEach(v => {
+      const opt = document.createElement('option');
+      opt.value = opt.textContent = v;
+      sel.appendChild(opt);
+    });
+    sel.addEventListener('change', renderRankTable);
+  };
+  // 等级沿用 PRODUCT_LIST 的 入门/专业 + 数字 顺序
+  fill('rankProfession', '全部职业', Array.from(profs).sort());
+  fill('rankLevel', '全部等级', Array.from(levels));
+  document.querySelectorAll('#rankTable th[data-sort]').forEach(th => th.addEventListener('click', () => {
+    rankView.desc = rankView.sort === th.dataset.sort ? !rankView.desc : true;
+    rankView.sort = th.dataset.sort;
+    renderRankTable();
+  }));
+}
+function rankTabVisible() {
+  return document.getElementById('rankTab').style.display !== 'none';
+}
+function renderRankTable() {
+  const stats = document.getElementById('rankStats');
+  if (!SALE_PRICES) {
+    stats.textContent = '未提供产品售价：生成时加 --sale-prices 售价表 后可查看盈利排行';
+    return;
+  }
+  const prof = document.getElementById('rankProfession').value;
+  const level = document.getElementById('rankLevel').value;
+  const products = PRODUCT_LIST.filter(p => SALE_PRICES[p.id] && (prof === 'all' || p.profession === prof) && (level === 'all' || p.level === level));
+  // 分片模式下先加载所涉职业的配方分片
+  Promise.all(Array.from(new Set(products.map(p => p.profession)), ensureShards)).then(() => {
+    const rows = products.map(p => {
+      const cost = productCost(p.id).cost, sale = SALE_PRICES[p.id], margin = sale - cost;
+      return { p, cost, sale, margin, pct: cost ? margin / cost * 100 : null, perCraft: margin * currentSuccessRate / 100 };
+    });
+    const dir = rankView.desc ? -1 : 1, key = rankView.sort;
+    rows.sort((a, b) => (a[key] === null) - (b[key] === null) || dir * (a[key] - b[key]));
+    const body = document.getElementById('rankTableBody');
+    body.innerHTML = '';
+    rows.slice(0, RANK_LIMIT).forEach(r => {
+      const tr = document.createElement('tr');
+      const cls = r.margin < 0 ? ' class="loss"' : '';
+      tr.innerHTML = `
+      <td>${getLocalizedName(r.p.name, currentRace)}</td><td>${r.p.profession}</td><td>${r.p.level}</td>
+      <td>${r.cost.toFixed(0)}</td><td>${r.sale}</td><td${cls}>${r.margin.toFixed(0)}</td>
+      <td${cls}>${r.pct === null ? '-' : r.pct.toFixed(1) + '%'}</td><td${cls}>${r.perCraft.toFixed(0)}</td>`;
+      tr.onclick = () => {
+        showTab('costTab');
+        selectProduct(r.p);
+      };
+      body.appendChild(tr);
+    });
+    const rateText = isInstantSuccess ? '一次性成功' : `${currentSuccessRate}% 成功率`;
+    stats.textContent = `有售价的配方 ${rows.length} 条（${rateText}）` + (rows.length > RANK_LIMIT ? `，显示前 ${RANK_LIMIT} 条` : '');
+  }, err => {
+    stats.textContent = err.message;
+  });
+}
+
+// ====================  制作队列 / 合并采购清单  ====================
+// 与 Python CostEngine.shopping_list 同口径：先按深度优先后序求出涉及产品的拓扑顺序，再从成品到子配方逐个传递需求，
+// 共用中间品的件数合并后只展开一次，每层配方各乘一次 100/成功率。
+// 环上的产品（Tarjan 强连通分量中多于一个产品，或引用自身）不再传递需求，原料按其单件成本构成折算，
+// 与 calculateProductCost 同样按路径去重，因此合计 = Σ 件数 × 单件成本
+const craftQueue = new Map(); // 产品编号 → 件数
+
+function shoppingList(orders) {
+  const order = [], index = new Map(), low = new Map(), stack = [], onStack = new Set(), cyclic = new Set();
+  const visit = pid => {
+    index.set(pid, index.size);
+    low.set(pid, index.get(pid));
+    stack.push(pid);
+    onStack.add(pid);
+    PRODUCT_BOM[pid].materials.forEach(m => {
+      if (!m.ref || !PRODUCT_BOM[m.ref]) return;
+      if (m.ref === pid) cyclic.add(pid);
+      if (!index.has(m.ref)) {
+        visit(m.ref);
+        low.set(pid, Math.min(low.get(pid), low.get(m.ref)));
+      } else if (onStack.has(m.ref)) {
+        low.set(pid, Math.min(low.get(pid), index.get(m.ref)));
+      }
+    });
+    if (low.get(pid) === index.get(pid)) {
+      const scc = stack.splice(stack.lastIndexOf(pid));
+      scc.forEach(q => onStack.delete(q));
+      if (scc.length > 1) scc.forEach(q => cyclic.add(q));
+    }
+    order.push(pid);
+  };
+  orders.forEach((n, pid) => PRODUCT_BOM[pid] && !index.has(pid) && visit(pid));
+  const rateMult = 100 / currentSuccessRate;
+  const demand = new Map(orders), products = {}, materials = {};
+  const addRaw = (id, qty) => {
+    const mat = ALL_MATERIALS_MAP[id];
+    if (!mat) return;
+    if (!materials[id]) materials[id] = { name: mat.name, qty: 0, cost: 0 };
+    materials[id].qty += qty;
+    materials[id].cost += qty * mat.price;
+  };
+  // 环外产品的引用方都在后序中排在其后（或在环上，不传递需求），逆序处理到它时需求已累计完整
+  for (let i = order.length - 1; i >= 0; i--) {
+    const pid = order[i], n = demand.get(pid);
+    if (!n) continue;
+    const p = PRODUCT_BOM[pid];
+    products[pid] = { name: p.name, qty: n, crafts: n * rateMult };
+    if (cyclic.has(pid)) {
+      Object.entries(productCost(pid).breakdown).forEach(([id, info]) => addRaw(id, n * info.qty));
+      continue;
+    }
+    const mult = n * rateMult * p.calculation_coefficient;
+    p.materials.forEach(m => {
+      if (!m.ref) return addRaw(m.id, m.qty * mult);
+      if (PRODUCT_BOM[m.ref]) demand.set(m.ref, (demand.get(m.ref) || 0) + m.qty * mult);
+    });
+  }
+  const total = Object.values(materials).reduce((sum, m) => sum + m.cost, 0);
+  return { products, materials, total };
+}
+function addToQueue() {
+  if (!currentProduct) { alert('请先选择一个产品'); return; }
+  const qty = Math.max(1, parseInt(document.getElementById('queueQty').value) || 1);
+  craftQueue.set(currentProduct.id, (craftQueue.get(currentProduct.id) || 0) + qty);
+  renderQueue();
+}
+function removeFromQueue(pid) {
+  craftQueue.delete(pid);
+  renderQueue();
+}
+function renderQueue() {
+  const list = document.getElementById('queueList');
+  if (!craftQueue.size) {
+    list.textContent = '队列为空：选择产品后加入，可合并计算多个产品的原料';
+    return;
   }
+  const shop = shoppingList(craftQueue);
+  list.innerHTML = '';
+  craftQueue.forEach((n, pid) => {
+    const row = document.createElement('div');
+    row.className = 'detail-row';
+    row.innerHTML = `<span>${getLocalizedName(PRODUCT_BOM[pid].name, currentRace)} × ${n}</span>
+      <span>${(productCost(pid).cost * n).toFixed(0)}G<button class="remove-btn" title="移出队列">✕</button></span>`;
+    row.querySelector('.remove-btn').onclick = () => removeFromQueue(pid);
+    list.appendChild(row);
+  });
+  const sum = document.createElement('div');
+  sum.className = 'detail-row';
+  sum.innerHTML = `<span>合并后原料 ${Object.keys(shop.materials).length} 种</span><span>${shop.total.toFixed(0)}G</span>`;
+  list.appendChild(sum);
+}
+function exportShoppingList() {
+  if (!craftQueue.size) { alert('制作队列为空'); return; }
+  const shop = shoppingList(craftQueue);
+  const rateText = isInstantSuccess ? '一次性成功' : `${currentSuccessRate}% 成功率`;
+  let txt = `永恒之塔2 合并采购清单 (${currentRace === 'T' ? '天族' : '魔族'}版本)\n生成时间: ${new Date().toLocaleString('zh-CN')}\n成功率设定: ${rateText}\n────────────────────────\n制作队列:\n`;
+  craftQueue.forEach((n, pid) => {
+    txt += `${getLocalizedName(PRODUCT_BOM[pid].name, currentRace).padEnd(22)} x${String(n).padStart(7)}\n`;
+  });
+  txt += `────────────────────────\n需采购原料:\n`;
+  Object.values(shop.materials).sort((a, b) => b.cost - a.cost).forEach(m => {
+    txt += `${getLocalizedName(m.name, currentRace).padEnd(22)} x${Math.round(m.qty).toString().padStart(7)}  ${m.cost.toFixed(0).padStart(12)}G\n`;
+  });
+  txt += `────────────────────────\n需制作（含中间品，件数 / 期望制作次数）:\n`;
+  Object.values(shop.products).forEach(p => {
+    txt += `${getLocalizedName(p.name, currentRace).padEnd(22)} x${Math.round(p.qty).toString().padStart(7)}  / ${p.crafts.toFixed(1)}次\n`;
+  });
+  txt += `────────────────────────\n合计: ${shop.total.toFixed(0)}G\n`;
+  const blob = new Blob([txt], { type: 'text/plain;charset=utf-8' });
+  const a = document.createElement('a');
+  a.href = URL.createObjectURL(blob);
+  a.download = `采购清单_${rateText}_${Date.now()}.txt`;
+  document.body.appendChild(a);
+  a.click();
+  document.body.removeChild(a);
 }
 
 // ====================  导出报告  ====================
@@ -1413,10 +2353,9 @@ function exportCostReport() {
   // 同步价格
   document.querySelectorAll('#materialTableBody td[contenteditable=true]').forEach(cell => {
     const id = cell.dataset.materialId;
-    const price = parseInt(cell.textContent) || 0;
-    if (ALL_MATERIALS_MAP[id]) ALL_MATERIALS_MAP[id].price = price;
+    setMaterialPrice(id, parseInt(cell.textContent) || 0);
   });
-  const res = calculateProductCost(currentProduct.id);
+  const res = productCost(currentProduct.id);
   const final = res.cost;
   const date = new Date().toLocaleString('zh-CN');
   const p = PRODUCT_BOM[currentProduct.id];
@@ -1434,6 +2373,14 @@ function exportCostReport() {
     const localizedMaterialName = getLocalizedName(info.name, currentRace);
     txt += `${localizedMaterialName.padEnd(22)} x${Math.round(info.qty).toString().padStart(7)}  ${info.cost.toFixed(0).padStart(12)}G  (${pct}%)\n`;
   });
+  const buy = makeBuyPlan(currentProduct.id);
+  if (Object.keys(buy).length) {
+    txt += `────────────────────────\n最优方案（中间品择优买或做）: ${bestCost(currentProduct.id).craft.toFixed(0)}G\n`;
+    Object.entries(buy).forEach(([pid, qty]) => {
+      const name = getLocalizedName(PRODUCT_BOM[pid].name, currentRace);
+      txt += `购买 ${name.padEnd(20)} x${Math.round(qty).toString().padStart(7)}  ${(qty * marketPrice(pid)).toFixed(0).padStart(12)}G\n`;
+    });
+  }
   txt += `\n💡 提示：成本基于当前交易行物价计算，成功率系数已应用。\n`;
   const blob = new Blob([txt], { type: 'text/plain;charset=utf-8' });
   const a = document.createElement('a');
@@ -1456,13 +2403,9 @@ document.addEventListener('input', e => {
     const cleaned = cur.replace(/[^0-9]/g, '');
     if (cur !== cleaned) e.target.textContent = cleaned;
     const id = e.target.dataset.materialId;
-    const price = parseInt(cleaned) || 0;
     if (ALL_MATERIALS_MAP[id]) {
-      ALL_MATERIALS_MAP[id].price = price;
-      if (currentProduct) {
-        calculateAndDisplayCost(currentProduct.id);
-        generateBOMTree(currentProduct.id);
-      }
+      setMaterialPrice(id, parseInt(cleaned) || 0);
+      scheduleRecalc();
     }
   }
 });
@@ -1471,11 +2414,8 @@ document.addEventListener('focusout', e => {
     e.target.textContent = '0';
     const id = e.target.dataset.materialId;
     if (ALL_MATERIALS_MAP[id]) {
-      ALL_MATERIALS_MAP[id].price = 0;
-      if (currentProduct) {
-        calculateAndDisplayCost(currentProduct.id);
-        generateBOMTree(currentProduct.id);
-      }
+      setMaterialPrice(id, 0);
+      scheduleRecalc();
     }
   }
 });
@@ -1498,13 +2438,20 @@ document.addEventListener('DOMContentLoaded', () => {
           calculateAndDisplayCost(currentProduct.id);
           generateBOMTree(currentProduct.id);
       }
+      if (rankTabVisible()) renderRankTable();
+      if (craftQueue.size) renderQueue();
     });
   }
 
+  // 物料表虚拟滚动：捕获阶段监听，面板自身滚动与页面滚动都会触发
+  document.addEventListener('scroll', scheduleMaterialRows, true);
+  window.addEventListener('resize', scheduleMaterialRows);
+
   // 首次加载初始化
   initProfessionFilter();
   initMaterialTable();
   initProductSearch();
+  initRankFilters();
 
   // 成功率
   const chk = document.getElementById('instantSuccessCheckbox');
@@ -1531,8 +2478,153 @@ document.addEventListener('DOMContentLoaded', () => {
 </body>
 </html>"""
 
+# --------------------  紧凑数据载荷  --------------------
+def compact_payload(material_items, recipe_data, flat=None) -> dict:
+    """字符串表 + 平行整数数组：名称/编号/职业等字符串只出现一次，配方材料按 CSR 排列
+
+    flat 为 flatten_recipes 的结果时，附带这些配方的展开行（物料以编号字符串引用，供分片独立加载）。
+    """
+    strings, index = [], {}
+    def sid(v):
+        k = index.get(v)
+        if k is None:
+            k = index[v] = len(strings)
+            strings.append(v)
+        return k
+    
+    mats = {"id": [], "name": [], "source": [], "price": [], "profPtr": [0], "prof": []}
+    for m in material_items:
+        mats["id"].append(sid(m['id']))
+        mats["name"].append(sid(m['name']))
+        mats["source"].append(sid(m['source']))
+        mats["price"].append(m['price'])
+        mats["prof"].extend(sid(p) for p in m['professions'])
+        mats["profPtr"].append(len(mats["prof"]))
+    
+    recs = {k: [] for k in ("id", "name", "level", "levelNum", "profession", "coef", "mat", "matName", "qty", "ref")}
+    recs["ptr"] = [0]
+    for pid, p in recipe_data.items():
+        recs["id"].append(sid(pid))
+        recs["name"].append(sid(p['name']))
+        recs["level"].append(sid(p['level']))
+        recs["levelNum"].append(p['levelNum'])
+        recs["profession"].append(sid(p['profession']))
+        recs["coef"].append(p['calculation_coefficient'])
+        for m in p['materials']:
+            recs["ref"].append(1 if 'ref' in m else 0)
+            recs["mat"].append(sid(m.get('ref', m.get('id'))))
+            recs["matName"].append(sid(m['name']))
+            recs["qty"].append(m['qty'])
+        recs["ptr"].append(len(recs["qty"]))
+    payload = {"v": 1, "strings": strings, "materials": mats, "recipes": recs}
+    
+    if flat is not None:
+        rows = {"rows": [], "ptr": [0], "mat": [], "depth": [], "qty": []}
+        for pid in recipe_data:
+            row = flat["rows"][pid]
+            lo, hi = flat["ptr"][row], flat["ptr"][row + 1]
+            rows["rows"].append(sid(pid))
+            rows["mat"].extend(sid(flat["cols"][c]) for c in flat["col"][lo:hi])
+            rows["depth"].extend(flat["depth"][lo:hi])
+            rows["qty"].extend(flat["qty"][lo:hi])
+            rows["ptr"].append(len(rows["qty"]))
+        payload["flat"] = rows
+    return payload
+
+def reverse_index(recipe_data) -> dict:
+    """反向依赖索引（CSR）：nodes[k] 被 users[ptr[k]:ptr[k+1]]（nodes 下标）直接引用
+
+    recipe_data 已按拓扑顺序排列，产品先于其他节点编号，引用方列表同样按拓扑顺序。
+    页面改价时沿此索引向上游传播，只失效受影响产品的成本缓存。
+    """
+    nodes, index = [], {}
+    def nid(v):
+        k = index.get(v)
+        if k is None:
+            k = index[v] = len(nodes)
+            nodes.append(v)
+        return k
+    
+    for pid in recipe_data:
+        nid(pid)
+    users = defaultdict(dict)
+    for pid, p in recipe_data.items():
+        for m in p['materials']:
+            users[nid(m.get('ref', m.get('id')))][index[pid]] = None
+    ptr, flat = [0], []
+    for k in range(len(nodes)):
+        flat.extend(users.get(k, ()))
+        ptr.append(len(flat))
+    return {"nodes": nodes, "ptr": ptr, "users": flat}
+
+def js_json(obj) -> str:
+    """以 JSON.parse("...") 形式内联：大对象解析比同等 JS 字面量更快，并转义 </script>"""
+    text = json.dumps(obj, ensure_ascii=False, separators=(',', ':'))
+    return "JSON.parse(" + json.dumps(text, ensure_ascii=False).replace('</', '<\\/') + ")"
+
+# --------------------  产品搜索索引  --------------------
+def search_index(recipe_data) -> dict:
+    """页面产品搜索用的预计算索引
+
+    keys   : 每个产品一条检索键，小写的原始名称、编号，以及各族名称的拼音全拼与首字母，以换行分隔
+    grams  : 检索键中二元组 → 产品下标倒排表（差分编码）；出现在超过 1/4 产品中的二元组只记入 stop，查询时跳过
+    buckets: 制作职业 → 产品下标，按职业筛选时直接取用
+    未安装 pypinyin 时不含拼音部分。
+    """
+    pinyin = pinyin_func()
+    ids = list(recipe_data)
+    keys, grams, buckets = [], defaultdict(list), defaultdict(list)
+    for k, (pid, p) in enumerate(recipe_data.items()):
+        fields = [p['name'].lower(), pid.lower()]
+        if pinyin:
+            for part in p['name'].split('/', 1):
+                syl = pinyin(part.strip())
+                fields += [''.join(syl).lower(), ''.join(s[:1] for s in syl).lower()]
+        key = '\n'.join(dict.fromkeys(f for f in fields if f))
+        keys.append(key)
+        for g in dict.fromkeys(key[i:i + 2] for i in range(len(key) - 1)):
+            if '\n' not in g:
+                grams[g].append(k)
+        buckets[p['profession']].append(k)
+    
+    limit = max(64, len(ids) // 4)
+    stop = sorted(g for g, post in grams.items() if len(post) > limit)
+    return {
+        "v": 1,
+        "ids": ids,
+        "keys": keys,
+        "grams": {g: [b - a for a, b in zip([0] + post, post)] for g, post in grams.items() if len(post) <= limit},
+        "stop": stop,
+        "buckets": buckets,
+    }
+
+def pinyin_func():
+    """可选依赖 pypinyin：返回逐字拼音函数（非汉字按字符原样保留），未安装时返回 None"""
+    try:
+        from pypinyin import lazy_pinyin
+    except ImportError:
+        return None
+    return lambda text: lazy_pinyin(text, errors=lambda chunk: list(chunk))
+
+# --------------------  物料排序  --------------------
+def material_collation(material_items) -> dict:
+    """物料表排序：{"T"/"M": 按该族本地化名称排序后的物料下标}，页面据此直接分组输出，不再逐次 localeCompare
+
+    本地化规则同页面 getLocalizedName；安装 pypinyin 时按拼音排序（接近浏览器中文排序），否则按字符编码。
+    """
+    pinyin = pinyin_func()
+    out = {}
+    for k, race in enumerate(("T", "M")):
+        keys = []
+        for m in material_items:
+            parts = m['name'].split('/')
+            name = (parts[k] if len(parts) > 1 else m['name']).strip()
+            keys.append((''.join(pinyin(name)).lower() if pinyin else '', name))
+        out[race] = sorted(range(len(keys)), key=keys.__getitem__)
+    return out
+
 # --------------------  生成 HTML  --------------------
-def generate_html(material_items, recipe_data):
+def generate_html(material_items, recipe_data, sale=None):
     print("\n" + "="*60)
     print("[步骤3] 生成 HTML")
     print("="*60)
@@ -1540,28 +2632,970 @@ def generate_html(material_items, recipe_data):
     # 检查数据有效性
     if not material_items:
         print("[✗] 物料数据为空，无法生成HTML")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
+        fail()
     if not recipe_data:
         print("[✗] 配方数据为空，无法生成HTML")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
+        fail()
     
-    html = HTML_TEMPLATE.replace('/*AUTO_GENERATED_MATERIALS*/', json.dumps(material_items, ensure_ascii=False, indent=2)[1:-1])
-    html = html.replace('/*AUTO_GENERATED_RECIPES*/', json.dumps(recipe_data, ensure_ascii=False, indent=2)[1:-1])
     out = Path(CFG["HTML_OUT"])
+    if pinyin_func() is None:
+        print("[⚠] 未安装 pypinyin，产品搜索不支持拼音/首字母（pip install pypinyin 后重新生成）")
+    if CFG["OUTPUT_MODE"] == "shards":
+        files = shard_files(material_items, recipe_data, out, sale)
+    else:
+        files = {out: render_single(material_items, recipe_data, sale)}
     
     try:
-        out.write_text(html, encoding='utf-8')
+        written = [p for p, text in files.items() if write_if_changed(p, text)]
+        html = files[out]
         print(f"[✓] HTML 已生成：{out.resolve()}")
         print(f"[📊] 文件大小: {len(html)/1024:.1f} KB")
+        if len(files) > 1:
+            removed = remove_stale_shards(shard_dir(out), files)
+            size = sum(len(t) for p, t in files.items() if p != out)
+            updated = sum(p != out for p in written)
+            print(f"[📦] 数据分片: {len(files) - 1} 个文件（{size/1024:.1f} KB），本次更新 {updated} 个"
+                  + (f"，清理 {removed} 个过期分片" if removed else ""))
     except Exception as e:
         print(f"[✗] 写入文件失败: {e}")
-        input("\n按 Enter 退出...")
-        sys.exit(1)
+        fail()
+    return files
+
+def render_single(material_items, recipe_data, sale=None) -> str:
+    """单文件模式：全部数据内联到 HTML"""
+    from aion_cost import flatten_recipes
+    if CFG["PAYLOAD"] == "compact":
+        html = HTML_TEMPLATE.replace('/*AUTO_GENERATED_PAYLOAD*/null', js_json(compact_payload(material_items, recipe_data)))
+        html = html.replace('/*AUTO_GENERATED_MATERIALS*/', '').replace('/*AUTO_GENERATED_RECIPES*/', '')
+    else:
+        html = HTML_TEMPLATE.replace('/*AUTO_GENERATED_MATERIALS*/', json.dumps(material_items, ensure_ascii=False, indent=2)[1:-1])
+        html = html.replace('/*AUTO_GENERATED_RECIPES*/', json.dumps(recipe_data, ensure_ascii=False, indent=2)[1:-1])
+    flat = flatten_recipes(recipe_data, [m['id'] for m in material_items])
+    html = html.replace('/*AUTO_GENERATED_FLAT*/', json.dumps(flat, ensure_ascii=False, separators=(',', ':'))[1:-1])
+    html = html.replace('/*AUTO_GENERATED_SEARCH*/null', js_json(search_index(recipe_data)))
+    html = html.replace('/*AUTO_GENERATED_COLLATION*/null', js_json(material_collation(material_items)))
+    html = html.replace('/*AUTO_GENERATED_REVERSE*/null', js_json(reverse_index(recipe_data)))
+    if sale:
+        html = html.replace('/*AUTO_GENERATED_SALE*/null', js_json(sale))
+    return html.replace('<!--AUTO_GENERATED_DATA_SCRIPTS-->\n', '')
+
+def write_if_changed(p: Path, text: str) -> bool:
+    """内容未变时不重写，分片模式下仅改单价只会更新 materials.js"""
+    try:
+        if p.read_text(encoding='utf-8') == text:
+            return False
+    except (OSError, ValueError):
+        pass
+    p.parent.mkdir(parents=True, exist_ok=True)
+    p.write_text(text, encoding='utf-8')
+    return True
+
+# --------------------  分片输出（按职业懒加载）  --------------------
+def shard_dir(out: Path) -> Path:
+    """index_generated.html → index_generated_data/"""
+    return out.with_name(out.stem + "_data")
+
+def shard_files(material_items, recipe_data, out: Path, sale=None) -> dict:
+    """静态外壳 + materials.js + 每个制作职业一个配方分片，返回 {路径: 内容}
+
+    外壳只含产品索引（名称、等级、职业等，用于搜索与筛选），随 BOM 变化；
+    物料单价单独放在 materials.js；配方与展开向量按职业拆分，页面选中职业或产品时才加载，
+    deps 记录每个职业（传递）引用到的其他职业分片。
+    """
+    from aion_cost import flatten_recipes
+    flat = flatten_recipes(recipe_data, [m['id'] for m in material_items])
+    folder = shard_dir(out)
+    
+    by_prof = defaultdict(dict)
+    for pid, p in recipe_data.items():
+        by_prof[p['profession']][pid] = p
+    profs = sorted(by_prof)
+    file_of = {prof: f"recipes-{k:02d}.js" for k, prof in enumerate(profs)}
+    
+    deps = {}
+    for prof in profs:
+        seen, stack = {prof}, [pid for pid in by_prof[prof]]
+        visited = set(stack)
+        while stack:
+            for m in recipe_data[stack.pop()]['materials']:
+                ref = m.get('ref')
+                if ref in recipe_data and ref not in visited:
+                    visited.add(ref)
+                    seen.add(recipe_data[ref]['profession'])
+                    stack.append(ref)
+        deps[prof] = [file_of[p] for p in sorted(seen)]
+    
+    files = {}
+    for prof in profs:
+        payload = compact_payload([], by_prof[prof], flat)
+        files[folder / file_of[prof]] = f"registerShard({js_json(payload)});\n"
+    files[folder / "materials.js"] = (f"var AION_MATERIALS = {js_json(compact_payload(material_items, {}))};\n"
+                                      f"var AION_COLLATION = {js_json(material_collation(material_items))};\n")
+    
+    index = {pid: {**p, 'materials': []} for pid, p in recipe_data.items()}
+    shards = {"dir": folder.name, "deps": deps}
+    html = HTML_TEMPLATE.replace('/*AUTO_GENERATED_PAYLOAD*/null', js_json(compact_payload([], index)))
+    html = html.replace('/*AUTO_GENERATED_SHARDS*/null', js_json(shards))
+    if sale:
+        html = html.replace('/*AUTO_GENERATED_SALE*/null', js_json(sale))
+    html = html.replace('/*AUTO_GENERATED_SEARCH*/null', js_json(search_index(recipe_data)))
+    html = html.replace('/*AUTO_GENERATED_MATERIALS*/', '').replace('/*AUTO_GENERATED_RECIPES*/', '')
+    html = html.replace('/*AUTO_GENERATED_FLAT*/', '"cols":[],"rows":{},"ptr":[0],"col":[],"depth":[],"qty":[]')
+    html = html.replace('<!--AUTO_GENERATED_DATA_SCRIPTS-->', f'<script src="{folder.name}/materials.js"></script>')
+    return {out: html, **files}
+
+def remove_stale_shards(folder: Path, files: dict) -> int:
+    """删除已不存在的职业留下的旧分片"""
+    removed = 0
+    for p in folder.glob("recipes-*.js"):
+        if p not in files:
+            p.unlink()
+            removed += 1
+    return removed
+
+# --------------------  增量构建（内容哈希清单）  --------------------
+MANIFEST_VERSION = 2
+# 页面数据（展开向量）与缓存快照还依赖这些本地模块，改动后同样需要重建
+GENERATOR_MODULES = ("aion_cost.py", "aion_snapshot.py")
+
+def sha256_file(p: Path, block: int = 1 << 20):
+    """流式计算文件 SHA-256；文件不存在时返回 None（交由后续步骤报错）"""
+    if not p.exists():
+        return None
+    h = hashlib.sha256()
+    with p.open('rb') as f:
+        while chunk := f.read(block):
+            h.update(chunk)
+    return h.hexdigest()
+
+def sha256_text(s: str) -> str:
+    return hashlib.sha256(s.encode('utf-8')).hexdigest()
+
+def manifest_path() -> Path:
+    """清单与输出文件放在一起：index_generated.html → index_generated.manifest.json"""
+    out = Path(CFG["HTML_OUT"])
+    return out.with_name(out.stem + ".manifest.json")
+
+def input_manifest() -> dict:
+    """当前输入的内容哈希：两份 CSV、HTML 模板、CFG 以及生成脚本本身和它依赖的本地模块"""
+    return {
+        "version":   MANIFEST_VERSION,
+        "material":  sha256_file(Path(CFG["MATERIAL_CSV"])),
+        "bom":       sha256_file(Path(CFG["BOM_CSV"])),
+        "sale":      sha256_file(Path(CFG["SALE_PRICES"])) if CFG["SALE_PRICES"] else "",
+        "template":  sha256_text(HTML_TEMPLATE),
+        "cfg":       sha256_text(json.dumps(CFG, sort_keys=True, ensure_ascii=False)),
+        "generator": generator_hash(),
+    }
+
+def generator_hash():
+    """生成脚本与 GENERATOR_MODULES 的合并哈希；任一文件缺失时返回 None（视为需要重建）"""
+    hashes = [sha256_file(Path(__file__).resolve()), *(sha256_file(SCRIPT_DIR / m) for m in GENERATOR_MODULES)]
+    return None if None in hashes else sha256_text(''.join(hashes))
+
+def load_manifest() -> dict:
+    try:
+        return json.loads(manifest_path().read_text(encoding='utf-8'))
+    except (OSError, ValueError):
+        return {}
+
+def is_up_to_date(old: dict, new: dict) -> bool:
+    """输入哈希一致且所有输出文件（HTML 及分片）均未被改动时，本次构建为空操作"""
+    if not old or any(old.get(k) != v for k, v in new.items()) or None in new.values():
+        return False
+    outputs = old.get("outputs") or {}
+    return bool(outputs) and all(sha256_file(Path(p)) == h for p, h in outputs.items())
+
+def save_manifest(manifest: dict, files: dict):
+    manifest = {**manifest, "outputs": {str(p): sha256_text(text) for p, text in files.items()}}
+    try:
+        manifest_path().write_text(json.dumps(manifest, indent=2), encoding='utf-8')
+    except OSError as e:
+        print(f"[⚠] 清单写入失败: {e}")
+
+def snapshot_path(manifest: dict) -> Path:
+    """完整快照（物料 + 配方）只依赖两份 CSV 与生成逻辑；命中时无需 pandas / chardet"""
+    key = sha256_text(f"{manifest['material']}{manifest['bom']}{manifest['generator']}")
+    return cache_dir() / f"snapshot-{key[:16]}.snap"
+
+def recipe_cache_path(manifest: dict, base_map: dict) -> Path:
+    """配方只依赖 BOM、物料名称→编码映射和生成逻辑；仅改单价时键不变，可跳过 BOM 解析"""
+    key = sha256_text(f"{manifest['bom']}{manifest['generator']}" + json.dumps(base_map, sort_keys=True, ensure_ascii=False))
+    return cache_dir() / f"recipes-{key[:16]}.snap"
+
+def save_cache_snapshot(p: Path, material_items, recipes: dict, name2id: dict):
+    """写入缓存快照，并清理同类的旧快照（含早期的 JSON 配方缓存）"""
+    from aion_snapshot import save_snapshot
+    try:
+        p.parent.mkdir(parents=True, exist_ok=True)
+        save_snapshot(p, material_items, recipes, name2id)
+        kind = p.name.split('-', 1)[0]
+        for old in p.parent.glob(f"{kind}-*"):
+            if old != p:
+                old.unlink()
+    except OSError as e:
+        print(f"[⚠] 快照缓存写入失败: {e}")
+
+# --------------------  批量定价（无界面）  --------------------
+def load_price_overrides(p: Path, material_items, name2id=None) -> dict:
+    """读取单价覆盖表 → {物料编号: 单价}
+
+    .json：{物料编号或原料名称: 单价}；其他：CSV，需含 原料名称,单价 两列（可直接用另一份物料表）。
+    传入 name2id 时也接受产品名称/编号，其单价作为该中间品的市场价。
+    """
+    by_name = {**(name2id or {}), **{m['name']: m['id'] for m in material_items}}
+    ids = set(by_name.values())
+    pairs = read_pairs(p, '原料名称', '单价', '单价覆盖')
+    
+    overrides, unknown = {}, []
+    for key, price in pairs:
+        mid = key if key in ids else by_name.get(key)
+        if mid is None:
+            unknown.append(key)
+        else:
+            overrides[mid] = safe_int(price)
+    print(f"[✓] 单价覆盖: {len(overrides)} 项")
+    if unknown:
+        print(f"[⚠] 忽略 {len(unknown)} 个未知物料: {'、'.join(unknown[:10])}{' 等' if len(unknown) > 10 else ''}")
+    return overrides
+
+def read_pairs(p: Path, name_col: str, price_col: str, what: str) -> list:
+    """.json 为 {名称或编号: 数值} 或 [[名称或编号, 数值], ...]；其他按 CSV 读取 name_col, price_col 两列，返回 [(键, 原始数值)]"""
+    if p.suffix.lower() == '.json':
+        try:
+            raw = json.loads(p.read_text(encoding='utf-8-sig'))
+        except (OSError, ValueError) as e:
+            print(f"[✗] 读取{what}失败: {e}")
+            fail()
+        if isinstance(raw, dict):
+            raw = raw.items()
+        elif not (isinstance(raw, list) and all(isinstance(r, list) and len(r) == 2 for r in raw)):
+            print(f"[✗] {what}格式错误: {p.name} 应为 {{名称或编号: 数值}} 或 [[名称或编号, 数值], ...]")
+            fail()
+        return [(str(k).strip(), v) for k, v in raw]
+    pairs = []
+    for df in read_csv_chunks(p, {name_col, price_col}):
+        pairs.extend(zip(df[name_col].astype(str).str.strip(), df[price_col]))
+    return pairs
+
+def load_sale_prices(p: Path, recipes: dict, name2id: dict) -> dict:
+    """读取产品售价 → {产品编号: 售价}
+
+    .json：{产品名称或编号: 售价}；其他：CSV，需含 名称,售价 两列（可直接用加了 售价 列的 bom.csv）。
+    售价为空或 ≤ 0 的行视为无售价。
+    """
+    sale, unknown = {}, []
+    for key, price in read_pairs(p, '名称', '售价', '售价表'):
+        pid = key if key in recipes else name2id.get(key)
+        if pid not in recipes:
+            unknown.append(key)
+        elif safe_int(price) > 0:
+            sale[pid] = safe_int(price)
+    print(f"[✓] 产品售价: {len(sale)} 项")
+    if unknown:
+        print(f"[⚠] 忽略 {len(unknown)} 个未知产品: {'、'.join(unknown[:10])}{' 等' if len(unknown) > 10 else ''}")
+    return sale
+
+def price_table(material_items, recipes, overrides, rates):
+    """全部配方在各成功率下的单件总成本及原料构成"""
+    from aion_cost import CostEngine
+    engine = CostEngine(recipes, material_items)
+    prices = engine.price_vector(overrides)
+    table = [{
+        "id": pid,
+        "name": p['name'],
+        "profession": p['profession'],
+        "level": p['level'],
+        "calculation_coefficient": p['calculation_coefficient'],
+        "rates": {},
+    } for pid, p in recipes.items()]
+    for rate in rates:
+        costs = engine.price_all(prices, rate)
+        for row in table:
+            row["rates"][str(rate)] = {
+                "cost": round(costs[row["id"]], 2),
+                "breakdown": [
+                    {"id": mid, "name": b["name"], "qty": round(b["qty"], 4), "cost": round(b["cost"], 2)}
+                    for mid, b in engine.breakdown(row["id"], prices, rate).items()
+                ],
+            }
+    return table
+
+def write_price_table(table, out: Path):
+    """.json 原样输出；其他按 CSV 长表输出（每个 产品×成功率×原料 一行，Excel 可直接打开）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(table, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{
+                '产品编号': r['id'], '产品名称': r['name'], '制作职业': r['profession'], '需求等级': r['level'],
+                '计算系数': r['calculation_coefficient'], '成功率': rate, '总成本': c['cost'],
+                '物料编号': b['id'], '物料名称': b['name'], '用量': b['qty'], '物料成本': b['cost'],
+            } for r in table for rate, c in r['rates'].items() for b in (c['breakdown'] or [{'id': '', 'name': '', 'qty': 0, 'cost': 0}])]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 成本表已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_price(args):
+    print("\n" + "="*60)
+    print("  AION 批量定价")
+    print("="*60)
+    material_items, recipe_data, _ = load_data(input_manifest())
+    overrides = load_price_overrides(args.prices, material_items) if args.prices else {}
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 计算成本（成功率: {', '.join(f'{r}%' for r in args.rates)}）")
+    print("="*60)
+    table = price_table(material_items, recipe_data, overrides, args.rates)
+    write_price_table(table, args.out)
+    print(f"[📊] 产品 {len(table)} 条 × 成功率 {len(args.rates)} 档")
+
+# --------------------  盈利排行  --------------------
+RANK_KEYS = {'margin': '利润', 'margin_pct': '利润率', 'per_craft': '每次制作利润'}
+
+def profit_table(material_items, recipes, sale, overrides, rate, professions=(), levels=(), sort='margin'):
+    """有售价的配方在指定成功率下的成本、利润、利润率与每次制作期望利润，按 sort 降序
+
+    成本由 price_all 按拓扑顺序一次记忆化求出（成功率系数已计入，即每件成品的期望成本）；
+    每次制作利润 = 利润 × 成功率，即每尝试制作一次的期望利润。professions / levels 非空时只保留匹配的配方。
+    """
+    from aion_cost import CostEngine
+    engine = CostEngine(recipes, material_items)
+    cost = engine.price_all(engine.price_vector(overrides), rate)
+    table = []
+    for pid, price in sale.items():
+        p = recipes[pid]
+        if (professions and p['profession'] not in professions) or (levels and p['level'] not in levels):
+            continue
+        margin = price - cost[pid]
+        table.append({
+            "id": pid,
+            "name": p['name'],
+            "profession": p['profession'],
+            "level": p['level'],
+            "cost": round(cost[pid], 2),
+            "sale": price,
+            "margin": round(margin, 2),
+            "margin_pct": round(margin / cost[pid] * 100, 2) if cost[pid] else None,
+            "per_craft": round(margin * rate / 100, 2),
+        })
+    table.sort(key=lambda r: -float('inf') if r[sort] is None else r[sort], reverse=True)
+    return table
+
+def write_profit_table(table, out: Path, rate):
+    """.json 原样输出；其他按 CSV 输出（每个配方一行，已按排序键降序）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(table, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{
+                '排名': k, '产品编号': r['id'], '产品名称': r['name'], '制作职业': r['profession'], '需求等级': r['level'],
+                '成功率': rate, '成本': r['cost'], '售价': r['sale'], '利润': r['margin'], '利润率(%)': r['margin_pct'],
+                '每次制作利润': r['per_craft'],
+            } for k, r in enumerate(table, 1)]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 盈利排行已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_rank(args):
+    print("\n" + "="*60)
+    print("  AION 盈利排行")
+    print("="*60)
+    material_items, recipe_data, name2id = load_data(input_manifest())
+    sale = load_sale_prices(args.sale_prices, recipe_data, name2id)
+    overrides = load_price_overrides(args.prices, material_items) if args.prices else {}
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 计算利润（成功率: {args.rate}%，按{RANK_KEYS[args.sort]}排序）")
+    print("="*60)
+    table = profit_table(material_items, recipe_data, sale, overrides, args.rate,
+                         set(args.profession or ()), set(args.level or ()), args.sort)
+    write_profit_table(table, args.out, args.rate)
+    print(f"[📊] 有售价的配方 {len(table)} 条，前 {min(10, len(table))} 名：")
+    for k, r in enumerate(table[:10], 1):
+        pct = '-' if r['margin_pct'] is None else f"{r['margin_pct']}%"   # 零成本配方无利润率，与页面一致显示 -
+        print(f"  {k:>2}. [{r['profession']} {r['level']}] {r['name']}  利润 {r['margin']:.0f}  利润率 {pct}")
+
+# --------------------  合并采购清单  --------------------
+def parse_orders(args, recipes: dict, name2id: dict) -> dict:
+    """--order 名称或编号=件数（可重复）与 --orders 文件（.json {名称或编号: 件数} 或含 名称,数量 的 CSV）→ {产品编号: 件数}"""
+    pairs = []
+    for item in args.order or ():
+        key, _, qty = item.rpartition('=')
+        pairs.append((key.strip(), qty) if key else (item.strip(), 1))
+    if args.orders:
+        pairs.extend(read_pairs(args.orders, '名称', '数量', '制作清单'))
+    orders, unknown = defaultdict(int), []
+    for key, qty in pairs:
+        pid = key if key in recipes else name2id.get(key)
+        if pid not in recipes:
+            unknown.append(key)
+        elif safe_int(qty) > 0:
+            orders[pid] += safe_int(qty)
+    if unknown:
+        print(f"[⚠] 忽略 {len(unknown)} 个未知产品: {'、'.join(unknown[:10])}{' 等' if len(unknown) > 10 else ''}")
+    if not orders:
+        print("[✗] 制作清单为空：请用 --order 名称=件数 或 --orders 文件 指定产品")
+        fail()
+    return dict(orders)
+
+def write_shopping_list(shop, out: Path):
+    """.json 原样输出；其他按 CSV 输出（原料在前、中间品与成品在后，每项一行）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(shop, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{'类型': '原料', '编号': mid, '名称': m['name'], '数量': round(m['qty'], 4),
+                     '制作次数': '', '金额': round(m['cost'], 2)} for mid, m in shop['materials'].items()]
+            rows += [{'类型': '制作', '编号': pid, '名称': p['name'], '数量': round(p['qty'], 4),
+                      '制作次数': round(p['crafts'], 4), '金额': ''} for pid, p in shop['products'].items()]
+            rows.append({'类型': '合计', '编号': '', '名称': '', '数量': '', '制作次数': '', '金额': round(shop['total'], 2)})
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 采购清单已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_shop(args):
+    print("\n" + "="*60)
+    print("  AION 合并采购清单")
+    print("="*60)
+    from aion_cost import CostEngine
+    material_items, recipe_data, name2id = load_data(input_manifest())
+    orders = parse_orders(args, recipe_data, name2id)
+    overrides = load_price_overrides(args.prices, material_items) if args.prices else {}
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 汇总原料（成功率: {args.rate}%）")
+    print("="*60)
+    shop = CostEngine(recipe_data, material_items).shopping_list(orders, overrides, args.rate)
+    write_shopping_list(shop, args.out)
+    print(f"[📊] 成品 {len(orders)} 种 {sum(orders.values())} 件，原料 {len(shop['materials'])} 种，"
+          f"需制作 {len(shop['products'])} 种产品，合计 {shop['total']:.0f}G")
+
+# --------------------  期望成本（按配方成功率）  --------------------
+PERCENTILES = (50, 90, 95, 99)
+
+def load_rate_table(p: Path, recipes: dict, name2id: dict) -> dict:
+    """读取成功率表 → {产品编号或需求等级: 成功率}
+
+    .json：{产品名称/编号或需求等级: 成功率}；其他：CSV，需含 名称,成功率 两列。
+    名称可为产品名称、产品编号或需求等级（如 专业10，对该等级全部配方生效，单个配方的设置优先）。
+    """
+    levels = {r['level'] for r in recipes.values()}
+    table, unknown, invalid = {}, [], []
+    for key, rate in read_pairs(p, '名称', '成功率', '成功率表'):
+        pid = key if key in recipes or key in levels else name2id.get(key)
+        if pid is None:
+            unknown.append(key)
+            continue
+        try:
+            table[pid] = success_rate(rate)
+        except (TypeError, ValueError, argparse.ArgumentTypeError):
+            invalid.append(key)
+    print(f"[✓] 成功率表: {len(table)} 项（其中需求等级 {sum(k in levels for k in table)} 项）")
+    if unknown:
+        print(f"[⚠] 忽略 {len(unknown)} 个未知产品/等级: {'、'.join(unknown[:10])}{' 等' if len(unknown) > 10 else ''}")
+    if invalid:
+        print(f"[⚠] 忽略 {len(invalid)} 个无效成功率（应在 (0, 100] 之间）: {'、'.join(invalid[:10])}")
+    return table
+
+def expected_table(material_items, recipes, overrides, rates, default_rate, samples=0, seed=None, products=()):
+    """各配方按自身成功率的期望成本与标准差；samples > 0 时另做蒙特卡洛模拟给出成本分位数
+
+    products 非空时只输出这些产品（子配方仍全部参与计算）。
+    """
+    from aion_cost import CostEngine
+    engine = CostEngine(recipes, material_items)
+    prices = engine.price_vector(overrides)
+    stats = engine.expected_costs(prices, rates, default_rate)
+    table = []
+    for pid in products or recipes:
+        p = recipes[pid]
+        row = {
+            "id": pid,
+            "name": p['name'],
+            "profession": p['profession'],
+            "level": p['level'],
+            "rate": stats[pid]["rate"],
+            "mean": round(stats[pid]["mean"], 2),
+            "std": round(stats[pid]["std"], 2),
+        }
+        if samples:
+            cost = engine.monte_carlo({pid: 1}, prices, rates, default_rate, samples, seed)
+            row["percentiles"] = {str(q): round(float(v), 2) for q, v in zip(PERCENTILES, np.percentile(cost, PERCENTILES))}
+        table.append(row)
+    return table
+
+def write_expected_table(table, out: Path):
+    """.json 原样输出；其他按 CSV 输出（每个配方一行，分位数各占一列）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(table, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{
+                '产品编号': r['id'], '产品名称': r['name'], '制作职业': r['profession'], '需求等级': r['level'],
+                '成功率': r['rate'], '期望成本': r['mean'], '标准差': r['std'],
+                **{f'P{q}': v for q, v in r.get('percentiles', {}).items()},
+            } for r in table]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 期望成本表已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_expect(args):
+    print("\n" + "="*60)
+    print("  AION 期望成本（按配方成功率）")
+    print("="*60)
+    material_items, recipe_data, name2id = load_data(input_manifest())
+    load_deps()
+    rates = load_rate_table(args.rate_table, recipe_data, name2id) if args.rate_table else {}
+    overrides = load_price_overrides(args.prices, material_items) if args.prices else {}
+    products = []
+    for key in args.product or ():
+        pid = key if key in recipe_data else name2id.get(key)
+        if pid in recipe_data:
+            products.append(pid)
+        else:
+            print(f"[⚠] 忽略未知产品: {key}")
+    
+    print("\n" + "="*60)
+    mode = f"，蒙特卡洛 {args.samples} 次" if args.samples else ""
+    print(f"[步骤3] 计算期望成本（未指定的配方成功率: {args.default_rate}%{mode}）")
+    print("="*60)
+    table = expected_table(material_items, recipe_data, overrides, rates, args.default_rate,
+                           args.samples, args.seed, products)
+    write_expected_table(table, args.out)
+    print(f"[📊] 产品 {len(table)} 条")
+
+# --------------------  自制 / 购买 方案  --------------------
+def make_buy_table(material_items, recipes, overrides, rates):
+    """全部配方在各成功率下的 全自制成本、最优成本（中间品择优买或做）与需购买的中间品"""
+    from aion_cost import CostEngine
+    engine = CostEngine(recipes, material_items)
+    prices = engine.price_vector(overrides)
+    market = {pid: v for pid, v in overrides.items() if pid in recipes}
+    table = []
+    for rate in rates:
+        full = engine.price_all(prices, rate)
+        best = engine.make_or_buy(prices, market, rate)
+        for pid, p in recipes.items():
+            plan = engine.make_buy_plan(pid, best, rate)
+            table.append({
+                "id": pid,
+                "name": p['name'],
+                "profession": p['profession'],
+                "level": p['level'],
+                "rate": rate,
+                "full_craft": round(full[pid], 2),
+                "craft": round(best[pid]["craft"], 2),
+                "buy": None if best[pid]["buy"] is None else round(best[pid]["buy"], 2),
+                "decision": best[pid]["decision"],
+                "saving": round(full[pid] - best[pid]["cost"], 2),
+                "buy_intermediates": [{"id": ref, "name": recipes[ref]['name'], "qty": round(q, 4)} for ref, q in plan["buy"].items()],
+            })
+    return table
+
+def write_make_buy_table(table, out: Path):
+    """.json 原样输出；其他按 CSV 输出（每个 产品×成功率 一行，需购买的中间品合并为一列）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(table, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{
+                '产品编号': r['id'], '产品名称': r['name'], '制作职业': r['profession'], '需求等级': r['level'],
+                '成功率': r['rate'], '全自制成本': r['full_craft'], '最优自制成本': r['craft'], '市场价': r['buy'],
+                '建议': '购买' if r['decision'] == 'buy' else '自制', '节省': r['saving'],
+                '购买中间品': '；'.join(f"{b['name']}×{b['qty']:g}" for b in r['buy_intermediates']),
+            } for r in table]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 自制/购买方案已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_plan(args):
+    print("\n" + "="*60)
+    print("  AION 自制 / 购买 方案")
+    print("="*60)
+    material_items, recipe_data, name2id = load_data(input_manifest())
+    overrides = load_price_overrides(args.prices, material_items, name2id) if args.prices else {}
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 求解最优方案（成功率: {', '.join(f'{r}%' for r in args.rates)}）")
+    print("="*60)
+    table = make_buy_table(material_items, recipe_data, overrides, args.rates)
+    write_make_buy_table(table, args.out)
+    bought = sum(bool(r['buy_intermediates']) for r in table)
+    print(f"[📊] 产品 {len(recipe_data)} 条 × 成功率 {len(args.rates)} 档，其中 {bought} 项方案需购买中间品")
+
+# --------------------  单价敏感度  --------------------
+def write_sensitivity(engine, grad, prices, out: Path):
+    """.json 输出 CSR 稀疏矩阵本身；其他按 CSV 三元组输出（每个 产品×物料 非零梯度一行）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            data = {k: (v.tolist() if isinstance(v, np.ndarray) else v) for k, v in grad.items()}
+            out.write_text(json.dumps(data, ensure_ascii=False, separators=(',', ':')), encoding='utf-8')
+        else:
+            rows = np.repeat(np.arange(len(grad["rows"])), np.diff(grad["ptr"]))
+            cost = grad["val"] * prices[grad["col"]]
+            total = np.bincount(rows, cost, minlength=len(grad["rows"]))
+            load_deps()
+            pd.DataFrame({
+                '产品编号': [grad["rows"][r] for r in rows],
+                '产品名称': [engine.recipes[grad["rows"][r]]['name'] for r in rows],
+                '物料编号': [grad["cols"][c] for c in grad["col"]],
+                '物料名称': [engine.materials[c]['name'] for c in grad["col"]],
+                'd成本/d单价': grad["val"].round(4),
+                '物料成本': cost.round(2),
+                '成本占比(%)': (np.divide(cost, total[rows], out=np.zeros_like(cost), where=total[rows] > 0) * 100).round(2),
+            }).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 敏感度矩阵已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def write_material_impact(impact, engine, prices, out: Path):
+    """.json 原样输出；其他按 CSV 输出（每个原料一行，按成本贡献降序）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(impact, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{
+                '排名': k, '物料编号': mid, '物料名称': m['name'], '单价': prices[engine.col_of[mid]],
+                '受影响产品数': m['products'], '全目录用量': round(m['qty'], 4), '成本贡献': round(m['cost'], 2),
+                '占比(%)': round(m['share'] * 100, 2), '影响最大的产品': engine.recipes[m['top']]['name'],
+            } for k, (mid, m) in enumerate(impact.items(), 1)]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 原料影响排行已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_sensitivity(args):
+    print("\n" + "="*60)
+    print("  AION 单价敏感度")
+    print("="*60)
+    from aion_cost import CostEngine
+    material_items, recipe_data, _ = load_data(input_manifest())
+    load_deps()
+    overrides = load_price_overrides(args.prices, material_items) if args.prices else {}
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 计算 d(成本)/d(单价)（成功率: {args.rate}%）")
+    print("="*60)
+    engine = CostEngine(recipe_data, material_items)
+    prices = engine.price_vector(overrides)
+    grad = engine.sensitivity(args.rate)
+    impact = engine.material_impact(prices, args.rate, grad)
+    write_sensitivity(engine, grad, prices, args.out)
+    write_material_impact(impact, engine, prices, args.movers)
+    print(f"[📊] 产品 {len(grad['rows'])} × 原料 {len(grad['cols'])}，非零梯度 {len(grad['val'])} 个；成本贡献前 {min(args.top, len(impact))} 的原料：")
+    for k, (mid, m) in enumerate(list(impact.items())[:args.top], 1):
+        print(f"  {k:>2}. {m['name']}  占比 {m['share'] * 100:.1f}%  影响 {m['products']} 个产品  单价 +1% → 全目录成本 +{m['cost'] / 100:.0f}")
+    
+    by_name = {m['name']: m['id'] for m in material_items}
+    rows = np.repeat(np.arange(len(grad["rows"])), np.diff(grad["ptr"]))
+    for key in args.material or ():
+        mid = key if key in engine.col_of else by_name.get(key)
+        if mid is None:
+            print(f"[⚠] 忽略未知物料: {key}")
+            continue
+        hit = np.flatnonzero(grad["col"] == engine.col_of[mid])
+        hit = hit[np.argsort(-grad["val"][hit], kind='stable')]
+        print(f"\n[📊] {engine.materials[engine.col_of[mid]]['name']} 单价每 +1，成本随之上涨的产品 {len(hit)} 个：")
+        for k in hit[:10]:
+            pid = grad["rows"][rows[k]]
+            print(f"  {recipe_data[pid]['name']}  +{grad['val'][k]:g}")
+        if len(hit) > 10:
+            print(f"  ... 其余 {len(hit) - 10} 个见 {args.out.name}")
+
+# --------------------  物价历史  --------------------
+def history_table(hist, engine, snaps, products, rate, fallback):
+    """各快照下指定产品的单件成本：历史单价矩阵 (快照 × 物料) 与展开 BOM 一次矩阵乘法求出
+
+    历史中从未记录（或已移除）的物料按 fallback（当前物料表单价）计。
+    """
+    prices = hist.price_matrix([m['name'] for m in engine.materials], [sn["id"] for sn in snaps])
+    missing = np.isnan(prices)
+    prices = np.where(missing, fallback, prices)
+    costs = engine.price_scenarios(prices, rate)
+    col = {pid: k for k, pid in enumerate(engine.products)}
+    return [{
+        "snapshot": sn["id"],
+        "ts": sn["ts"],
+        "costs": {pid: round(float(costs[i, col[pid]]), 2) for pid in products},
+    } for i, sn in enumerate(snaps)], int(missing.any(axis=0).sum())
+
+def write_history_table(table, recipes, out: Path):
+    """.json 原样输出；其他按 CSV 长表输出（每个 快照×产品 一行）"""
+    try:
+        out.parent.mkdir(parents=True, exist_ok=True)
+        if out.suffix.lower() == '.json':
+            out.write_text(json.dumps(table, ensure_ascii=False, indent=2), encoding='utf-8')
+        else:
+            rows = [{'快照': r['snapshot'], '时间': r['ts'], '产品编号': pid, '产品名称': recipes[pid]['name'], '成本': c}
+                    for r in table for pid, c in r['costs'].items()]
+            load_deps()
+            pd.DataFrame(rows).to_csv(out, index=False, encoding='utf-8-sig')
+        print(f"[✓] 成本走势已生成：{out.resolve()}")
+    except Exception as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+
+def run_history(args):
+    print("\n" + "="*60)
+    print("  AION 物价历史")
+    print("="*60)
+    from aion_cost import CostEngine
+    from aion_history import PriceHistory
+    if not CFG["HISTORY_DB"]:
+        print("[✗] 物价历史已关闭（--history 为空）")
+        fail()
+    material_items, recipe_data, name2id = load_data(input_manifest())
+    load_deps()
+    try:
+        hist = PriceHistory(history_db())
+    except OSError as e:
+        print(f"[✗] {e}")
+        fail()
+    try:
+        if args.at:
+            snap = hist.snapshot_at(args.at)
+            snaps = [snap] if snap else []
+        else:
+            snaps = hist.snapshots(args.since, args.until)
+    except ValueError as e:
+        print(f"[✗] 时间格式应为 ISO 日期或时间（如 2026-10-01 或 2026-10-01T12:00）: {e}")
+        fail()
+    if not snaps:
+        print("[✗] 指定时间内没有物价快照")
+        fail()
+    print(f"[✓] 物价快照 {len(snaps)} 个: #{snaps[0]['id']} {snaps[0]['ts']} ~ #{snaps[-1]['id']} {snaps[-1]['ts']}")
+    
+    products = []
+    for key in args.product or ():
+        pid = key if key in recipe_data else name2id.get(key)
+        if pid in recipe_data:
+            products.append(pid)
+        else:
+            print(f"[⚠] 忽略未知产品: {key}")
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 计算历史成本（成功率: {args.rate}%）")
+    print("="*60)
+    engine = CostEngine(recipe_data, material_items)
+    table, missing = history_table(hist, engine, snaps, products or list(recipe_data), args.rate, engine.price_vector())
+    hist.close()
+    if missing:
+        print(f"[⚠] {missing} 种物料在部分快照中无记录，按当前单价计")
+    write_history_table(table, recipe_data, args.out)
+    for pid in products[:10]:
+        series = [r['costs'][pid] for r in table]
+        print(f"  {recipe_data[pid]['name']}: {series[0]:.0f} → {series[-1]:.0f}（最低 {min(series):.0f}，最高 {max(series):.0f}）")
+
+# --------------------  多服务器批量构建  --------------------
+BATCH_SHARED = {}
+
+def dataset_names(paths) -> list:
+    """数据集名称取物料表文件名；文件名重复时（如 服务器A/aion-物料.csv）改用所在目录名"""
+    names = [p.stem for p in paths]
+    if len(set(names)) < len(names):
+        names = [p.parent.name for p in paths]
+    if len(set(names)) < len(names):
+        print("[✗] 无法区分物料表：文件名与所在目录名均有重复")
+        fail()
+    return names
+
+def batch_init(cfg: dict, groups: dict):
+    """进程池初始化：每个工作进程只接收一次配置与共用配方，避免随每个任务重复传输"""
+    CFG.update(cfg)
+    BATCH_SHARED.update(groups)
+
+def render_dataset(name, material_items, group, out: Path, rates):
+    """工作进程内渲染单个数据集的 HTML（及成本表），返回 (名称, 耗时, 输出字节数, 错误信息)"""
+    t0 = time.perf_counter()
+    recipe_data, sale = BATCH_SHARED[group]
+    CFG["HTML_OUT"] = str(out)
+    try:
+        with contextlib.redirect_stdout(io.StringIO()):
+            files = generate_html(material_items, recipe_data, sale)
+            if rates:
+                cost = out.with_suffix('.cost.csv')
+                write_price_table(price_table(material_items, recipe_data, {}, rates), cost)
+                files[cost] = ''
+        size = sum(p.stat().st_size for p in files)
+        return name, time.perf_counter() - t0, size, None
+    except (Exception, SystemExit) as e:
+        return name, time.perf_counter() - t0, 0, str(e) or type(e).__name__
+
+def run_batch(args):
+    print("\n" + "="*60)
+    print(f"  AION 多服务器批量构建（{len(args.materials)} 份物料表）")
+    print("="*60)
+    t_start = time.perf_counter()
+    load_deps()
+    names = dataset_names(args.materials)
+    
+    # BOM 只读取、展开与拓扑排序一次
+    print("\n" + "="*60)
+    print(f"[步骤1] 解析共用 BOM: {CFG['BOM_CSV']}")
+    print("="*60)
+    t0 = time.perf_counter()
+    parsed = parse_bom()
+    if parsed is None:
+        print("[✗] 配方数据为空")
+        fail()
+    rows, long = parsed
+    sorted_idx = topological_sort(rows['name'].tolist(), long)
+    t_bom = time.perf_counter() - t0
+    
+    # 物料表逐份解析；物料名称集合相同的服务器共用同一份组装结果
+    print("\n" + "="*60)
+    print("[步骤2] 解析物料表")
+    print("="*60)
+    datasets, groups, group_of, parse_time = [], {}, {}, {}
+    for name, path in zip(names, args.materials):
+        t0 = time.perf_counter()
+        items = []
+        for df in read_csv_chunks(path, {'原料名称', '制作职业', '来源', '单价'}):
+            items.extend(material_items(df))
+        base_map = {m['name']: m['id'] for m in items}
+        key = sha256_text(json.dumps(base_map, sort_keys=True, ensure_ascii=False))
+        if key not in group_of:
+            with contextlib.redirect_stdout(io.StringIO()):
+                recipes, name2id = assemble_recipes(rows, long, base_map, sorted_idx)
+            sale = load_sale_prices(Path(CFG["SALE_PRICES"]), recipes, name2id) if CFG["SALE_PRICES"] else None
+            group_of[key] = len(groups)
+            groups[group_of[key]] = (recipes, sale)
+        datasets.append((name, items, group_of[key]))
+        parse_time[name] = time.perf_counter() - t0
+    print(f"[✓] 物料表 {len(datasets)} 份，不同物料名称集合 {len(groups)} 组（每组组装一次配方）")
+    
+    print("\n" + "="*60)
+    jobs = max(1, args.jobs)
+    print(f"[步骤3] 并行生成（{jobs} 个进程）")
+    print("="*60)
+    out_dir = args.out_dir.resolve()
+    out_dir.mkdir(parents=True, exist_ok=True)
+    results = {}
+    from concurrent.futures import ProcessPoolExecutor, as_completed
+    with ProcessPoolExecutor(max_workers=jobs, initializer=batch_init, initargs=(CFG, groups)) as pool:
+        futures = [pool.submit(render_dataset, name, items, group, out_dir / f"{name}.html", args.rates)
+                   for name, items, group in datasets]
+        for f in as_completed(futures):
+            name, elapsed, size, err = f.result()
+            results[name] = (elapsed, size, err)
+            print(f"[{'✗' if err else '✓'}] {name}" + (f": {err}" if err else f"（{elapsed:.2f}s）"))
+    
+    print("\n" + "="*60)
+    print("[📊] 耗时汇总")
+    print("="*60)
+    print(f"  共用 BOM 解析 + 拓扑排序: {t_bom:.2f}s（{len(rows)} 行）")
+    print(f"  {'数据集':<16}{'物料解析':>10}{'生成':>10}{'输出':>12}")
+    for name in names:
+        elapsed, size, err = results[name]
+        print(f"  {name:<16}{parse_time[name]:>9.2f}s{elapsed:>9.2f}s" + ("      失败" if err else f"{size/1024:>10.1f}KB"))
+    failed = [n for n in names if results[n][2]]
+    print(f"  总耗时: {time.perf_counter() - t_start:.2f}s，成功 {len(names) - len(failed)} 份，输出目录: {out_dir}")
+    if failed:
+        print(f"[✗] {len(failed)} 份生成失败: {'、'.join(failed)}")
+        fail()
+
+# --------------------  数据快照导出  --------------------
+def run_snapshot(args):
+    print("\n" + "="*60)
+    print("  AION 数据快照导出")
+    print("="*60)
+    from aion_snapshot import save_snapshot
+    material_items, recipe_data, name2id = load_data(input_manifest(), args.force)
+    try:
+        args.out.parent.mkdir(parents=True, exist_ok=True)
+        save_snapshot(args.out, material_items, recipe_data, name2id)
+    except OSError as e:
+        print(f"[✗] 写入文件失败: {e}")
+        fail()
+    print(f"[✓] 快照已生成：{args.out.resolve()}")
+    print(f"[📊] 物料 {len(material_items)} 种，配方 {len(recipe_data)} 条，文件 {args.out.stat().st_size/1024:.1f} KB")
+
+def run_serve(args):
+    print("\n" + "="*60)
+    print("  AION 本地定价服务")
+    print("="*60)
+    import asyncio
+    from aion_server import PricingService
+    
+    def loader():
+        manifest = input_manifest()
+        material_items, recipe_data, name2id = load_data(manifest)
+        return {"materials": material_items, "recipes": recipe_data, "name2id": name2id, "bom": manifest["bom"]}
+    
+    service = PricingService(loader, search_index,
+                             watch=[Path(CFG["MATERIAL_CSV"]).resolve(), Path(CFG["BOM_CSV"]).resolve()],
+                             interval=args.interval)
+    service.data = service.load()
+    # 服务运行期间重载出错只记日志并保留旧数据，不能停下来等待回车
+    CFG["HEADLESS"] = True
+    
+    print("\n" + "="*60)
+    print(f"[步骤3] 启动 HTTP 服务（物料 {len(service.data.materials)} 种，配方 {len(service.data.recipes)} 条，Ctrl+C 停止）")
+    print("="*60)
+    try:
+        asyncio.run(service.serve(args.host, args.port))
+    except KeyboardInterrupt:
+        print("\n[✓] 定价服务已停止")
+    except OSError as e:
+        print(f"[✗] 无法监听 {args.host}:{args.port}: {e}")
+        fail()
 
 # --------------------  主流程  --------------------
-def main():
+def load_data(manifest: dict, force: bool = False):
+    """读取物料、配方与名称→编码映射
+    
+    两份 CSV 均未变时直接内存映射二进制快照（不加载 pandas / chardet）；
+    仅物料表变化且名称未变时复用配方快照，只重新解析物料表。
+    """
+    from aion_snapshot import load_snapshot
+    full = snapshot_path(manifest)
+    snap = None if force else load_snapshot(full)
+    if snap is not None:
+        print(f"\n[♻] CSV 未变化，载入二进制快照: {full.name}")
+        material_items = snap.material_items()
+        record_history(material_items)
+        return material_items, snap.recipes(), snap.name2id()
+    
+    material_items = convert_material()
+    base_map = {m['name']: m['id'] for m in material_items}
+    cache = recipe_cache_path(manifest, base_map)
+    snap = None if force else load_snapshot(cache)
+    if snap is not None:
+        recipe_data, name2id = snap.recipes(), snap.name2id()
+        print(f"\n[♻] BOM 未变化，复用已解析配方: {cache.name}（{len(recipe_data)} 条）")
+    else:
+        recipe_data, name2id = convert_bom(base_map)
+        save_cache_snapshot(cache, [], recipe_data, name2id)
+    save_cache_snapshot(full, material_items, recipe_data, name2id)
+    return material_items, recipe_data, name2id
+
+def run_build(args):
     print("\n" + "="*60)
     print("  AION 综合转换工具 v5.5  终极修复版")
     print("="*60)
@@ -1572,28 +3606,189 @@ def main():
     print(f"  - {CFG['HTML_OUT']}")
     print("="*60)
     
+    manifest = input_manifest()
+    if not args.force and is_up_to_date(load_manifest(), manifest):
+        print(f"\n[♻] 输入未变化，跳过生成: {Path(CFG['HTML_OUT']).resolve()}")
+        print("    如需强制重建请加 --force")
+    else:
+        build(manifest, args.force)
+
+def build(manifest: dict, force: bool = False):
+    """完整构建流程；BOM 与物料名称未变时复用缓存配方，仅重新生成物料数据"""
+    material_items, recipe_data, name2id = load_data(manifest, force)
+    sale = load_sale_prices(Path(CFG["SALE_PRICES"]), recipe_data, name2id) if CFG["SALE_PRICES"] else None
+    files = generate_html(material_items, recipe_data, sale)
+    save_manifest(manifest, files)
+    
+    print("\n" + "="*60)
+    print("[🎉] 全部完成！")
+    print("="*60)
+    print(f"\n📊 最终数据汇总:")
+    print(f"  ├─ 基础材料: {len(material_items)} 种")
+    print(f"  ├─ 产品配方: {len(recipe_data)} 条")
+    print(f"  ├─ 制作职业: {len(set(p['profession'] for p in recipe_data.values()))} 个")
+    print(f"  └─ 生成文件: {Path(CFG['HTML_OUT']).resolve()}")
+    print("\n🎯 下一步: 双击打开 index_generated.html 开始使用")
+    print("="*60)
+
+COMMANDS = ('build', 'batch', 'price', 'plan', 'rank', 'shop', 'expect', 'sensitivity', 'history', 'snapshot', 'serve')
+
+def success_rate(v):
+    rate = float(v)
+    if not 0 < rate <= 100:
+        raise argparse.ArgumentTypeError(f"成功率应在 (0, 100] 之间: {v}")
+    return int(rate) if rate.is_integer() else rate
+
+def success_rates(v):
+    return [success_rate(x) for x in v.split(',') if x.strip()]
+
+def user_path(v) -> Path:
+    return LAUNCH_DIR / v
+
+def parse_args(argv=None):
+    argv = sys.argv[1:] if argv is None else list(argv)
+    # 未指定命令时默认 build，兼容原有的直接运行方式
+    if not argv or (argv[0] not in COMMANDS and argv[0] not in ('-h', '--help')):
+        argv = ['build', *argv]
+    
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument('--material-csv', metavar='CSV', help=f'物料价格表（默认 {CFG["MATERIAL_CSV"]}）')
+    common.add_argument('--bom-csv', metavar='CSV', help=f'产品配方表（默认 {CFG["BOM_CSV"]}）')
+    common.add_argument('--chunksize', type=int, default=CFG["CHUNKSIZE"], metavar='N',
+                        help='按每块 N 行流式读取 CSV，适用于超大导出文件（默认整表读取）')
+    common.add_argument('--history', metavar='DB',
+                        help=f'物价历史库，解析物料表时追加本次单价（默认 {CFG["HISTORY_DB"]}，传空字符串关闭）')
+    common.add_argument('--headless', action='store_true',
+                        help='无人值守：不自动安装依赖、不等待回车（也可设置 AION_HEADLESS=1）')
+    
+    ap = argparse.ArgumentParser(description="AION 综合转换工具：物料/BOM CSV → 制作成本计算器 HTML / 成本表")
+    sub = ap.add_subparsers(dest='command', metavar='命令')
+    b = sub.add_parser('build', parents=[common], help='生成制作成本计算器 HTML（默认）')
+    b.add_argument('--force', action='store_true', help='忽略哈希清单，强制完整重建')
+    b.add_argument('--payload', choices=('compact', 'legacy'), default=CFG["PAYLOAD"],
+                   help='HTML 内嵌数据格式：compact 为字符串表 + 整数数组（默认），legacy 为缩进的完整对象')
+    b.add_argument('--output-mode', choices=('single', 'shards'), default=CFG["OUTPUT_MODE"],
+                   help='single 为单个 HTML（默认）；shards 为 HTML 外壳 + 按职业懒加载的数据分片目录')
+    b.add_argument('--sale-prices', metavar='FILE', help='产品售价（.json 或含 名称,售价 的 CSV），页面据此显示盈利排行')
+    a = sub.add_parser('batch', parents=[common], help='多服务器批量构建：共用 BOM 只解析一次，多份物料表并行生成')
+    a.add_argument('materials', type=user_path, nargs='+', metavar='物料CSV', help='各服务器的物料价格表')
+    a.add_argument('--out-dir', type=user_path, default='batch_out', metavar='DIR',
+                   help='输出目录（默认 batch_out），每份物料表生成 <名称>.html')
+    a.add_argument('-j', '--jobs', type=int, default=os.cpu_count() or 1, metavar='N', help='并行进程数（默认 CPU 核数）')
+    a.add_argument('--rates', type=success_rates, metavar='R1,R2', help='同时输出 <名称>.cost.csv 成本表，成功率列表如 100,50')
+    a.add_argument('--payload', choices=('compact', 'legacy'), default=CFG["PAYLOAD"], help='HTML 内嵌数据格式（同 build）')
+    a.add_argument('--output-mode', choices=('single', 'shards'), default=CFG["OUTPUT_MODE"], help='输出模式（同 build）')
+    a.add_argument('--sale-prices', metavar='FILE', help='产品售价（同 build），各服务器共用')
+    p = sub.add_parser('price', parents=[common], help='无界面批量定价，输出全部配方的成本表')
+    p.add_argument('--prices', type=user_path, metavar='FILE', help='单价覆盖表（.json 或含 原料名称,单价 的 CSV）')
+    p.add_argument('--rates', type=success_rates, default=[100], metavar='R1,R2', help='成功率列表（百分比），如 100,50,25')
+    p.add_argument('-o', '--out', type=user_path, default='cost_table.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    m = sub.add_parser('plan', parents=[common], help='自制/购买最优方案：中间品有市场价时择优买或做')
+    m.add_argument('--prices', type=user_path, metavar='FILE',
+                   help='单价覆盖表（.json 或含 原料名称,单价 的 CSV），可含产品名称/编号作为中间品市场价')
+    m.add_argument('--rates', type=success_rates, default=[100], metavar='R1,R2', help='成功率列表（百分比），如 100,50,25')
+    m.add_argument('-o', '--out', type=user_path, default='make_buy.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    r = sub.add_parser('rank', parents=[common], help='全部配方盈利排行（需提供售价）')
+    r.add_argument('--sale-prices', type=user_path, required=True, metavar='FILE',
+                   help='产品售价（.json 或含 名称,售价 的 CSV，可直接用加了 售价 列的 bom.csv）')
+    r.add_argument('--prices', type=user_path, metavar='FILE', help='单价覆盖表（.json 或含 原料名称,单价 的 CSV）')
+    r.add_argument('--rate', type=success_rate, default=100, metavar='R', help='成功率（百分比，默认 100）')
+    r.add_argument('--profession', action='append', metavar='职业', help='只看该制作职业（可重复）')
+    r.add_argument('--level', action='append', metavar='等级', help='只看该需求等级，如 专业10（可重复）')
+    r.add_argument('--sort', choices=tuple(RANK_KEYS), default='margin',
+                   help='排序：margin 利润（默认）、margin_pct 利润率、per_craft 每次制作期望利润')
+    r.add_argument('-o', '--out', type=user_path, default='profit_rank.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    q = sub.add_parser('shop', parents=[common], help='多产品合并采购清单（共用中间品合并后展开）')
+    q.add_argument('--order', action='append', metavar='产品=件数', help='要制作的产品名称或编号及件数（可重复）')
+    q.add_argument('--orders', type=user_path, metavar='FILE', help='制作清单（.json {名称或编号: 件数} 或含 名称,数量 的 CSV）')
+    q.add_argument('--prices', type=user_path, metavar='FILE', help='单价覆盖表（.json 或含 原料名称,单价 的 CSV）')
+    q.add_argument('--rate', type=success_rate, default=100, metavar='R', help='成功率（百分比，默认 100）')
+    q.add_argument('-o', '--out', type=user_path, default='shopping_list.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    e = sub.add_parser('expect', parents=[common], help='按配方成功率的期望成本、标准差与蒙特卡洛分位数')
+    e.add_argument('--rate-table', type=user_path, metavar='FILE',
+                   help='成功率表（.json 或含 名称,成功率 的 CSV；名称可为产品名称/编号或需求等级）')
+    e.add_argument('--default-rate', type=success_rate, default=100, metavar='R', help='成功率表未指定的配方的成功率（默认 100）')
+    e.add_argument('--prices', type=user_path, metavar='FILE', help='单价覆盖表（.json 或含 原料名称,单价 的 CSV）')
+    e.add_argument('--product', action='append', metavar='产品', help='只输出该产品名称或编号（可重复）')
+    e.add_argument('--samples', type=int, default=0, metavar='N',
+                   help=f'蒙特卡洛模拟次数，>0 时输出 {"/".join(f"P{q}" for q in PERCENTILES)} 成本分位数（默认不模拟）')
+    e.add_argument('--seed', type=int, metavar='N', help='蒙特卡洛随机种子（便于复现）')
+    e.add_argument('-o', '--out', type=user_path, default='expected_cost.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    g = sub.add_parser('sensitivity', parents=[common], help='单价敏感度：每个 产品×原料 的 d(成本)/d(单价) 稀疏矩阵与原料影响排行')
+    g.add_argument('--prices', type=user_path, metavar='FILE', help='单价覆盖表（.json 或含 原料名称,单价 的 CSV）')
+    g.add_argument('--rate', type=success_rate, default=100, metavar='R', help='成功率（百分比，默认 100）')
+    g.add_argument('--material', action='append', metavar='原料', help='列出该原料（名称或编号）涨价时受影响的产品（可重复）')
+    g.add_argument('--top', type=int, default=20, metavar='N', help='控制台显示成本贡献前 N 的原料（默认 20）')
+    g.add_argument('-o', '--out', type=user_path, default='sensitivity.csv', metavar='FILE',
+                   help='敏感度矩阵（.csv 为 产品×原料 三元组；.json 为 CSR 稀疏矩阵）')
+    g.add_argument('--movers', type=user_path, default='material_impact.csv', metavar='FILE', help='原料影响排行（.csv 或 .json）')
+    h = sub.add_parser('history', parents=[common], help='物价历史：计算产品在历史快照或时间段内的成本走势')
+    h.add_argument('--product', action='append', metavar='产品', help='产品名称或编号（可重复，默认全部产品）')
+    h.add_argument('--at', metavar='时间', help='只算该时刻生效的物价快照，如 2026-10-01 或 2026-10-01T12:00')
+    h.add_argument('--since', metavar='时间', help='时间段起点（只给日期时从当天 0 点起，含起点时生效的快照）')
+    h.add_argument('--until', metavar='时间', help='时间段终点（只给日期时含当天）')
+    h.add_argument('--rate', type=success_rate, default=100, metavar='R', help='成功率（百分比，默认 100）')
+    h.add_argument('-o', '--out', type=user_path, default='cost_history.csv', metavar='FILE', help='输出文件（.csv 或 .json）')
+    n = sub.add_parser('snapshot', parents=[common], help='导出二进制数据快照，供 aion_snapshot.load_snapshot 内存映射读取')
+    n.add_argument('--force', action='store_true', help='忽略缓存快照，重新解析 CSV')
+    n.add_argument('-o', '--out', type=user_path, default='aion.snap', metavar='FILE', help='输出文件（默认 aion.snap）')
+    v = sub.add_parser('serve', parents=[common], help='本地 HTTP 定价服务：JSON 接口查询成本、构成、BOM 树与搜索，CSV 变化时自动重载')
+    v.add_argument('--host', default='127.0.0.1', help='监听地址（默认 127.0.0.1，仅本机可访问）')
+    v.add_argument('--port', type=int, default=8765, help='监听端口（默认 8765）')
+    v.add_argument('--interval', type=float, default=1.0, metavar='SEC', help='检查 CSV 变化的间隔秒数（默认 1，0 为不监视）')
+    return ap.parse_args(argv)
+
+def main(argv=None):
+    args = parse_args(argv)
+    CFG["HEADLESS"] = CFG["HEADLESS"] or args.headless
+    if args.material_csv:
+        CFG["MATERIAL_CSV"] = str(user_path(args.material_csv))
+    if args.bom_csv:
+        CFG["BOM_CSV"] = str(user_path(args.bom_csv))
+    CFG["CHUNKSIZE"] = max(0, args.chunksize)
+    CFG["PAYLOAD"] = getattr(args, 'payload', CFG["PAYLOAD"])
+    CFG["OUTPUT_MODE"] = getattr(args, 'output_mode', CFG["OUTPUT_MODE"])
+    if args.history is not None:
+        CFG["HISTORY_DB"] = str(user_path(args.history)) if args.history else ""
+    if getattr(args, 'sale_prices', None):
+        CFG["SALE_PRICES"] = str(user_path(args.sale_prices))
+    
+    # 强制在脚本所在目录运行，防止路径问题
+    os.chdir(SCRIPT_DIR)
+    print(f"[📁] 当前工作目录: {Path.cwd()}")
+    # 无人值守时同样检查，缺少依赖直接以退出码 1 报告，而不是稍后抛 ImportError
+    check_and_install()
+    
     try:
-        material_items = convert_material()
-        recipe_data, _ = convert_bom({m['name']: m['id'] for m in material_items})
-        generate_html(material_items, recipe_data)
-        
-        print("\n" + "="*60)
-        print("[🎉] 全部完成！")
-        print("="*60)
-        print(f"\n📊 最终数据汇总:")
-        print(f"  ├─ 基础材料: {len(material_items)} 种")
-        print(f"  ├─ 产品配方: {len(recipe_data)} 条")
-        print(f"  ├─ 制作职业: {len(set(p['profession'] for p in recipe_data.values()))} 个")
-        print(f"  └─ 生成文件: {Path(CFG['HTML_OUT']).resolve()}")
-        print("\n🎯 下一步: 双击打开 index_generated.html 开始使用")
-        print("="*60)
-        
+        if args.command == 'price':
+            run_price(args)
+        elif args.command == 'shop':
+            run_shop(args)
+        elif args.command == 'rank':
+            run_rank(args)
+        elif args.command == 'batch':
+            run_batch(args)
+        elif args.command == 'expect':
+            run_expect(args)
+        elif args.command == 'history':
+            run_history(args)
+        elif args.command == 'sensitivity':
+            run_sensitivity(args)
+        elif args.command == 'plan':
+            run_plan(args)
+        elif args.command == 'snapshot':
+            run_snapshot(args)
+        elif args.command == 'serve':
+            run_serve(args)
+        else:
+            run_build(args)
     except Exception as e:
         print(f"\n[✗] 程序异常终止: {e}")
         traceback.print_exc()
-        input("\n按 Enter 退出...")
+        fail()
     
-    input("\n按 Enter 退出程序...")
+    pause("\n按 Enter 退出程序...")
+    return 0
 
 if __name__ == '__main__':
-    main()
\ No newline at end of file
+    sys.exit(main())